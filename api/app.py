@@ -3,33 +3,194 @@
 import os
 import logging
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import requests
+from routing import jsonlib, metrics
 from routing.router import Router
-from routing.summary import build_route_summary
+from routing.summary import build_route_summary, iter_route_summary
+from serving import accept_queue_depth
+import batch
+import compression
 
 app = Flask(__name__, static_folder="static", static_url_path="")
 CORS(app, resources={r"/*": {"origins": "*"}}, send_wildcard=True)
 OSRM_URL = os.environ.get('OSRM_URL', 'http://localhost:5000')
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', '500'))
+OSRM_PASSTHROUGH = os.environ.get('OSRM_PASSTHROUGH', 'true').lower() == 'true'
+PASSTHROUGH_CHUNK_SIZE = 64 * 1024
+# Аргументы Router, которые клиент не может передать параметрами запроса: это не опции OSRM.
+RESERVED_PARAMS = frozenset(['timeout'])
 router = Router(OSRM_URL)
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+compression_stats = compression.CompressionStats()
+# Эндпоинты, для которых собираются метрики, и метка сервиса для каждого.
+METRIC_SERVICES = {
+    'route': 'route',
+    'table': 'table',
+    'nearest': 'nearest',
+    'match': 'match',
+    'trip': 'trip',
+    'route_summary': 'summary',
+    'route_batch': 'batch'
+}
+api_metrics = metrics.Registry()
+requests_total = api_metrics.counter(
+    'osrm_api_requests_total', 'Запросы к API по сервисам и HTTP-статусам', ('service', 'status')
+)
+errors_total = api_metrics.counter(
+    'osrm_api_errors_total', 'Ответы API со статусом 4xx и 5xx', ('service', 'status')
+)
+osrm_seconds = api_metrics.histogram(
+    'osrm_api_osrm_seconds', 'Время запроса API, проведённое в ожидании OSRM', ('service',)
+)
+python_seconds = api_metrics.histogram(
+    'osrm_api_python_seconds', 'Время запроса API в Python: разбор, резюме, сериализация', ('service',)
+)
+compression_ratio = api_metrics.histogram(
+    'osrm_api_compression_ratio', 'Доля сжатого размера ответа от исходного', ('service', 'encoding'),
+    compression.RATIO_BUCKETS
+)
+compression_seconds = api_metrics.histogram(
+    'osrm_api_compression_seconds', 'Время сжатия ответа', ('service', 'encoding'),
+    compression.SECONDS_BUCKETS
+)
 
 
-def _call_osrm(method, *args, **kwargs):
-    """Вызывает OSRM и корректно передаёт код ошибки."""
+def _osrm_result(method, *args, **kwargs):
+    """Вызывает OSRM и возвращает пару (данные, HTTP-статус)."""
     try:
-        data = method(*args, **kwargs)
-        return jsonify(data), 200
+        return method(*args, **kwargs), 200
     except requests.HTTPError as exc:
         resp = exc.response
         try:
             payload = resp.json()
         except ValueError:
             payload = {'error': resp.text}
-        return jsonify(payload), resp.status_code
+        return payload, resp.status_code
+    except requests.RequestException as exc:
+        return {'error': str(exc)}, 502
+
+
+def _query_params(exclude):
+    """Возвращает параметры запроса для OSRM без служебных, первое значение побеждает."""
+    return {k: v for k, v in request.args.items() if k not in exclude and k not in RESERVED_PARAMS}
+
+
+def _json_response(data, status):
+    """Сериализует ответ быстрым бэкендом JSON, если он установлен."""
+    if jsonlib.FAST:
+        return Response(jsonlib.dumps(data), status=status, mimetype='application/json')
+    return jsonify(data), status
+
+
+def _call_osrm(method, *args, **kwargs):
+    """Вызывает OSRM и корректно передаёт код ошибки."""
+    data, status = _osrm_result(method, *args, **kwargs)
+    return _json_response(data, status)
+
+
+def _stream_upstream(upstream):
+    """Передаёт тело ответа OSRM клиенту по частям, не разбирая JSON."""
+
+    def generate():
+        try:
+            for chunk in upstream.iter_content(chunk_size=PASSTHROUGH_CHUNK_SIZE):
+                if chunk:
+                    yield chunk
+        finally:
+            upstream.close()
+
+    headers = {}
+    # requests распаковывает gzip при чтении, поэтому длину передаём только для несжатого тела.
+    if 'Content-Length' in upstream.headers and 'Content-Encoding' not in upstream.headers:
+        headers['Content-Length'] = upstream.headers['Content-Length']
+    return Response(
+        stream_with_context(generate()),
+        status=upstream.status_code,
+        headers=headers,
+        content_type=upstream.headers.get('Content-Type', 'application/json')
+    )
+
+
+def _proxy_osrm(service, points, params):
+    """Проксирует запрос к сервису OSRM, по возможности без разбора ответа."""
+    if not OSRM_PASSTHROUGH or not router.can_passthrough(service, points, params):
+        return _call_osrm(getattr(router, service), points, **params)
+    try:
+        upstream = router.raw_cached(service, points, **params)
     except requests.RequestException as exc:
         return jsonify({'error': str(exc)}), 502
+    return _stream_upstream(upstream)
+
+
+@app.before_request
+def start_metrics():
+    """Запоминает время начала запроса к сервису OSRM."""
+    if request.endpoint in METRIC_SERVICES:
+        g.metrics_started = time.perf_counter()
+        metrics.start_request()
+
+
+@app.after_request
+def record_metrics(response):
+    """Разделяет время запроса на ожидание OSRM и работу Python."""
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    total = time.perf_counter() - started
+    osrm = metrics.finish_request()
+    service = METRIC_SERVICES[request.endpoint]
+    status = str(response.status_code)
+    requests_total.inc((service, status))
+    if response.status_code >= 400:
+        errors_total.inc((service, status))
+    osrm_seconds.observe(osrm, (service,))
+    python_seconds.observe(max(0.0, total - osrm), (service,))
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Сжимает JSON-ответ потоком, если клиент это поддерживает.
+
+    Потоком сжимается уже готовое тело: ответы, собранные в Python, сначала
+    целиком сериализуются, и только ответы OSRM, отдаваемые как есть, не
+    держатся в памяти воркера полностью.
+    """
+    if not compression.COMPRESSION_ENABLED or request.method == 'HEAD':
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if not compression.is_compressible(response.mimetype):
+        return response
+    length = response.content_length
+    if length is not None and length < compression.COMPRESSION_MIN_SIZE:
+        return response
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    endpoint = request.endpoint or request.path
+
+    service = METRIC_SERVICES.get(endpoint, endpoint)
+
+    def on_done(bytes_in, bytes_out, seconds):
+        compression_stats.record(endpoint, encoding, bytes_in, bytes_out, seconds)
+        if bytes_in:
+            compression_ratio.observe(bytes_out / bytes_in, (service, encoding))
+        compression_seconds.observe(seconds, (service, encoding))
+
+    response.response = compression.compress_stream(response.iter_encoded(), encoding, on_done)
+    response.headers.pop('Content-Length', None)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
 # Конфигурация логгера, чтобы сообщения запуска сервера не попадали в error.
 logging.getLogger('werkzeug').setLevel(logging.INFO)
@@ -47,7 +208,7 @@ def route():
     if not start or not end:
         return jsonify({'error': 'start and end required'}), 400
     via_points = request.args.getlist('via')
-    params = {k: v for k, v in request.args.items() if k not in {'start', 'end', 'via'}}
+    params = _query_params({'start', 'end', 'via'})
     return _call_osrm(router.route, start, end, via=via_points or None, **params)
 
 
@@ -57,9 +218,8 @@ def table():
     coords = request.args.get('points')
     if not coords:
         return jsonify({'error': 'points required'}), 400
-    params = request.args.to_dict(flat=True)
-    params.pop('points', None)
-    return _call_osrm(router.table, coords, **params)
+    params = _query_params({'points'})
+    return _proxy_osrm('table', coords, params)
 
 
 @app.route('/nearest')
@@ -68,9 +228,8 @@ def nearest():
     coord = request.args.get('point')
     if not coord:
         return jsonify({'error': 'point required'}), 400
-    params = request.args.to_dict(flat=True)
-    params.pop('point', None)
-    return _call_osrm(router.nearest, coord, **params)
+    params = _query_params({'point'})
+    return _proxy_osrm('nearest', coord, params)
 
 
 @app.route('/match')
@@ -79,9 +238,8 @@ def match():
     coords = request.args.get('points')
     if not coords:
         return jsonify({'error': 'points required'}), 400
-    params = request.args.to_dict(flat=True)
-    params.pop('points', None)
-    return _call_osrm(router.match, coords, **params)
+    params = _query_params({'points'})
+    return _proxy_osrm('match', coords, params)
 
 
 @app.route('/trip')
@@ -90,12 +248,11 @@ def trip():
     coords = request.args.get('points')
     if not coords:
         return jsonify({'error': 'points required'}), 400
-    params = request.args.to_dict(flat=True)
-    params.pop('points', None)
-    return _call_osrm(router.trip, coords, **params)
+    params = _query_params({'points'})
+    return _proxy_osrm('trip', coords, params)
 
 
-def _route_summary(points, params):
+def _route_summary(points, params, include_route=True):
     """Формирует JSON с оригинальным ответом OSRM и кратким резюме."""
     coordinates = [coord for coord in points.split(';') if coord]
     if len(coordinates) >= 2:
@@ -106,12 +263,38 @@ def _route_summary(points, params):
     else:
         route_response = router.route_points(points, **params)
     summary = build_route_summary(route_response)
+    if not include_route:
+        return {'summary': summary}
     return {
         'route': route_response,
         'summary': summary
     }
 
 
+def _stream_route_summary(points, params):
+    """Отдаёт резюме построчно (NDJSON), разбирая ответ OSRM по участкам.
+
+    Ошибки OSRM передаются как есть, без запасного поиска и кэша.
+    """
+    try:
+        upstream = router.raw('route', points, **params)
+    except requests.RequestException as exc:
+        return jsonify({'error': str(exc)}), 502
+    if upstream.status_code != 200:
+        return _stream_upstream(upstream)
+
+    def generate():
+        try:
+            for item in iter_route_summary(upstream.iter_content(chunk_size=PASSTHROUGH_CHUNK_SIZE)):
+                yield jsonlib.dumps(item) + b'\n'
+        except (ValueError, requests.RequestException) as exc:
+            yield jsonlib.dumps({'error': str(exc)}) + b'\n'
+        finally:
+            upstream.close()
+
+    return Response(stream_with_context(generate()), status=200, content_type='application/x-ndjson')
+
+
 @app.route('/route/summary')
 def route_summary():
     """Возвращает краткое описание маршрута для Telegram-бота."""
@@ -130,10 +313,77 @@ def route_summary():
         coordinates.append(end)
         coord_string = ';'.join(coordinates)
 
-    params = {k: v for k, v in request.args.items() if k not in {'points', 'start', 'end', 'via'}}
+    params = _query_params({'points', 'start', 'end', 'via', 'include_route', 'stream'})
     params.setdefault('steps', 'true')
     params.setdefault('overview', 'false')
-    return _call_osrm(_route_summary, coord_string, params)
+    if request.args.get('stream', 'false').lower() == 'true':
+        return _stream_route_summary(coord_string, params)
+    include_route = request.args.get('include_route', 'true').lower() != 'false'
+    return _call_osrm(_route_summary, coord_string, params, include_route)
+
+def _batch_job(job, with_summary):
+    """Выполняет одно задание пакетного запроса и возвращает его результат.
+
+    Ошибка одного задания попадает только в его элемент ответа.
+    """
+    try:
+        start, end, via_points, params, summary = batch.parse_job(job, with_summary, RESERVED_PARAMS)
+    except batch.JobError as exc:
+        return {'status': 400, 'error': str(exc)}
+    try:
+        if summary:
+            params.setdefault('steps', 'true')
+            params.setdefault('overview', 'false')
+            coord_string = ';'.join([start] + via_points + [end])
+            data, status = _osrm_result(_route_summary, coord_string, params)
+        else:
+            data, status = _osrm_result(router.route, start, end, via=via_points or None, **params)
+    except Exception:
+        app.logger.exception('Batch job failed')
+        return {'status': 500, 'error': 'internal server error'}
+    if status != 200:
+        return {'status': status, 'error': data}
+    return {'status': status, 'result': data}
+
+
+@app.route('/route/batch', methods=['POST'])
+def route_batch():
+    """Строит маршруты для массива заданий параллельно, сохраняя порядок."""
+    jobs = request.get_json(silent=True)
+    if not isinstance(jobs, list):
+        return jsonify({'error': 'JSON array of jobs required'}), 400
+    if len(jobs) > BATCH_MAX_JOBS:
+        return jsonify({'error': 'too many jobs, limit is {}'.format(BATCH_MAX_JOBS)}), 413
+    with_summary = request.args.get('summary', 'false').lower() == 'true'
+    with metrics.osrm_time():
+        results = list(batch_executor.map(lambda job: _batch_job(job, with_summary), jobs))
+    for index, item in enumerate(results):
+        item['index'] = index
+    return jsonify({'results': results}), 200
+
+
+@app.route('/stats')
+def stats():
+    """Возвращает состояние пула соединений, кэшей, сжатия и очереди accept."""
+    return jsonify({
+        'pid': os.getpid(),
+        'osrm_pool': router.pool_stats(),
+        'cache': router.cache.stats(),
+        'snap_cache': router.snap_cache.stats(),
+        'coalescing': router.flights.stats(),
+        'graph': router.graph.stats() if router.graph is not None else {'loaded': False},
+        'rebuild': router.rebuilder.status(),
+        'compression': compression_stats.stats(),
+        'accept_queue': accept_queue_depth(int(os.environ.get('PORT', '5000')))
+    }), 200
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Отдаёт метрики API и клиента OSRM в текстовом формате Prometheus."""
+    body = api_metrics.render() + router.metrics.render()
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 def run_app():
     """Запускает сервер, учитывая переменную PORT."""
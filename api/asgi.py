@@ -0,0 +1,303 @@
+"""ASGI-версия API на асинхронном клиенте OSRM.
+
+Обслуживает те же эндпоинты, что и ``app.py``, но не блокирует поток на
+каждом запросе к OSRM, поэтому один процесс держит тысячи вызовов
+одновременно. Запуск: ``python3 asgi.py`` или ``uvicorn asgi:app``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+from routing import jsonlib, metrics
+from routing.async_router import AsyncRouter, OSRMHTTPError, TRANSPORT_ERRORS
+from routing.summary import build_route_summary
+import batch
+
+OSRM_URL = os.environ.get('OSRM_URL', 'http://localhost:5000')
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', '500'))
+STATIC_INDEX = Path(__file__).resolve().parent / 'static' / 'index.html'
+# Аргументы AsyncRouter, которые клиент не может передать параметрами запроса: это не опции OSRM.
+RESERVED_PARAMS = frozenset(['timeout'])
+
+router = AsyncRouter(OSRM_URL)
+logger = logging.getLogger(__name__)
+# Эндпоинты, для которых собираются метрики, и метка сервиса для каждого.
+METRIC_SERVICES = {
+    '/route': 'route',
+    '/table': 'table',
+    '/nearest': 'nearest',
+    '/match': 'match',
+    '/trip': 'trip',
+    '/route/summary': 'summary',
+    '/route/batch': 'batch'
+}
+api_metrics = metrics.Registry()
+requests_total = api_metrics.counter(
+    'osrm_api_requests_total', 'Запросы к API по сервисам и HTTP-статусам', ('service', 'status')
+)
+errors_total = api_metrics.counter(
+    'osrm_api_errors_total', 'Ответы API со статусом 4xx и 5xx', ('service', 'status')
+)
+request_seconds = api_metrics.histogram(
+    'osrm_api_request_seconds', 'Полное время запроса API', ('service',)
+)
+
+
+class Request:
+    """Минимальное представление HTTP-запроса ASGI."""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True)
+        self.body = body
+
+    def arg(self, name):
+        for key, value in self.query:
+            if key == name:
+                return value
+        return None
+
+    def args_list(self, name):
+        return [value for key, value in self.query if key == name]
+
+    def params(self, exclude):
+        """Возвращает параметры запроса без служебных, первое значение побеждает."""
+        params = {}
+        for key, value in self.query:
+            if key not in exclude and key not in RESERVED_PARAMS and key not in params:
+                params[key] = value
+        return params
+
+
+async def _osrm_result(coro):
+    """Ожидает вызов OSRM и возвращает пару (данные, HTTP-статус)."""
+    try:
+        return await coro, 200
+    except OSRMHTTPError as exc:
+        return exc.payload, exc.status
+    except TRANSPORT_ERRORS as exc:
+        return {'error': str(exc) or exc.__class__.__name__}, 502
+
+
+async def route(req):
+    start = req.arg('start')
+    end = req.arg('end')
+    if not start or not end:
+        return {'error': 'start and end required'}, 400
+    via_points = req.args_list('via')
+    params = req.params({'start', 'end', 'via'})
+    return await _osrm_result(router.route(start, end, via=via_points or None, **params))
+
+
+def _proxy(service, point_arg):
+    """Создаёт обработчик, передающий запрос сервису OSRM как есть."""
+
+    async def handler(req):
+        coords = req.arg(point_arg)
+        if not coords:
+            return {'error': '{} required'.format(point_arg)}, 400
+        params = req.params({point_arg})
+        return await _osrm_result(getattr(router, service)(coords, **params))
+
+    return handler
+
+
+async def _route_summary(points, params, include_route=True):
+    coordinates = [coord for coord in points.split(';') if coord]
+    if len(coordinates) >= 2:
+        route_response = await router.route(
+            coordinates[0], coordinates[-1], via=coordinates[1:-1] or None, **params
+        )
+    else:
+        route_response = await router.route_points(points, **params)
+    if not include_route:
+        return {'summary': build_route_summary(route_response)}
+    return {
+        'route': route_response,
+        'summary': build_route_summary(route_response)
+    }
+
+
+async def route_summary(req):
+    points = req.arg('points')
+    if points:
+        coord_string = points
+    else:
+        start = req.arg('start')
+        end = req.arg('end')
+        if not start or not end:
+            return {'error': 'points or start/end required'}, 400
+        coord_string = ';'.join([start] + req.args_list('via') + [end])
+    if (req.arg('stream') or 'false').lower() == 'true':
+        # Потоковый разбор идёт по блокирующему ответу requests, его есть только в app.py.
+        return {'error': 'stream=true is not supported by the ASGI server'}, 400
+    params = req.params({'points', 'start', 'end', 'via', 'include_route', 'stream'})
+    params.setdefault('steps', 'true')
+    params.setdefault('overview', 'false')
+    include_route = (req.arg('include_route') or 'true').lower() != 'false'
+    return await _osrm_result(_route_summary(coord_string, params, include_route))
+
+
+async def _batch_job(job, with_summary, semaphore):
+    try:
+        start, end, via_points, params, summary = batch.parse_job(job, with_summary, RESERVED_PARAMS)
+    except batch.JobError as exc:
+        return {'status': 400, 'error': str(exc)}
+    try:
+        async with semaphore:
+            if summary:
+                params.setdefault('steps', 'true')
+                params.setdefault('overview', 'false')
+                coord_string = ';'.join([start] + via_points + [end])
+                data, status = await _osrm_result(_route_summary(coord_string, params))
+            else:
+                data, status = await _osrm_result(
+                    router.route(start, end, via=via_points or None, **params)
+                )
+    except Exception:
+        logger.exception('Batch job failed')
+        return {'status': 500, 'error': 'internal server error'}
+    if status != 200:
+        return {'status': status, 'error': data}
+    return {'status': status, 'result': data}
+
+
+async def route_batch(req):
+    try:
+        jobs = json.loads(req.body.decode('utf-8')) if req.body else None
+    except ValueError:
+        jobs = None
+    if not isinstance(jobs, list):
+        return {'error': 'JSON array of jobs required'}, 400
+    if len(jobs) > BATCH_MAX_JOBS:
+        return {'error': 'too many jobs, limit is {}'.format(BATCH_MAX_JOBS)}, 413
+    with_summary = (req.arg('summary') or 'false').lower() == 'true'
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    results = await asyncio.gather(*[_batch_job(job, with_summary, semaphore) for job in jobs])
+    for index, item in enumerate(results):
+        item['index'] = index
+    return {'results': results}, 200
+
+
+async def stats(req):
+    """Возвращает состояние пула соединений и кэшей процесса."""
+    return {
+        'pid': os.getpid(),
+        'osrm_pool': router.pool_stats(),
+        'cache': router.cache.stats(),
+        'snap_cache': router.snap_cache.stats()
+    }, 200
+
+
+ROUTES = {
+    ('GET', '/route'): route,
+    ('GET', '/table'): _proxy('table', 'points'),
+    ('GET', '/nearest'): _proxy('nearest', 'point'),
+    ('GET', '/match'): _proxy('match', 'points'),
+    ('GET', '/trip'): _proxy('trip', 'points'),
+    ('GET', '/route/summary'): route_summary,
+    ('POST', '/route/batch'): route_batch,
+    ('GET', '/stats'): stats,
+}
+
+
+async def _read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def _send(send, status, body, content_type, extra_headers=()):
+    headers = [
+        (b'content-type', content_type),
+        (b'content-length', str(len(body)).encode('ascii')),
+        (b'access-control-allow-origin', b'*'),
+    ]
+    headers.extend(extra_headers)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await router.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """Точка входа ASGI."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    req = Request(scope, await _read_body(receive))
+    if req.method == 'OPTIONS':
+        await _send(send, 204, b'', b'text/plain', [
+            (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+            (b'access-control-allow-headers', b'content-type'),
+        ])
+        return
+    if req.method == 'GET' and req.path == '/':
+        await _send(send, 200, STATIC_INDEX.read_bytes(), b'text/html; charset=utf-8')
+        return
+    if req.method == 'GET' and req.path == '/metrics':
+        body = api_metrics.render() + router.metrics.render()
+        await _send(send, 200, body.encode('utf-8'), b'text/plain; version=0.0.4; charset=utf-8')
+        return
+
+    started = time.perf_counter()
+    handler = ROUTES.get((req.method, req.path))
+    if handler is None:
+        known_path = any(path == req.path for _, path in ROUTES)
+        status = 405 if known_path else 404
+        payload = {'error': 'method not allowed' if known_path else 'not found'}
+    else:
+        try:
+            payload, status = await handler(req)
+        except Exception:
+            logger.exception('Unhandled error in %s', req.path)
+            payload, status = {'error': 'internal server error'}, 500
+    await _send(send, status, jsonlib.dumps(payload), b'application/json')
+    service = METRIC_SERVICES.get(req.path) if handler is not None else None
+    if service is not None:
+        requests_total.inc((service, str(status)))
+        if status >= 400:
+            errors_total.inc((service, str(status)))
+        request_seconds.observe(time.perf_counter() - started, (service,))
+
+
+def run_asgi():
+    """Запускает ASGI-сервер uvicorn, учитывая переменную PORT."""
+    import uvicorn
+
+    port = int(os.environ.get('PORT', '5000'))
+    handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level='info')
+
+
+if __name__ == '__main__':
+    run_asgi()
@@ -0,0 +1,44 @@
+"""Разбор заданий пакетного запроса /route/batch, общий для Flask и ASGI."""
+
+
+class JobError(ValueError):
+    """Задание пакета составлено неверно; текст уходит клиенту со статусом 400."""
+
+
+def parse_flag(value, default):
+    """Разбирает флаг задания: bool или строку, как у параметров запроса (``true`` — истина)."""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    raise JobError('summary must be a boolean')
+
+
+def parse_job(job, with_summary, reserved=()):
+    """Проверяет задание и возвращает (start, end, via, params, summary).
+
+    Начало, конец и каждая промежуточная точка должны быть строками
+    ``lon,lat``; иначе, как и при других ошибках, бросается ``JobError``.
+    """
+    if not isinstance(job, dict):
+        raise JobError('job must be an object')
+    start = job.get('start')
+    end = job.get('end')
+    if not start or not end:
+        raise JobError('start and end required')
+    via_points = job.get('via') or []
+    if isinstance(via_points, str):
+        via_points = [via_points]
+    if not isinstance(via_points, list):
+        raise JobError('via must be a string or an array of strings')
+    for point in [start, end] + via_points:
+        if not isinstance(point, str) or not point:
+            raise JobError('points must be "lon,lat" strings')
+    params = job.get('params') or {}
+    if not isinstance(params, dict):
+        raise JobError('params must be an object')
+    params = {str(k): str(v) for k, v in params.items() if str(k) not in reserved}
+    summary = parse_flag(job.get('summary'), with_summary)
+    return start, end, via_points, params, summary
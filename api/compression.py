@@ -0,0 +1,173 @@
+"""Сжатие ответов API: выбор кодировки, потоковое сжатие и статистика."""
+
+import os
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli необязателен
+    brotli = None
+
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION', 'true').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+# Размер куска несжатого тела, который подаётся компрессору за раз.
+COMPRESSION_CHUNK_SIZE = 64 * 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+# Границы гистограмм метрик сжатия: доля сжатого размера от исходного и время компрессора.
+RATIO_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0)
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def available_encodings():
+    """Возвращает кодировки в порядке предпочтения сервера."""
+    if brotli is not None:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+def negotiate(accept_encoding, encodings=None):
+    """Выбирает кодировку по заголовку Accept-Encoding или возвращает None.
+
+    Учитываются веса ``q``: кодировка с ``q=0`` запрещена, ``*`` разрешает
+    все остальные. При равных весах побеждает порядок ``encodings``.
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+    best = None
+    best_weight = 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(mimetype):
+    """Проверяет, стоит ли сжимать ответ с таким типом содержимого."""
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+class _GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def make_encoder(encoding):
+    """Создаёт потоковый компрессор для кодировки ``gzip`` или ``br``."""
+    if encoding == 'gzip':
+        return _GzipEncoder(GZIP_LEVEL)
+    if encoding == 'br' and brotli is not None:
+        return _BrotliEncoder(BROTLI_QUALITY)
+    raise ValueError('unsupported encoding: {}'.format(encoding))
+
+
+def compress_stream(chunks, encoding, on_done=None, chunk_size=COMPRESSION_CHUNK_SIZE):
+    """Сжимает поток кусков, отдавая сжатые данные по мере готовности.
+
+    Большие куски режутся на части по ``chunk_size``, поэтому в памяти
+    одновременно находится только текущая часть и её сжатый результат.
+    По завершении вызывается ``on_done(bytes_in, bytes_out, seconds)``;
+    исходный итератор закрывается, даже если клиент оборвал передачу.
+    """
+    encoder = make_encoder(encoding)
+    bytes_in = 0
+    bytes_out = 0
+    seconds = 0.0
+    try:
+        for chunk in chunks:
+            view = memoryview(chunk)
+            for offset in range(0, len(view), chunk_size):
+                piece = view[offset:offset + chunk_size]
+                started = time.perf_counter()
+                out = encoder.process(piece.tobytes())
+                seconds += time.perf_counter() - started
+                bytes_in += len(piece)
+                if out:
+                    bytes_out += len(out)
+                    yield out
+        started = time.perf_counter()
+        out = encoder.finish()
+        seconds += time.perf_counter() - started
+        bytes_out += len(out)
+        if out:
+            yield out
+        if on_done is not None:
+            on_done(bytes_in, bytes_out, seconds)
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class CompressionStats:
+    """Потокобезопасные счётчики сжатия по эндпоинтам."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, encoding, bytes_in, bytes_out, seconds):
+        with self._lock:
+            item = self._endpoints.get(endpoint)
+            if item is None:
+                item = self._endpoints[endpoint] = {
+                    'responses': 0,
+                    'bytes_in': 0,
+                    'bytes_out': 0,
+                    'seconds': 0.0,
+                    'encodings': {}
+                }
+            item['responses'] += 1
+            item['bytes_in'] += bytes_in
+            item['bytes_out'] += bytes_out
+            item['seconds'] += seconds
+            item['encodings'][encoding] = item['encodings'].get(encoding, 0) + 1
+
+    def stats(self):
+        """Возвращает копию счётчиков со степенью сжатия по каждому эндпоинту."""
+        with self._lock:
+            result = {}
+            for endpoint, item in self._endpoints.items():
+                entry = dict(item, encodings=dict(item['encodings']))
+                entry['ratio'] = round(item['bytes_out'] / item['bytes_in'], 4) if item['bytes_in'] else None
+                entry['seconds'] = round(item['seconds'], 6)
+                result[endpoint] = entry
+            return result
@@ -0,0 +1,28 @@
+"""Конфигурация gunicorn для промышленного запуска API.
+
+Мастер-процесс форкает воркеры заранее; по сигналу HUP воркеры
+перезапускаются по одному, не прерывая обслуживание запросов.
+"""
+
+import multiprocessing
+import os
+
+
+def default_workers():
+    """Число воркеров по умолчанию: 2 × ядра + 1."""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+bind = "0.0.0.0:{}".format(os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+backlog = int(os.environ.get('GUNICORN_BACKLOG', '2048'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = 'info'
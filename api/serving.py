@@ -0,0 +1,35 @@
+"""Сведения о серверном сокете API."""
+
+import os
+
+
+_PROC_TCP_TABLES = ('/proc/net/tcp', '/proc/net/tcp6')
+_TCP_LISTEN = '0A'
+
+
+def accept_queue_depth(port, tables=_PROC_TCP_TABLES):
+    """Возвращает глубину очереди accept слушающего сокета на порту.
+
+    Для сокетов в состоянии LISTEN ядро Linux показывает в rx_queue число
+    соединений, ожидающих accept. Если таблицы недоступны (не Linux) или
+    порт никто не слушает, возвращается None.
+    """
+    found = False
+    queued = 0
+    for table in tables:
+        if not os.path.exists(table):
+            continue
+        with open(table) as handle:
+            next(handle, None)
+            for line in handle:
+                fields = line.split()
+                if len(fields) < 5 or fields[3] != _TCP_LISTEN:
+                    continue
+                local_port = int(fields[1].rsplit(':', 1)[1], 16)
+                if local_port != port:
+                    continue
+                queued += int(fields[4].split(':')[1], 16)
+                found = True
+    if not found:
+        return None
+    return {'port': port, 'queued': queued}
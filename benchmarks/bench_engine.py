@@ -0,0 +1,122 @@
+"""Бенчмарк локального поиска путей ``routing.engine`` против OSRM.
+
+Берёт случайные пары узлов графа, строит маршруты двунаправленным
+Дейкстрой, A* и CH и, если указан ``--osrm``, тем же парам координат
+запрашивает ``/route`` у osrm-routed. Показывает задержки (p50/p95),
+время предобработки CH и расхождение длительностей с OSRM.
+
+Запуск на графе области:
+``python benchmarks/bench_engine.py data/odessa_oblast.graph --osrm http://localhost:5000 [--pairs 200] [--json out.json]``.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from routing.engine import ShortestPathEngine  # noqa: E402
+from routing.graph import Graph  # noqa: E402
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else None
+
+
+def _timings(values):
+    return {
+        'p50_ms': round(_percentile(values, 0.5) * 1000, 3),
+        'p95_ms': round(_percentile(values, 0.95) * 1000, 3),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3)
+    }
+
+
+def _osrm_route(session, base_url, start, end):
+    url = '{}/route/v1/driving/{:.6f},{:.6f};{:.6f},{:.6f}'.format(base_url.rstrip('/'), *(start + end))
+    started = time.perf_counter()
+    payload = session.get(url, params={'overview': 'false'}, timeout=60).json()
+    elapsed = time.perf_counter() - started
+    if payload.get('code') != 'Ok':
+        return elapsed, None
+    return elapsed, payload['routes'][0]['duration']
+
+
+def run(graph_path, pairs, algorithms, osrm_url=None, seed=1):
+    graph = Graph().load(graph_path)
+    engine = ShortestPathEngine(graph)
+    results = {'graph': graph.stats(), 'pairs': pairs}
+    if 'ch' in algorithms:
+        started = time.perf_counter()
+        ch = engine.prepare_ch()
+        results['ch'] = {'prepare_s': round(time.perf_counter() - started, 2), 'shortcuts': ch.shortcut_count}
+
+    rng = random.Random(seed)
+    nodes = [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(pairs)]
+    durations = {}
+    for algorithm in algorithms:
+        elapsed = []
+        found = []
+        for source, target in nodes:
+            started = time.perf_counter()
+            path = engine.shortest_path(source, target, algorithm)
+            elapsed.append(time.perf_counter() - started)
+            found.append(None if path is None else path[0])
+        durations[algorithm] = found
+        results.setdefault('algorithms', {})[algorithm] = dict(
+            _timings(elapsed), reachable=sum(value is not None for value in found)
+        )
+
+    if osrm_url:
+        session = requests.Session()
+        elapsed = []
+        deviations = []
+        reference = durations[algorithms[0]]
+        for (source, target), local in zip(nodes, reference):
+            start = (float(graph.lon[source]), float(graph.lat[source]))
+            end = (float(graph.lon[target]), float(graph.lat[target]))
+            seconds, duration = _osrm_route(session, osrm_url, start, end)
+            elapsed.append(seconds)
+            if duration and local:
+                deviations.append(abs(local - duration) / duration)
+        results['osrm'] = _timings(elapsed)
+        if deviations:
+            results['osrm']['duration_deviation_p50'] = round(_percentile(deviations, 0.5), 4)
+            results['osrm']['duration_deviation_p95'] = round(_percentile(deviations, 0.95), 4)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('graph', help='каталог *.graph, выгрузка OSM или путь *.osrm')
+    parser.add_argument('--osrm', help='URL osrm-routed для сравнения')
+    parser.add_argument('--pairs', type=int, default=200)
+    parser.add_argument('--algorithms', default='dijkstra,astar,ch')
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    args = parser.parse_args()
+
+    results = run(args.graph, args.pairs, args.algorithms.split(','), args.osrm)
+    print('{nodes} nodes, {edges} edges'.format(**results['graph']))
+    if 'ch' in results:
+        print('ch: prepared in {prepare_s} s, {shortcuts} shortcuts'.format(**results['ch']))
+    for algorithm, stats in results['algorithms'].items():
+        print('{}: p50 {p50_ms} ms, p95 {p95_ms} ms, {reachable}/{pairs} reachable'.format(
+            algorithm, pairs=args.pairs, **stats))
+    if 'osrm' in results:
+        print('osrm /route: p50 {p50_ms} ms, p95 {p95_ms} ms'.format(**results['osrm']))
+        if 'duration_deviation_p50' in results['osrm']:
+            print('duration deviation vs osrm: p50 {duration_deviation_p50:.2%}, '
+                  'p95 {duration_deviation_p95:.2%}'.format(**results['osrm']))
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Нагрузочный бенчмарк Flask API против заглушки OSRM.
+
+API запускается отдельным процессом (встроенный многопоточный сервер
+werkzeug) и обращается к ``stub_osrm.StubOSRMServer`` с заданной задержкой
+и размером ответов. Для каждого сценария — ``route``, ``summary``,
+``table`` и ``fallback`` (запасной поиск по ближайшим точкам) — клиент
+шлёт запросы с фиксированной параллельностью и считает пропускную
+способность, задержки p50/p95/p99, процессорное время и память процесса
+API на запрос (по ``/proc``, только Linux).
+
+Кэши Router по умолчанию отключены, чтобы каждый запрос доходил до OSRM.
+
+Запуск::
+
+    python benchmarks/bench_load.py --requests 500 --concurrency 16 --latency-ms 5 --json bench.json
+    python benchmarks/bench_load.py --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_osrm import StubConfig, StubOSRMServer  # noqa: E402
+
+SCENARIOS = ('route', 'summary', 'table', 'fallback')
+
+_SERVE_SNIPPET = """
+import logging
+import sys
+from werkzeug.serving import make_server
+import app
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+make_server('127.0.0.1', int(sys.argv[1]), app.app, threaded=True).serve_forever()
+"""
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _point(index, lon=30.7, lat=46.4):
+    """Уникальная точка для запроса, чтобы запросы не объединялись и не попадали в кэш."""
+    return '{:.5f},{:.5f}'.format(lon + (index % 997) * 1e-3, lat + (index // 997) * 1e-3)
+
+
+def scenario_url(name, index, table_size, waypoints):
+    """Возвращает путь запроса сценария ``name`` с номером ``index``."""
+    if name == 'route':
+        return '/route?start={}&end={}&steps=true'.format(_point(index), _point(index + 1, lat=46.5))
+    if name == 'summary':
+        points = [_point(index + i, lat=46.4 + i * 0.01) for i in range(waypoints)]
+        return '/route/summary?points={}'.format(';'.join(points))
+    if name == 'table':
+        points = [_point(index + i, lat=46.4 + i * 0.001) for i in range(table_size)]
+        return '/table?points={}'.format(';'.join(points))
+    if name == 'fallback':
+        return '/route?start={}&end={}'.format(_point(index, lon=0.1), _point(index + 1, lat=46.5))
+    raise ValueError('unknown scenario: {}'.format(name))
+
+
+def percentile(sorted_values, fraction):
+    """Процентиль по методу ближайшего ранга."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def process_usage(pid):
+    """Возвращает процессорное время (с) и память (кБ) процесса или None вне Linux."""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as handle:
+            fields = handle.read().rsplit(')', 1)[1].split()
+        with open('/proc/{}/status'.format(pid)) as handle:
+            status = dict(line.split(':', 1) for line in handle if ':' in line)
+    except (IOError, OSError):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    return {
+        'cpu_seconds': (int(fields[11]) + int(fields[12])) / float(ticks),
+        'rss_kb': int(status.get('VmRSS', '0 kB').split()[0]),
+        'peak_rss_kb': int(status.get('VmHWM', '0 kB').split()[0])
+    }
+
+
+def _reset_peak_rss(pid):
+    try:
+        with open('/proc/{}/clear_refs'.format(pid), 'w') as handle:
+            handle.write('5')
+    except (IOError, OSError):
+        pass
+
+
+class ApiProcess:
+    """Процесс Flask API, направленный на заглушку OSRM."""
+
+    def __init__(self, osrm_url, cache=False):
+        self.port = _free_port()
+        env = dict(os.environ)
+        env['OSRM_URL'] = osrm_url
+        env['OSRM_DATA'] = os.path.join(ROOT, 'data', 'bench-missing.osrm')
+        env['PYTHONPATH'] = os.pathsep.join([ROOT, os.path.join(ROOT, 'api')])
+        if not cache:
+            env['OSRM_CACHE_SIZE'] = '0'
+            env['OSRM_SNAP_CACHE_SIZE'] = '0'
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', _SERVE_SNIPPET, str(self.port)],
+            cwd=os.path.join(ROOT, 'api'), env=env
+        )
+        self.url = 'http://127.0.0.1:{}'.format(self.port)
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('API process exited with code {}'.format(self.process.returncode))
+            try:
+                if requests.get(self.url + '/stats', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                time.sleep(0.1)
+        raise RuntimeError('API did not start in {} s'.format(timeout))
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def run_scenario(api, name, count, concurrency, warmup, table_size, waypoints):
+    """Прогоняет сценарий и возвращает его статистику."""
+    local = threading.local()
+
+    def fetch(index):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        url = api.url + scenario_url(name, index, table_size, waypoints)
+        started = time.perf_counter()
+        try:
+            response = session.get(url, timeout=60)
+            response.content
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fetch, range(100000, 100000 + warmup)))
+        _reset_peak_rss(api.process.pid)
+        before = process_usage(api.process.pid)
+        started = time.perf_counter()
+        results = list(executor.map(fetch, range(count)))
+        elapsed = time.perf_counter() - started
+        after = process_usage(api.process.pid)
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    stats = {
+        'requests': count,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput_rps': round(count / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'cpu_ms_per_request': None,
+        'rss_kb': None,
+        'peak_rss_kb': None
+    }
+    if before is not None and after is not None and count:
+        stats['cpu_ms_per_request'] = round((after['cpu_seconds'] - before['cpu_seconds']) / count * 1000, 3)
+        stats['rss_kb'] = after['rss_kb']
+        stats['peak_rss_kb'] = after['peak_rss_kb']
+        stats['rss_growth_kb_per_request'] = round((after['rss_kb'] - before['rss_kb']) / float(count), 3)
+    return stats
+
+
+def _git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def run(args):
+    config = StubConfig(args.latency_ms, args.steps, args.geometry_points)
+    stub = StubOSRMServer(('127.0.0.1', 0), config).start()
+    api = ApiProcess(stub.url, cache=args.cache)
+    try:
+        api.wait_ready()
+        scenarios = {}
+        for name in args.scenarios:
+            scenarios[name] = run_scenario(
+                api, name, args.requests, args.concurrency, args.warmup, args.table_size, args.waypoints
+            )
+    finally:
+        api.stop()
+        stub.shutdown()
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'latency_ms': args.latency_ms,
+            'steps': args.steps,
+            'geometry_points': args.geometry_points,
+            'table_size': args.table_size,
+            'waypoints': args.waypoints,
+            'cache': args.cache
+        },
+        'scenarios': scenarios
+    }
+
+
+def compare(current, baseline):
+    """Возвращает строки сравнения с прошлым прогоном в процентах."""
+    lines = []
+    for name, stats in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        parts = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'cpu_ms_per_request'):
+            if stats.get(key) is None or not old.get(key):
+                continue
+            change = (stats[key] - old[key]) / old[key] * 100
+            parts.append('{} {:+.1f}%'.format(key, change))
+        lines.append('{:<9} {}'.format(name, '  '.join(parts)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=300, help='запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='задержка заглушки OSRM')
+    parser.add_argument('--steps', type=int, default=10, help='шагов на участок маршрута')
+    parser.add_argument('--geometry-points', type=int, default=0, help='точек в геометрии маршрута')
+    parser.add_argument('--table-size', type=int, default=50, help='точек в запросе /table')
+    parser.add_argument('--waypoints', type=int, default=5, help='точек в запросе /route/summary')
+    parser.add_argument('--cache', action='store_true', help='не отключать кэши Router')
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    parser.add_argument('--compare', help='сравнить с результатами из файла JSON')
+    args = parser.parse_args()
+
+    results = run(args)
+    print('commit {}  concurrency {}  latency {} ms'.format(
+        results['meta']['commit'], args.concurrency, args.latency_ms))
+    for name, stats in results['scenarios'].items():
+        print('{:<9} {:>8.1f} rps  p50 {:>8.3f}  p95 {:>8.3f}  p99 {:>8.3f} ms  cpu {} ms/req  errors {}'.format(
+            name, stats['throughput_rps'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+            stats['cpu_ms_per_request'], stats['errors']))
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        print('vs {}'.format(baseline.get('meta', {}).get('commit')))
+        for line in compare(results, baseline):
+            print(line)
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Сравнение путей проксирования ответов OSRM через Flask API.
+
+Запросы идут через тестовый клиент Flask, а ответ OSRM подставляется
+заранее сериализованными байтами, так что измеряется только работа Python:
+
+- ``legacy`` — разбор ``resp.json()`` и ``jsonify``, как до прямой передачи;
+- ``fast_json`` — разбор и сериализация через ``routing.jsonlib`` (orjson, если установлен);
+- ``passthrough`` — потоковая передача байтов OSRM без разбора.
+
+Запуск: ``python benchmarks/bench_proxy.py [--size 500] [--repeat 20] [--json out.json]``.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+
+import app as app_module  # noqa: E402
+from routing import jsonlib  # noqa: E402
+from routing.cache import ResponseCache  # noqa: E402
+
+
+class _CannedResponse:
+    """Ответ requests с заранее сериализованным телом."""
+
+    def __init__(self, body):
+        self.content = body
+        self.status_code = 200
+        self.headers = {'Content-Type': 'application/json; charset=UTF-8', 'Content-Length': str(len(body))}
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def raise_for_status(self):
+        return None
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        return None
+
+
+def table_payload(size):
+    """Матрица size × size, как у /table с annotations=duration,distance."""
+    row = [float(i) * 1.5 for i in range(size)]
+    return {
+        'code': 'Ok',
+        'durations': [row for _ in range(size)],
+        'distances': [row for _ in range(size)],
+        'sources': [{'location': [30.7, 46.4], 'name': 'Дерибасовская'} for _ in range(size)],
+        'destinations': [{'location': [30.7, 46.4], 'name': 'Пушкинская'} for _ in range(size)]
+    }
+
+
+def route_payload(points):
+    """Маршрут с overview=full&geometries=geojson из points точек."""
+    coordinates = [[30.7 + i * 1e-5, 46.4 + i * 1e-5] for i in range(points)]
+    return {
+        'code': 'Ok',
+        'routes': [{'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                    'distance': 12345.6, 'duration': 1234.5, 'legs': []}],
+        'waypoints': []
+    }
+
+
+def _measure(client, url, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        body = response.get_data()
+        timings.append(time.perf_counter() - started)
+        size = len(body)
+    timings.sort()
+    return {
+        'median_ms': round(timings[len(timings) // 2] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'bytes': size
+    }
+
+
+def run(size, route_points, repeat):
+    app_module.router.cache = ResponseCache(max_entries=0)
+    client = app_module.app.test_client()
+    cases = {
+        'table': ('/table?points=1,1;2,2', jsonlib.dumps(table_payload(size))),
+        'trip': ('/trip?points=1,1;2,2&overview=full&geometries=geojson',
+                 jsonlib.dumps(route_payload(route_points)))
+    }
+    modes = {
+        'legacy': {'OSRM_PASSTHROUGH': False, 'orjson': None},
+        'fast_json': {'OSRM_PASSTHROUGH': False},
+        'passthrough': {'OSRM_PASSTHROUGH': True}
+    }
+    results = {'fast_json_backend': 'orjson' if jsonlib.FAST else 'json', 'cases': {}}
+    for case, (url, body) in cases.items():
+        results['cases'][case] = {}
+        for mode, settings in modes.items():
+            patches = [
+                patch('routing.router.requests.Session.get', return_value=_CannedResponse(body)),
+                patch.object(app_module, 'OSRM_PASSTHROUGH', settings['OSRM_PASSTHROUGH'])
+            ]
+            if 'orjson' in settings:
+                patches.append(patch.object(jsonlib, 'orjson', settings['orjson']))
+                patches.append(patch.object(jsonlib, 'FAST', False))
+            for item in patches:
+                item.start()
+            try:
+                results['cases'][case][mode] = _measure(client, url, repeat)
+            finally:
+                for item in reversed(patches):
+                    item.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=500, help='размер матрицы /table')
+    parser.add_argument('--route-points', type=int, default=50000, help='точек в геометрии маршрута')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    args = parser.parse_args()
+
+    results = run(args.size, args.route_points, args.repeat)
+    print("JSON backend: {}".format(results['fast_json_backend']))
+    for case, modes in results['cases'].items():
+        for mode, stats in modes.items():
+            print("{:<6} {:<12} median {:>9.3f} ms  min {:>9.3f} ms  {:>10} bytes".format(
+                case, mode, stats['median_ms'], stats['min_ms'], stats['bytes']))
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Микробенчмарк ``build_route_summary`` на большом синтетическом маршруте.
+
+Сравнивает текущую реализацию с прежним построчным вариантом, где каждая
+инструкция собиралась через ``_humanize_step``, и проверяет, что JSON
+результатов совпадает байт в байт.
+
+Запуск: ``python benchmarks/bench_summary.py [--waypoints 25] [--steps 200] [--repeat 20] [--json out.json]``.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from routing import summary  # noqa: E402
+
+_TYPES = ('depart', 'turn', 'new name', 'continue', 'roundabout', 'fork', 'merge', 'end of road', 'arrive')
+_MODIFIERS = ('left', 'right', 'slight left', 'slight right', 'straight', 'sharp left', None)
+
+
+def synthetic_response(waypoints, steps_per_leg):
+    """Ответ /route со steps=true через waypoints точек."""
+    legs = []
+    for leg_index in range(waypoints - 1):
+        steps = []
+        for index in range(steps_per_leg):
+            maneuver = {'type': _TYPES[index % len(_TYPES)]}
+            modifier = _MODIFIERS[index % len(_MODIFIERS)]
+            if modifier is not None:
+                maneuver['modifier'] = modifier
+            steps.append({
+                'distance': 37.5 + index,
+                'duration': 4.25 + index / 10.0,
+                'name': 'Улица {}'.format(index % 40) if index % 5 else '',
+                'maneuver': maneuver
+            })
+        legs.append({
+            'distance': sum(step['distance'] for step in steps),
+            'duration': sum(step['duration'] for step in steps),
+            'summary': 'Участок {}'.format(leg_index),
+            'steps': steps
+        })
+    return {
+        'code': 'Ok',
+        'routes': [{
+            'distance': sum(leg['distance'] for leg in legs),
+            'duration': sum(leg['duration'] for leg in legs),
+            'legs': legs
+        }],
+        'waypoints': [
+            {'name': 'Точка {}'.format(i) if i % 3 else '', 'location': [30.7 + i * 0.01, 46.4 + i * 0.01]}
+            for i in range(waypoints)
+        ]
+    }
+
+
+def reference_steps(steps):
+    """Прежний вариант: каждый шаг собирается через _humanize_step."""
+    return [{
+        'instruction': summary._humanize_step(step),
+        'distance_km': summary._meters_to_kilometers(step.get('distance', 0.0)),
+        'duration_min': summary._seconds_to_minutes(step.get('duration', 0.0))
+    } for step in steps]
+
+
+def _best(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(waypoints, steps_per_leg, repeat):
+    response = synthetic_response(waypoints, steps_per_leg)
+    legs = response['routes'][0]['legs']
+    expected = summary.build_route_summary(response)
+    for leg_payload, leg in zip(expected['legs'], legs):
+        leg_payload['steps'] = reference_steps(leg['steps'])
+    identical = (json.dumps(summary.build_route_summary(response), ensure_ascii=False)
+                 == json.dumps(expected, ensure_ascii=False))
+    fast = _best(lambda: [summary._summarize_steps(leg['steps']) for leg in legs], repeat)
+    reference = _best(lambda: [reference_steps(leg['steps']) for leg in legs], repeat)
+    total = _best(lambda: summary.build_route_summary(response), repeat)
+    return {
+        'waypoints': waypoints,
+        'steps': (waypoints - 1) * steps_per_leg,
+        'identical': identical,
+        'steps_reference_ms': round(reference * 1000, 3),
+        'steps_fast_ms': round(fast * 1000, 3),
+        'speedup': round(reference / fast, 2) if fast else None,
+        'build_route_summary_ms': round(total * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--waypoints', type=int, default=25)
+    parser.add_argument('--steps', type=int, default=200, help='шагов на участок')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    args = parser.parse_args()
+
+    results = run(args.waypoints, args.steps, args.repeat)
+    print('{steps} steps, identical output: {identical}'.format(**results))
+    print('per-step humanize {steps_reference_ms:.3f} ms, templates {steps_fast_ms:.3f} ms, '
+          'x{speedup}; build_route_summary {build_route_summary_ms:.3f} ms'.format(**results))
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Бенчмарк ``Graph.update_weights`` на синтетическом графе.
+
+Измеряет пропускную способность применения наблюдений трафика по OSM id
+линий и по номерам рёбер.
+
+Запуск: ``python benchmarks/bench_weights.py [--edges 2000000] [--observations 3000000] [--json out.json]``.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from routing.graph import Graph  # noqa: E402
+
+
+def synthetic_graph(edges, rng):
+    nodes = max(2, edges // 4)
+    return Graph.from_edges(
+        np.arange(nodes), 30 + rng.random(nodes), 46 + rng.random(nodes),
+        rng.integers(0, nodes, edges), rng.integers(0, nodes, edges),
+        rng.choice([25.0, 40.0, 65.0, 90.0], edges), rng.integers(0, edges // 6 + 1, edges)
+    )
+
+
+def run(edges, observations, seed=0):
+    rng = np.random.default_rng(seed)
+    graph = synthetic_graph(edges, rng)
+    started = time.perf_counter()
+    graph.way_edges()
+    index_seconds = time.perf_counter() - started
+    results = {'edges': edges, 'observations': observations, 'index_ms': round(index_seconds * 1000, 1)}
+    speeds = rng.random(observations) * 80
+    for key, upper in (('way', edges // 6 + 1), ('edge', edges)):
+        ids = rng.integers(0, upper, observations)
+        graph.reset_weights()
+        started = time.perf_counter()
+        changed = graph.update_weights(ids, speeds, key=key)
+        seconds = time.perf_counter() - started
+        results[key] = {
+            'ms': round(seconds * 1000, 1),
+            'observations_per_second': int(observations / seconds),
+            'changed_edges': int(len(changed))
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--edges', type=int, default=2000000)
+    parser.add_argument('--observations', type=int, default=3000000)
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    args = parser.parse_args()
+
+    results = run(args.edges, args.observations)
+    print('{edges} edges, way index {index_ms:.1f} ms'.format(**results))
+    for key in ('way', 'edge'):
+        print('by {}: {ms:.1f} ms, {observations_per_second} obs/s, {changed_edges} edges changed'.format(
+            key, **results[key]))
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Заглушка osrm-routed для нагрузочных тестов API.
+
+Отвечает на ``/route``, ``/table`` и ``/nearest`` синтетическими ответами
+заданного размера с искусственной задержкой. Маршруты, у которых первая
+координата имеет долготу меньше 1, возвращают ``NoRoute``, а ``/nearest``
+для таких точек предлагает кандидатов со сдвигом на 30° — так включается
+запасной поиск ``Router``.
+
+Запуск отдельно: ``python benchmarks/stub_osrm.py --port 5001 --latency-ms 5``.
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubConfig:
+    """Параметры заглушки: задержка и размер ответов."""
+
+    def __init__(self, latency_ms=0.0, steps_per_leg=10, geometry_points=0):
+        self.latency_ms = latency_ms
+        self.steps_per_leg = steps_per_leg
+        self.geometry_points = geometry_points
+
+
+def _parse_coordinates(value):
+    coordinates = []
+    for item in value.split(';'):
+        lon, lat = item.split(',')[:2]
+        coordinates.append([float(lon), float(lat)])
+    return coordinates
+
+
+def route_response(coordinates, config):
+    """Маршрут через все точки с steps_per_leg шагами на участок."""
+    if coordinates[0][0] < 1:
+        return {'code': 'NoRoute', 'message': 'Impossible route between points'}
+    legs = []
+    for index in range(len(coordinates) - 1):
+        steps = []
+        for step in range(config.steps_per_leg):
+            if step == 0:
+                maneuver = {'type': 'depart'}
+            elif step == config.steps_per_leg - 1:
+                maneuver = {'type': 'arrive'}
+            else:
+                maneuver = {'type': 'turn', 'modifier': 'left' if step % 2 else 'slight right'}
+            steps.append({
+                'distance': 120.5,
+                'duration': 14.2,
+                'name': 'Улица {}'.format(step),
+                'maneuver': maneuver
+            })
+        legs.append({
+            'distance': 120.5 * config.steps_per_leg,
+            'duration': 14.2 * config.steps_per_leg,
+            'summary': 'Участок {}'.format(index),
+            'steps': steps
+        })
+    route = {
+        'distance': sum(leg['distance'] for leg in legs),
+        'duration': sum(leg['duration'] for leg in legs),
+        'legs': legs
+    }
+    if config.geometry_points:
+        start = coordinates[0]
+        route['geometry'] = {
+            'type': 'LineString',
+            'coordinates': [[start[0] + i * 1e-5, start[1] + i * 1e-5] for i in range(config.geometry_points)]
+        }
+    return {
+        'code': 'Ok',
+        'routes': [route],
+        'waypoints': [{'name': 'Точка {}'.format(i), 'location': c} for i, c in enumerate(coordinates)]
+    }
+
+
+def table_response(coordinates, query):
+    """Матрица длительностей по евклидову расстоянию между точками."""
+    count = len(coordinates)
+    sources = [int(i) for i in query['sources'][0].split(';')] if 'sources' in query else range(count)
+    destinations = ([int(i) for i in query['destinations'][0].split(';')]
+                    if 'destinations' in query else range(count))
+    durations = []
+    for s in sources:
+        row = []
+        for d in destinations:
+            dx = coordinates[s][0] - coordinates[d][0]
+            dy = coordinates[s][1] - coordinates[d][1]
+            row.append(round((dx * dx + dy * dy) ** 0.5 * 100000 / 14.0, 1))
+        durations.append(row)
+    return {
+        'code': 'Ok',
+        'durations': durations,
+        'sources': [{'location': coordinates[s], 'name': ''} for s in sources],
+        'destinations': [{'location': coordinates[d], 'name': ''} for d in destinations]
+    }
+
+
+def nearest_response(coordinates, query):
+    """Кандидаты вокруг точки; недостижимые точки сдвигаются на дорогу."""
+    lon, lat = coordinates[0]
+    if lon < 1:
+        lon += 30
+    number = int(query.get('number', ['1'])[0])
+    return {
+        'code': 'Ok',
+        'waypoints': [
+            {'name': '', 'distance': i * 3.0, 'location': [lon + i * 1e-3, lat + i * 1e-3]}
+            for i in range(number)
+        ]
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными write; без этого keep-alive упирается в delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        config = self.server.config
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        segments = parts.path.strip('/').split('/')
+        if config.latency_ms:
+            time.sleep(config.latency_ms / 1000.0)
+        try:
+            service = segments[0]
+            coordinates = _parse_coordinates(segments[3])
+        except (IndexError, ValueError):
+            self._reply(400, {'code': 'InvalidUrl'})
+            return
+        if service == 'route':
+            self._reply(200, route_response(coordinates, config))
+        elif service == 'table':
+            self._reply(200, table_response(coordinates, query))
+        elif service == 'nearest':
+            self._reply(200, nearest_response(coordinates, query))
+        else:
+            self._reply(400, {'code': 'InvalidService'})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return None
+
+
+class StubOSRMServer(ThreadingMixIn, HTTPServer):
+    """Многопоточный HTTP-сервер заглушки."""
+
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        HTTPServer.__init__(self, address, _Handler)
+        self.config = config
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """Запускает сервер в фоновом потоке и возвращает себя."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--steps', type=int, default=10, help='шагов на участок маршрута')
+    parser.add_argument('--geometry-points', type=int, default=0, help='точек в геометрии маршрута')
+    args = parser.parse_args()
+    server = StubOSRMServer((args.host, args.port), StubConfig(args.latency_ms, args.steps, args.geometry_points))
+    print('Stub OSRM listening on {}'.format(server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+"""Асинхронный клиент OSRM на aiohttp с той же семантикой, что и Router."""
+
+import asyncio
+import time
+
+import aiohttp
+
+from routing import jsonlib
+from routing.cache import ResponseCache, SnapCache, make_key
+from routing.matching import MatchMerger, match_windows, window_params
+from routing.metrics import Registry
+from routing.rebuild import Rebuilder
+from routing.router import (
+    FALLBACK_DEADLINE,
+    FALLBACK_STRATEGIES,
+    FALLBACK_STRATEGY,
+    FALLBACK_WORKERS,
+    MATCH_OVERLAP,
+    MATCH_WORKERS,
+    MAX_MATCHING_SIZE,
+    MAX_TABLE_SIZE,
+    NEAREST_CANDIDATE_LIMIT,
+    OSRM_CONNECT_TIMEOUT,
+    OSRM_DATA,
+    OSRM_MAX_RETRIES,
+    OSRM_POOL_SIZE,
+    OSRM_READ_TIMEOUT,
+    OSRM_URL,
+    TABLE_WORKERS,
+    Router,
+    TableStitcher,
+    needs_table_chunking,
+    resolve_timeout,
+    table_tiles,
+)
+
+
+_RETRY_STATUSES = (502, 503, 504)
+_RETRY_BACKOFF = 0.1
+
+
+class OSRMHTTPError(Exception):
+    """Ответ OSRM с HTTP-статусом ошибки."""
+
+    def __init__(self, status, payload):
+        super().__init__("OSRM responded with HTTP {}".format(status))
+        self.status = status
+        self.payload = payload
+
+
+# Ошибки соединения и таймауты, при которых клиенту отдаётся 502.
+TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class AsyncRouter:
+    """Асинхронный клиент OSRM с пулом соединений aiohttp.
+
+    Повторяет поведение Router: кэш ответов, запасной поиск по ближайшим
+    точкам, разбиение больших матриц и длинных треков. Сессия aiohttp
+    создаётся при первом запросе внутри работающего цикла событий.
+    """
+
+    def __init__(self, base_url=OSRM_URL, pool_size=OSRM_POOL_SIZE,
+                 connect_timeout=OSRM_CONNECT_TIMEOUT, read_timeout=OSRM_READ_TIMEOUT,
+                 max_retries=OSRM_MAX_RETRIES, fallback_workers=FALLBACK_WORKERS,
+                 fallback_deadline=FALLBACK_DEADLINE, fallback_strategy=FALLBACK_STRATEGY,
+                 data_path=OSRM_DATA, cache=None, snap_cache=None,
+                 max_table_size=MAX_TABLE_SIZE, table_workers=TABLE_WORKERS,
+                 max_matching_size=MAX_MATCHING_SIZE, match_overlap=MATCH_OVERLAP,
+                 match_workers=MATCH_WORKERS, metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.fallback_workers = fallback_workers
+        self.fallback_deadline = fallback_deadline
+        if fallback_strategy not in FALLBACK_STRATEGIES:
+            raise ValueError("Unknown fallback strategy: {}".format(fallback_strategy))
+        self.fallback_strategy = fallback_strategy
+        self.data_path = data_path
+        # Перестройку запускает синхронный Router; здесь Rebuilder нужен только для метки её завершения.
+        self.rebuilder = Rebuilder(data_path)
+        if cache is None:
+            cache = ResponseCache(version_func=self._data_version)
+        self.cache = cache
+        if snap_cache is None:
+            snap_cache = SnapCache(version_func=self._data_version)
+        self.snap_cache = snap_cache
+        self.max_table_size = max_table_size
+        self.table_workers = table_workers
+        self.max_matching_size = max_matching_size
+        self.match_overlap = match_overlap
+        self.match_workers = match_workers
+        self.metrics = metrics if metrics is not None else Registry()
+        self._upstream_seconds = self.metrics.histogram(
+            'osrm_upstream_request_seconds', 'Время HTTP-запроса к osrm-routed', ('service',)
+        )
+        self._session = None
+        self._in_flight = 0
+        self._requests_total = 0
+
+    _data_version = Router._data_version
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Закрывает сессию и соединения пула."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _fetch(self, url, params, timeout):
+        """Выполняет один GET и возвращает пару (статус, JSON-ответ)."""
+        connect, read = timeout
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        async with self._get_session().get(url, params=params, timeout=client_timeout) as resp:
+            body = await resp.read()
+            try:
+                payload = jsonlib.loads(body)
+            except ValueError:
+                payload = {'error': body.decode('utf-8', 'replace')}
+            return resp.status, payload
+
+    async def _request(self, path, params=None, timeout=None):
+        params = params or {}
+        url = "{}{}".format(self.base_url, path)
+        timeout = resolve_timeout(self.timeout, timeout)
+        service = path.split('/', 2)[1]
+        self._in_flight += 1
+        self._requests_total += 1
+        try:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    status, payload = await self._fetch(url, params, timeout)
+                except TRANSPORT_ERRORS:
+                    self._upstream_seconds.observe(time.perf_counter() - started, (service,))
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    self._upstream_seconds.observe(time.perf_counter() - started, (service,))
+                    if status < 400:
+                        return payload
+                    if status not in _RETRY_STATUSES or attempt >= self.max_retries:
+                        raise OSRMHTTPError(status, payload)
+                await asyncio.sleep(_RETRY_BACKOFF * (2 ** attempt))
+                attempt += 1
+        finally:
+            self._in_flight -= 1
+
+    def pool_stats(self):
+        """Возвращает статистику пула соединений к OSRM."""
+        connector = self._session.connector if self._session is not None else None
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'in_flight': self._in_flight,
+            'requests_total': self._requests_total,
+            'open': connector is not None and not connector.closed
+        }
+
+    async def _cached(self, service, points, params, call):
+        key = make_key(service, points, params)
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+        response = await call()
+        if isinstance(response, dict) and response.get('code') == 'Ok':
+            self.cache.put(key, response)
+        return response
+
+    def _deadline_timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+    async def route_points(self, points, timeout=None, **params):
+        """Строит маршрут по заранее собранной строке координат."""
+        query = {'overview': 'false'}
+        query.update(params)
+        path = "/route/v1/driving/{}".format(points)
+        return await self._request(path, query, timeout=timeout)
+
+    async def route(self, start, end, via=None, timeout=None, **params):
+        """Строит маршрут между стартом и финишем с необязательными via-точками."""
+        coordinates = [start]
+        if via:
+            coordinates.extend(via)
+        coordinates.append(end)
+        points = ';'.join(coordinates)
+
+        async def call():
+            response = await self.route_points(points, timeout=timeout, **params)
+            if Router._is_route_success(response):
+                return response
+            fallback_response = await self._route_with_nearest_points(start, end, via, params)
+            if fallback_response is not None:
+                return fallback_response
+            return response
+
+        return await self._cached('route', points, params, call)
+
+    async def _nearest_candidates(self, point, deadline):
+        cached = self.snap_cache.get(point, NEAREST_CANDIDATE_LIMIT)
+        if cached is not None:
+            return list(cached)
+        timeout = self._deadline_timeout(deadline)
+        if timeout is None:
+            return []
+        response = await self.nearest(point, timeout=timeout, number=str(NEAREST_CANDIDATE_LIMIT))
+        candidates = Router._candidates_from_nearest(response)
+        self.snap_cache.put(point, NEAREST_CANDIDATE_LIMIT, candidates)
+        return candidates
+
+    async def _route_with_nearest_points(self, start, end, via, params):
+        """Ищет маршрут между ближайшими точками дороги в пределах общего срока."""
+        deadline = time.monotonic() + self.fallback_deadline
+        try:
+            return await asyncio.wait_for(
+                self._fallback(start, end, via, params, deadline),
+                timeout=self.fallback_deadline
+            )
+        except asyncio.TimeoutError:
+            return None
+
+    async def _fallback(self, start, end, via, params, deadline):
+        start_candidates, end_candidates = await asyncio.gather(
+            self._nearest_candidates(start, deadline),
+            self._nearest_candidates(end, deadline)
+        )
+        if not start_candidates or not end_candidates:
+            return None
+        via_points = list(via) if via else []
+        if self.fallback_strategy == 'table':
+            return await self._fallback_by_table(
+                start_candidates, end_candidates, via_points, params, deadline
+            )
+        return await self._fallback_by_probing(
+            start_candidates, end_candidates, via_points, params, deadline
+        )
+
+    async def _fallback_by_table(self, start_candidates, end_candidates, via_points, params, deadline):
+        points, query = Router._candidate_table_query(
+            start_candidates, end_candidates, via_points, params
+        )
+        try:
+            response = await self.table(points, timeout=self._deadline_timeout(deadline), **query)
+        except (OSRMHTTPError,) + TRANSPORT_ERRORS:
+            return None
+        pairs = Router._rank_pairs_by_table(response, start_candidates, end_candidates, via_points)
+        for start_point, end_point in pairs:
+            timeout = self._deadline_timeout(deadline)
+            if timeout is None:
+                break
+            points = Router._join_route_points(start_point, via_points, end_point)
+            try:
+                response = await self.route_points(points, timeout=timeout, **params)
+            except (OSRMHTTPError,) + TRANSPORT_ERRORS:
+                continue
+            if Router._is_route_success(response):
+                return response
+        return None
+
+    async def _fallback_by_probing(self, start_candidates, end_candidates, via_points, params, deadline):
+        semaphore = asyncio.Semaphore(self.fallback_workers)
+
+        async def probe(points):
+            async with semaphore:
+                timeout = self._deadline_timeout(deadline)
+                if timeout is None:
+                    return None
+                try:
+                    return await self.route_points(points, timeout=timeout, **params)
+                except (OSRMHTTPError,) + TRANSPORT_ERRORS:
+                    return None
+
+        tasks = [
+            asyncio.ensure_future(probe(Router._join_route_points(start_point, via_points, end_point)))
+            for start_point in start_candidates
+            for end_point in end_candidates
+        ]
+        order = {task: index for index, task in enumerate(tasks)}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=order.get):
+                    response = task.result()
+                    if Router._is_route_success(response):
+                        return response
+        finally:
+            for task in pending:
+                task.cancel()
+        return None
+
+    async def table(self, points, timeout=None, **params):
+        """Строит матрицу, разбивая её на тайлы, если она больше --max-table-size."""
+        coordinates = points.split(';')
+        sources = Router._table_indices(params.get('sources'), len(coordinates))
+        destinations = Router._table_indices(params.get('destinations'), len(coordinates))
+        if not needs_table_chunking(self.max_table_size, sources, destinations):
+            path = "/table/v1/driving/{}".format(points)
+            return await self._cached(
+                'table', points, params, lambda: self._request(path, params, timeout=timeout)
+            )
+        return await self._chunked_table(coordinates, sources, destinations, params, timeout)
+
+    async def _chunked_table(self, coordinates, sources, destinations, params, timeout):
+        semaphore = asyncio.Semaphore(self.table_workers)
+
+        async def tile(tile_sources, tile_destinations):
+            async with semaphore:
+                coordinate_indices = tile_sources + tile_destinations
+                query = Router._tile_params(
+                    params, coordinate_indices, len(tile_sources), len(tile_destinations)
+                )
+                path = "/table/v1/driving/{}".format(
+                    ';'.join(coordinates[index] for index in coordinate_indices)
+                )
+                return await self._request(path, query, timeout=timeout)
+
+        tiles = table_tiles(self.max_table_size, sources, destinations)
+        responses = await asyncio.gather(*[tile(t[2], t[3]) for t in tiles])
+        stitcher = TableStitcher(len(sources), len(destinations))
+        for (row, col, _, _), response in zip(tiles, responses):
+            error = stitcher.add(row, col, response)
+            if error is not None:
+                return error
+        return stitcher.result()
+
+    async def nearest(self, point, timeout=None, **params):
+        path = "/nearest/v1/driving/{}".format(point)
+        return await self._cached(
+            'nearest', point, params, lambda: self._request(path, params, timeout=timeout)
+        )
+
+    async def match(self, points, timeout=None, **params):
+        """Привязывает трек к дорогам, длинные треки — перекрывающимися окнами."""
+        coordinates = points.split(';')
+        if (self.max_matching_size <= 0 or len(coordinates) <= self.max_matching_size
+                or 'waypoints' in params):
+            path = "/match/v1/driving/{}".format(points)
+            return await self._request(path, params, timeout=timeout)
+
+        windows = match_windows(len(coordinates), self.max_matching_size, self.match_overlap)
+        merger = MatchMerger(len(coordinates))
+        in_flight = []
+        next_window = 0
+
+        def submit(window):
+            start, end = window[0], window[1]
+            query = window_params(params, start, end)
+            query['overview'] = 'false'
+            path = "/match/v1/driving/{}".format(';'.join(coordinates[start:end]))
+            return asyncio.ensure_future(self._request(path, query, timeout=timeout))
+
+        try:
+            while next_window < len(windows) or in_flight:
+                while next_window < len(windows) and len(in_flight) < self.match_workers:
+                    in_flight.append((windows[next_window], submit(windows[next_window])))
+                    next_window += 1
+                window, task = in_flight.pop(0)
+                merger.add(window, await task)
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+        return merger.result()
+
+    async def trip(self, points, timeout=None, **params):
+        path = "/trip/v1/driving/{}".format(points)
+        return await self._request(path, params, timeout=timeout)
@@ -0,0 +1,250 @@
+"""Кэш ответов OSRM в памяти процесса."""
+
+import glob
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHE_MAX_ENTRIES = int(os.environ.get('OSRM_CACHE_SIZE', '1024'))
+CACHE_MAX_BYTES = int(os.environ.get('OSRM_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_VERSION_CHECK_INTERVAL = float(os.environ.get('OSRM_CACHE_VERSION_CHECK', '5'))
+SNAP_PRECISION = int(os.environ.get('OSRM_SNAP_PRECISION', '4'))
+SNAP_CACHE_SIZE = int(os.environ.get('OSRM_SNAP_CACHE_SIZE', '4096'))
+SNAP_CACHE_TTL = float(os.environ.get('OSRM_SNAP_CACHE_TTL', '3600'))
+
+_DEFAULT_TTLS = {
+    'route': 300.0,
+    'table': 300.0,
+    'nearest': 3600.0
+}
+
+
+def _ttl_from_env(service, default):
+    """Читает TTL сервиса из переменной OSRM_CACHE_TTL_<SERVICE>."""
+    return float(os.environ.get('OSRM_CACHE_TTL_{}'.format(service.upper()), default))
+
+
+def default_ttls():
+    """Возвращает TTL по сервисам с учётом переменных окружения."""
+    return {service: _ttl_from_env(service, ttl) for service, ttl in _DEFAULT_TTLS.items()}
+
+
+def canonical_coordinates(points):
+    """Приводит строку координат к единому виду: 6 знаков после запятой."""
+    canonical = []
+    for coord in points.split(';'):
+        if not coord:
+            continue
+        try:
+            lon, lat = coord.split(',')
+            canonical.append("{:.6f},{:.6f}".format(float(lon), float(lat)))
+        except ValueError:
+            canonical.append(coord.strip())
+    return ';'.join(canonical)
+
+
+def make_key(service, points, params):
+    """Строит ключ кэша из сервиса, координат и отсортированных параметров."""
+    items = tuple(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+    return (service, canonical_coordinates(points), items)
+
+
+def data_version(data_path, *markers):
+    """Возвращает отметку версии данных OSRM по времени изменения файлов.
+
+    ``markers`` — дополнительные файлы, например метка перезагрузки
+    перестроенных весов, которая не трогает ``OSRM_DATA*``.
+    """
+    stamps = []
+    for path in glob.glob(data_path + '*') + list(markers):
+        try:
+            stamps.append(os.stat(path).st_mtime)
+        except OSError:
+            continue
+    return max(stamps) if stamps else None
+
+
+def _estimate_size(value):
+    """Грубо оценивает размер значения по длине его JSON-представления.
+
+    Дорого для больших ответов, поэтому используется, только когда
+    размер не передан в ``put``.
+    """
+    try:
+        return len(json.dumps(value, separators=(',', ':')))
+    except (TypeError, ValueError):
+        return 0
+
+
+class ResponseCache:
+    """LRU-кэш с TTL по сервисам и ограничением по объёму.
+
+    Возвращаемые ответы разделяются между вызывающими и не должны изменяться.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttls=None,
+                 version_func=None, version_check_interval=CACHE_VERSION_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = default_ttls() if ttls is None else dict(ttls)
+        self._version_func = version_func
+        self._version_check_interval = version_check_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = version_func() if version_func else None
+        self._version_checked = clock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _check_version(self, now):
+        """Сбрасывает кэш, если файлы данных OSRM изменились."""
+        if self._version_func is None:
+            return
+        if now - self._version_checked < self._version_check_interval:
+            return
+        self._version_checked = now
+        version = self._version_func()
+        if version != self._version:
+            self._version = version
+            self._clear_locked()
+
+    def _clear_locked(self):
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self._bytes = 0
+
+    def _drop_locked(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        """Возвращает значение или None, если его нет либо оно устарело."""
+        if not self.enabled:
+            return None
+        now = self._clock()
+        with self._lock:
+            self._check_version(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= now:
+                self._drop_locked(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=None):
+        """Сохраняет значение с TTL сервиса из ключа.
+
+        ``size`` — размер в байтах, обычно длина тела ответа OSRM; без него
+        размер оценивается сериализацией значения.
+        """
+        if not self.enabled:
+            return
+        ttl = self.ttls.get(key[0], 0)
+        if ttl <= 0:
+            return
+        if size is None:
+            size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        now = self._clock()
+        with self._lock:
+            self._check_version(now)
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (value, now + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """Полностью очищает кэш, например после перестройки графа."""
+        with self._lock:
+            self._clear_locked()
+
+    def stats(self):
+        """Возвращает счётчики попаданий, промахов и вытеснений."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+
+class SnapCache:
+    """Пространственный кэш ближайших точек дороги по ячейкам сетки.
+
+    Координаты квантуются до ``precision`` знаков после запятой, поэтому
+    шумные GPS-точки рядом с одним адресом попадают в одну ячейку
+    (4 знака — около 11 м по широте).
+    """
+
+    def __init__(self, precision=SNAP_PRECISION, max_entries=SNAP_CACHE_SIZE, ttl=SNAP_CACHE_TTL,
+                 version_func=None, clock=time.monotonic):
+        self.precision = precision
+        self._scale = 10 ** precision
+        self._cache = ResponseCache(
+            max_entries=max_entries,
+            ttls={'snap': ttl},
+            version_func=version_func,
+            clock=clock
+        )
+
+    def cell(self, point):
+        """Возвращает ячейку сетки для строки ``lon,lat`` или None."""
+        try:
+            lon, lat = point.split(',')
+            return (int(round(float(lon) * self._scale)), int(round(float(lat) * self._scale)))
+        except (AttributeError, ValueError):
+            return None
+
+    def get(self, point, number):
+        """Возвращает закэшированных кандидатов для точки или None."""
+        cell = self.cell(point)
+        if cell is None:
+            return None
+        return self._cache.get(('snap', cell, number))
+
+    def put(self, point, number, candidates):
+        """Сохраняет кандидатов для ячейки, в которую попала точка."""
+        cell = self.cell(point)
+        if cell is None or not candidates:
+            return
+        self._cache.put(('snap', cell, number), tuple(candidates))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['precision'] = self.precision
+        return stats
@@ -0,0 +1,71 @@
+"""Объединение одинаковых одновременных запросов (single-flight)."""
+
+import threading
+
+from routing.metrics import osrm_time
+
+
+class _Call:
+    """Выполняющийся вызов, результат которого ждут остальные потоки."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Выполняет одинаковые одновременные вызовы один раз.
+
+    Первый поток с данным ключом выполняет функцию, остальные ждут и
+    получают тот же результат или то же исключение. Ключ снимается сразу
+    после завершения, так что следующий запрос снова идёт к источнику
+    (обычно к этому времени ответ уже лежит в кэше).
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Возвращает результат ``func()``, разделяя его между потоками с тем же ключом."""
+        if not self.enabled:
+            return func()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            with osrm_time():
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """Возвращает число выполненных и объединённых вызовов."""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced
+            }
@@ -0,0 +1,456 @@
+"""Локальный поиск кратчайших путей по графу ``routing.graph.Graph``.
+
+Нужен для оценки сценариев «что если» по трафику без перезагрузки OSRM:
+веса меняются через ``Graph.update_weights``, и следующий запрос уже
+учитывает их. Алгоритмы:
+
+- ``dijkstra`` — двунаправленный Дейкстра по прямому и обратному CSR;
+- ``astar`` — A* с эвристикой «расстояние по прямой / максимальная скорость»;
+- ``ch`` — иерархии сжатия (contraction hierarchies). Предобработка долгая
+  (чистый Python), поэтому результат кэшируется на диск и проверяется по
+  отпечатку весов; после изменения весов запросы идут двунаправленным
+  Дейкстрой, пока иерархия не будет пересчитана.
+
+Циклы поиска читают массивы графа через ``memoryview``: индексирование
+даёт обычные числа Python без копирования массивов.
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import os
+
+import numpy as np
+
+from routing.graph import EARTH_RADIUS_M
+
+
+ALGORITHMS = ('dijkstra', 'astar', 'ch')
+CH_FORMAT_VERSION = 1
+CH_FILENAME = 'ch.npz'
+# Сколько узлов осматривает поиск свидетеля при сжатии узла.
+WITNESS_SETTLE_LIMIT = 100
+_INF = float('inf')
+
+
+def weights_digest(weights):
+    """Отпечаток весов графа для проверки кэша предобработки."""
+    return hashlib.sha1(np.ascontiguousarray(weights).tobytes()).hexdigest()
+
+
+def _parse_point(point):
+    if isinstance(point, str):
+        lon, lat = point.split(',')
+        return float(lon), float(lat)
+    return float(point[0]), float(point[1])
+
+
+class ContractionHierarchy:
+    """Иерархия сжатия: ранги узлов, рёбра с ярлыками и CSR поиска вверх и вниз.
+
+    Ребро иерархии ``c`` ведёт из ``tails[c]`` в ``heads[c]``. Для ярлыка
+    ``first``/``second`` — рёбра иерархии, которые он заменяет; для
+    исходного ребра ``second`` равно -1, а ``first`` — номер ребра графа.
+    """
+
+    _ARRAYS = ('rank', 'tails', 'heads', 'weights', 'first', 'second',
+               'up_indptr', 'up_edges', 'down_indptr', 'down_edges')
+
+    def __init__(self, arrays, digest):
+        for name in self._ARRAYS:
+            setattr(self, name, arrays[name])
+        self.digest = digest
+
+    @property
+    def shortcut_count(self):
+        return int(np.count_nonzero(self.second >= 0))
+
+    @classmethod
+    def build(cls, graph, settle_limit=WITNESS_SETTLE_LIMIT):
+        """Сжимает узлы по возрастанию разности рёбер с ленивым обновлением приоритетов."""
+        count = graph.node_count
+        tails, heads, weights, first, second = [], [], [], [], []
+        out_adj = [{} for _ in range(count)]
+        in_adj = [{} for _ in range(count)]
+        for edge, (tail, head, weight) in enumerate(zip(
+                graph.sources.tolist(), graph.targets.tolist(), graph.weights.tolist())):
+            current = out_adj[tail].get(head)
+            if current is not None and weights[current] <= weight:
+                continue
+            out_adj[tail][head] = in_adj[head][tail] = len(tails)
+            tails.append(tail)
+            heads.append(head)
+            weights.append(weight)
+            first.append(edge)
+            second.append(-1)
+
+        rank = [0] * count
+        up = [()] * count
+        down = [()] * count
+        removed_neighbours = [0] * count
+
+        def priority(node):
+            shortcuts = cls._shortcuts(node, out_adj, in_adj, weights, settle_limit)
+            degree = len(out_adj[node]) + len(in_adj[node])
+            return len(shortcuts) - degree + removed_neighbours[node], shortcuts
+
+        queue = [(priority(node)[0], node) for node in range(count)]
+        heapq.heapify(queue)
+        order = 0
+        while queue:
+            _, node = heapq.heappop(queue)
+            value, shortcuts = priority(node)
+            if queue and value > queue[0][0]:
+                heapq.heappush(queue, (value, node))
+                continue
+            rank[node] = order
+            order += 1
+            up[node] = list(out_adj[node].values())
+            down[node] = list(in_adj[node].values())
+            for head in out_adj[node]:
+                del in_adj[head][node]
+                removed_neighbours[head] += 1
+            for tail in in_adj[node]:
+                del out_adj[tail][node]
+                removed_neighbours[tail] += 1
+            out_adj[node] = in_adj[node] = None
+            for tail, head, weight, left, right in shortcuts:
+                current = out_adj[tail].get(head)
+                if current is not None and weights[current] <= weight:
+                    continue
+                out_adj[tail][head] = in_adj[head][tail] = len(tails)
+                tails.append(tail)
+                heads.append(head)
+                weights.append(weight)
+                first.append(left)
+                second.append(right)
+
+        arrays = {
+            'rank': np.asarray(rank, dtype=np.int32),
+            'tails': np.asarray(tails, dtype=np.int32),
+            'heads': np.asarray(heads, dtype=np.int32),
+            'weights': np.asarray(weights, dtype=np.float64),
+            'first': np.asarray(first, dtype=np.int64),
+            'second': np.asarray(second, dtype=np.int64)
+        }
+        for name, lists in (('up', up), ('down', down)):
+            indptr = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum([len(edges) for edges in lists], out=indptr[1:])
+            arrays[name + '_indptr'] = indptr
+            arrays[name + '_edges'] = np.fromiter(
+                (edge for edges in lists for edge in edges), dtype=np.int64, count=int(indptr[-1])
+            )
+        return cls(arrays, weights_digest(graph.weights))
+
+    @staticmethod
+    def _shortcuts(node, out_adj, in_adj, weights, settle_limit):
+        """Ярлыки, нужные при сжатии узла: (из, в, вес, ребро входа, ребро выхода)."""
+        result = []
+        outgoing = out_adj[node]
+        for tail, in_edge in in_adj[node].items():
+            base = weights[in_edge]
+            targets = {head: base + weights[edge] for head, edge in outgoing.items() if head != tail}
+            if not targets:
+                continue
+            limit = max(targets.values())
+            # Поиск свидетеля: путь в обход сжимаемого узла не длиннее пути через него.
+            dist = {tail: 0.0}
+            heap = [(0.0, tail)]
+            settled = 0
+            remaining = len(targets)
+            while heap and settled < settle_limit and remaining:
+                cost, current = heapq.heappop(heap)
+                if cost > dist[current]:
+                    continue
+                if cost > limit:
+                    break
+                settled += 1
+                if current in targets:
+                    remaining -= 1
+                for head, edge in out_adj[current].items():
+                    if head == node:
+                        continue
+                    candidate = cost + weights[edge]
+                    if candidate < dist.get(head, _INF):
+                        dist[head] = candidate
+                        heapq.heappush(heap, (candidate, head))
+            for head, cost in targets.items():
+                if dist.get(head, _INF) > cost:
+                    result.append((tail, head, cost, in_edge, outgoing[head]))
+        return result
+
+    def save(self, path):
+        """Сохраняет иерархию в файл ``.npz`` с отпечатком весов."""
+        meta = json.dumps({'version': CH_FORMAT_VERSION, 'digest': self.digest})
+        with open(path, 'wb') as handle:
+            np.savez(handle, meta=np.array(meta), **{name: getattr(self, name) for name in self._ARRAYS})
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') != CH_FORMAT_VERSION:
+                raise ValueError('Unsupported CH format version: {}'.format(meta.get('version')))
+            arrays = {name: data[name] for name in cls._ARRAYS}
+        return cls(arrays, meta['digest'])
+
+    def query(self, source, target):
+        """Возвращает (вес, номера рёбер графа по порядку) или None, если пути нет."""
+        if source == target:
+            return 0.0, []
+        tails, heads, weights = memoryview(self.tails), memoryview(self.heads), memoryview(self.weights)
+        sides = (
+            (memoryview(self.up_indptr), memoryview(self.up_edges), heads),
+            (memoryview(self.down_indptr), memoryview(self.down_edges), tails)
+        )
+        dist = ({source: 0.0}, {target: 0.0})
+        pred = ({source: -1}, {target: -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = _INF
+        meet = -1
+        side = 0
+        while heaps[0] or heaps[1]:
+            if not heaps[side] or (heaps[1 - side] and heaps[1 - side][0][0] < heaps[side][0][0]):
+                side = 1 - side
+            cost, node = heapq.heappop(heaps[side])
+            if cost >= best:
+                # В этом направлении улучшить путь уже нельзя.
+                del heaps[side][:]
+                continue
+            if cost > dist[side][node]:
+                continue
+            indptr, edges, ends = sides[side]
+            near, far = dist[side], dist[1 - side]
+            for position in range(indptr[node], indptr[node + 1]):
+                edge = edges[position]
+                neighbour = ends[edge]
+                candidate = cost + weights[edge]
+                if candidate < near.get(neighbour, _INF):
+                    near[neighbour] = candidate
+                    pred[side][neighbour] = edge
+                    heapq.heappush(heaps[side], (candidate, neighbour))
+                    other = far.get(neighbour)
+                    if other is not None and candidate + other < best:
+                        best, meet = candidate + other, neighbour
+            if node in far and cost + far[node] < best:
+                best, meet = cost + far[node], node
+        if meet < 0:
+            return None
+        chain = []
+        node = meet
+        while pred[0][node] >= 0:
+            chain.append(pred[0][node])
+            node = tails[pred[0][node]]
+        chain.reverse()
+        node = meet
+        while pred[1][node] >= 0:
+            chain.append(pred[1][node])
+            node = heads[pred[1][node]]
+        return best, self._unpack(chain)
+
+    def _unpack(self, chain):
+        first, second = memoryview(self.first), memoryview(self.second)
+        result = []
+        stack = list(reversed(chain))
+        while stack:
+            edge = stack.pop()
+            if second[edge] >= 0:
+                stack.append(second[edge])
+                stack.append(first[edge])
+            else:
+                result.append(first[edge])
+        return result
+
+
+class ShortestPathEngine:
+    """Маршруты между координатами по графу в памяти."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        reverse = np.argsort(graph.targets, kind='stable')
+        self._reverse_edges = reverse.astype(np.int64)
+        self._reverse_indptr = np.zeros(graph.node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(graph.targets, minlength=graph.node_count), out=self._reverse_indptr[1:])
+        self.ch = None
+        self._ch_version = None
+
+    def default_ch_path(self):
+        """Путь кэша иерархии: файл ``ch.npz`` в каталоге ``*.graph`` или None."""
+        path = self.graph.path
+        if path and os.path.isdir(path):
+            return os.path.join(path, CH_FILENAME)
+        return None
+
+    def prepare_ch(self, path=None, settle_limit=WITNESS_SETTLE_LIMIT):
+        """Загружает иерархию из кэша, если она построена для текущих весов, иначе строит и сохраняет."""
+        path = path or self.default_ch_path()
+        digest = weights_digest(self.graph.weights)
+        ch = None
+        if path and os.path.exists(path):
+            try:
+                ch = ContractionHierarchy.load(path)
+            except (OSError, ValueError, KeyError):
+                ch = None
+            if ch is not None and ch.digest != digest:
+                ch = None
+        if ch is None:
+            ch = ContractionHierarchy.build(self.graph, settle_limit=settle_limit)
+            if path:
+                try:
+                    ch.save(path)
+                except OSError:
+                    pass
+        self.ch = ch
+        self._ch_version = self.graph.weights_version
+        return ch
+
+    @property
+    def ch_ready(self):
+        return self.ch is not None and self._ch_version == self.graph.weights_version
+
+    def route(self, start, end, algorithm=None):
+        """Строит маршрут между точками (``'lon,lat'`` или пара чисел).
+
+        Точки привязываются к ближайшим узлам графа. Возвращает словарь с
+        ``distance`` (м), ``duration`` (с), OSM id узлов пути ``nodes``,
+        ``waypoints`` и использованным алгоритмом, или None, если пути нет.
+        По умолчанию используется CH, когда иерархия актуальна, иначе
+        двунаправленный Дейкстра; устаревшая CH тоже заменяется им.
+        """
+        points = [_parse_point(start), _parse_point(end)]
+        lons, lats = zip(*points)
+        indices, distances = self.graph.nearest(lons, lats, 1)
+        source, target = int(indices[0, 0]), int(indices[1, 0])
+        if source < 0 or target < 0:
+            return None
+        if algorithm is None or (algorithm == 'ch' and not self.ch_ready):
+            algorithm = 'ch' if self.ch_ready else 'dijkstra'
+        found = self.shortest_path(source, target, algorithm)
+        if found is None:
+            return None
+        _, edges = found
+        graph = self.graph
+        edges = np.asarray(edges, dtype=np.int64)
+        path = [source] + graph.targets[edges].tolist()
+        return {
+            'distance': float(graph.lengths[edges].sum(dtype=np.float64)),
+            'duration': float(graph.weights[edges].sum(dtype=np.float64)),
+            'nodes': graph.node_ids[path].tolist(),
+            'waypoints': [{
+                'location': [float(graph.lon[node]), float(graph.lat[node])],
+                'distance': float(distances[index, 0])
+            } for index, node in enumerate((source, target))],
+            'algorithm': algorithm
+        }
+
+    def shortest_path(self, source, target, algorithm='dijkstra'):
+        """Возвращает (вес, номера рёбер пути) между узлами или None."""
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown algorithm: {}'.format(algorithm))
+        if algorithm == 'ch':
+            if not self.ch_ready:
+                raise ValueError('Contraction hierarchy is not prepared for the current weights')
+            return self.ch.query(source, target)
+        if algorithm == 'astar':
+            return self._astar(source, target)
+        return self._bidirectional(source, target)
+
+    def _bidirectional(self, source, target):
+        if source == target:
+            return 0.0, []
+        graph = self.graph
+        weights = memoryview(graph.weights)
+        sources, targets = memoryview(graph.sources), memoryview(graph.targets)
+        forward_indptr = memoryview(graph.indptr)
+        reverse_indptr, reverse_edges = memoryview(self._reverse_indptr), memoryview(self._reverse_edges)
+        dist = ({source: 0.0}, {target: 0.0})
+        pred = ({source: -1}, {target: -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = _INF
+        meet = -1
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            cost, node = heapq.heappop(heaps[side])
+            if cost > dist[side][node]:
+                continue
+            near, far = dist[side], dist[1 - side]
+            if side == 0:
+                edges = range(forward_indptr[node], forward_indptr[node + 1])
+            else:
+                edges = (reverse_edges[i] for i in range(reverse_indptr[node], reverse_indptr[node + 1]))
+            ends = targets if side == 0 else sources
+            for edge in edges:
+                neighbour = ends[edge]
+                candidate = cost + weights[edge]
+                if candidate < near.get(neighbour, _INF):
+                    near[neighbour] = candidate
+                    pred[side][neighbour] = edge
+                    heapq.heappush(heaps[side], (candidate, neighbour))
+                    other = far.get(neighbour)
+                    if other is not None and candidate + other < best:
+                        best, meet = candidate + other, neighbour
+        if meet < 0:
+            return None
+        chain = []
+        node = meet
+        while pred[0][node] >= 0:
+            chain.append(pred[0][node])
+            node = sources[pred[0][node]]
+        chain.reverse()
+        node = meet
+        while pred[1][node] >= 0:
+            chain.append(pred[1][node])
+            node = targets[pred[1][node]]
+        return best, chain
+
+    def _astar(self, source, target):
+        graph = self.graph
+        weights = memoryview(graph.weights)
+        sources, targets, indptr = memoryview(graph.sources), memoryview(graph.targets), memoryview(graph.indptr)
+        lons, lats = memoryview(graph.lon), memoryview(graph.lat)
+        target_lon = math.radians(lons[target])
+        target_lat = math.radians(lats[target])
+        cos_target = math.cos(target_lat)
+        # Вес ребра не меньше его длины при максимальной скорости графа; запас — на округление float32.
+        seconds_per_meter = 3.6 / float(graph.speeds.max()) * (1 - 1e-6) if graph.edge_count else 0.0
+        scale = 2 * EARTH_RADIUS_M * seconds_per_meter
+        estimates = {}
+
+        def estimate(node):
+            value = estimates.get(node)
+            if value is None:
+                lat = math.radians(lats[node])
+                a = (math.sin((target_lat - lat) / 2) ** 2
+                     + math.cos(lat) * cos_target * math.sin((target_lon - math.radians(lons[node])) / 2) ** 2)
+                value = estimates[node] = scale * math.asin(math.sqrt(min(1.0, a)))
+            return value
+
+        dist = {source: 0.0}
+        pred = {source: -1}
+        heap = [(estimate(source), 0.0, source)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if cost > dist[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = targets[edge]
+                candidate = cost + weights[edge]
+                if candidate < dist.get(neighbour, _INF):
+                    dist[neighbour] = candidate
+                    pred[neighbour] = edge
+                    heapq.heappush(heap, (candidate + estimate(neighbour), candidate, neighbour))
+        if target not in dist:
+            return None
+        chain = []
+        node = target
+        while pred[node] >= 0:
+            chain.append(pred[node])
+            node = sources[pred[node]]
+        chain.reverse()
+        return dist[target], chain
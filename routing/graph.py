@@ -1,14 +1,506 @@
-"""Управление графом дорожной сети."""
+"""Управление графом дорожной сети.
 
+Граф хранится в компактном виде CSR: рёбра отсортированы по исходному
+узлу, ``indptr[v]:indptr[v + 1]`` — срез рёбер узла ``v``. Все данные —
+массивы NumPy, которые сохраняются в каталог ``*.graph`` файлами ``.npy``
+и при загрузке отображаются в память (``mmap``), поэтому старт быстрый,
+а страницы делятся между воркерами.
 
-class Graph:
-    """Заглушка объекта графа."""
+Граф строится из выгрузки OSM (``.osm.pbf`` из ``scripts/update_data.py``
+или ``.osm``). Бинарные файлы ``.osrm`` не читаются: их формат внутренний
+и меняется между версиями OSRM; для пути ``*.osrm`` используется лежащий
+рядом кэш ``*.graph`` либо исходный ``*.osm.pbf``.
 
-    def load(self, path):
-        """Загружает граф из файла."""
-        # Реализация может быть добавлена при расширении проекта
+Сборка кэша: ``python -m routing.graph data/odessa_oblast.osm.pbf``.
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from routing.osm import iter_osm
+from routing.spatial import GridIndex
+
+
+GRAPH_FORMAT_VERSION = 1
+EARTH_RADIUS_M = 6371008.8
+
+# Скорости по умолчанию (км/ч), как в профиле car.lua OSRM.
+HIGHWAY_SPEEDS = {
+    'motorway': 90,
+    'motorway_link': 45,
+    'trunk': 85,
+    'trunk_link': 40,
+    'primary': 65,
+    'primary_link': 30,
+    'secondary': 55,
+    'secondary_link': 25,
+    'tertiary': 40,
+    'tertiary_link': 20,
+    'unclassified': 25,
+    'residential': 25,
+    'living_street': 10,
+    'service': 15
+}
+_NO_ACCESS = ('no', 'private', 'agricultural', 'forestry', 'delivery')
+_ONEWAY_YES = ('yes', '1', 'true')
+_IMPLIED_ONEWAY = ('motorway',)
+
+# Массивы графа: имя -> тип. Порядок рёбер везде один — порядок CSR.
+_ARRAYS = (
+    ('node_ids', np.int64),
+    ('lon', np.float64),
+    ('lat', np.float64),
+    ('indptr', np.int64),
+    ('sources', np.int32),
+    ('targets', np.int32),
+    ('lengths', np.float32),
+    ('speeds', np.float32),
+    ('weights', np.float32),
+    ('way_ids', np.int64)
+)
+# Массивы, которые меняются на месте и потому копируются в память при загрузке.
+_WRITABLE = ('weights',)
+
+# Наблюдаемая скорость ограничивается долями скорости свободного потока.
+TRAFFIC_MIN_FACTOR = 0.05
+TRAFFIC_MAX_FACTOR = 1.0
+# Доля наблюдения при смешивании со скоростью свободного потока.
+TRAFFIC_BLEND = 1.0
+# Изменения веса меньше этой доли не считаются изменением ребра.
+WEIGHT_TOLERANCE = 1e-4
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """Расстояние по большому кругу в метрах; принимает массивы."""
+    lon1, lat1, lon2, lat2 = (np.radians(value) for value in (lon1, lat1, lon2, lat2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def parse_maxspeed(value):
+    """Возвращает ограничение скорости в км/ч или None, если его не разобрать."""
+    if not value:
+        return None
+    text = value.strip().lower()
+    factor = 1.0
+    if text.endswith('mph'):
+        factor = 1.609344
+        text = text[:-3].strip()
+    try:
+        speed = float(text) * factor
+    except ValueError:
         return None
+    return speed if speed > 0 else None
 
-    def update_weights(self, data):
-        """Обновляет веса рёбер на основе трафика."""
+
+def way_profile(tags):
+    """Возвращает (скорость км/ч, направление) для дороги или None, если по ней не проехать.
+
+    Направление: 0 — в обе стороны, 1 — по порядку узлов, -1 — против.
+    """
+    highway = tags.get('highway')
+    if highway not in HIGHWAY_SPEEDS or tags.get('area') == 'yes':
         return None
+    for key in ('access', 'vehicle', 'motor_vehicle', 'motorcar'):
+        if tags.get(key) in _NO_ACCESS:
+            return None
+    speed = parse_maxspeed(tags.get('maxspeed')) or HIGHWAY_SPEEDS[highway]
+    oneway = tags.get('oneway')
+    if oneway == '-1':
+        direction = -1
+    elif (oneway in _ONEWAY_YES or tags.get('junction') in ('roundabout', 'circular')
+          or (highway in _IMPLIED_ONEWAY and oneway != 'no')):
+        direction = 1
+    else:
+        direction = 0
+    return speed, direction
+
+
+class Graph:
+    """Ориентированный граф дорог в формате CSR."""
+
+    def __init__(self):
+        for name, _ in _ARRAYS:
+            setattr(self, name, None)
+        self.path = None
+        self.index = None
+        self._way_edges = None
+        self._node_sorter = None
+        # Растёт при каждом изменении весов: по нему находят устаревшую предобработку.
+        self.weights_version = 0
+
+    @property
+    def loaded(self):
+        return self.indptr is not None
+
+    @property
+    def node_count(self):
+        return 0 if self.node_ids is None else len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return 0 if self.targets is None else len(self.targets)
+
+    @classmethod
+    def from_edges(cls, node_ids, lon, lat, sources, targets, speeds, way_ids, lengths=None):
+        """Строит CSR из списка рёбер в произвольном порядке.
+
+        ``sources``/``targets`` — индексы узлов в ``node_ids``; длины, если не
+        заданы, считаются по координатам. Вес ребра — время проезда в секундах.
+        """
+        graph = cls()
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if lengths is None:
+            lengths = haversine(
+                np.asarray(lon)[sources], np.asarray(lat)[sources],
+                np.asarray(lon)[targets], np.asarray(lat)[targets]
+            )
+        order = np.lexsort((targets, sources))
+        graph.node_ids = np.asarray(node_ids, dtype=np.int64)
+        graph.lon = np.asarray(lon, dtype=np.float64)
+        graph.lat = np.asarray(lat, dtype=np.float64)
+        graph.sources = sources[order].astype(np.int32)
+        graph.targets = targets[order].astype(np.int32)
+        graph.lengths = np.asarray(lengths, dtype=np.float32)[order]
+        graph.speeds = np.asarray(speeds, dtype=np.float32)[order]
+        graph.way_ids = np.asarray(way_ids, dtype=np.int64)[order]
+        graph.weights = (graph.lengths / (graph.speeds / np.float32(3.6))).astype(np.float32)
+        counts = np.bincount(graph.sources, minlength=len(graph.node_ids))
+        graph.indptr = np.zeros(len(graph.node_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=graph.indptr[1:])
+        return graph
+
+    @classmethod
+    def from_osm(cls, path):
+        """Строит граф из выгрузки OSM: узлы всех проезжих для автомобиля дорог."""
+        refs = []
+        way_index = []
+        way_ids = []
+        way_speeds = []
+        way_directions = []
+        for event in iter_osm(path, nodes=False):
+            _, way_id, way_refs, tags = event
+            profile = way_profile(tags)
+            if profile is None or len(way_refs) < 2:
+                continue
+            refs.extend(way_refs)
+            way_index.extend([len(way_ids)] * len(way_refs))
+            way_ids.append(way_id)
+            way_speeds.append(profile[0])
+            way_directions.append(profile[1])
+
+        refs = np.asarray(refs, dtype=np.int64)
+        way_index = np.asarray(way_index, dtype=np.int64)
+        node_ids, ref_nodes = np.unique(refs, return_inverse=True)
+        ref_nodes = ref_nodes.reshape(-1)
+        lon = np.full(len(node_ids), np.nan)
+        lat = np.full(len(node_ids), np.nan)
+        for event in iter_osm(path, ways=False):
+            _, ids, lons, lats = event
+            ids = np.asarray(ids, dtype=np.int64)
+            positions = np.searchsorted(node_ids, ids)
+            positions[positions >= len(node_ids)] = 0
+            found = node_ids[positions] == ids
+            lon[positions[found]] = np.asarray(lons)[found]
+            lat[positions[found]] = np.asarray(lats)[found]
+
+        # Соседние ссылки одной линии образуют отрезок.
+        same_way = way_index[:-1] == way_index[1:]
+        start = ref_nodes[:-1][same_way]
+        end = ref_nodes[1:][same_way]
+        segment_way = way_index[:-1][same_way]
+        directions = np.asarray(way_directions, dtype=np.int8)[segment_way]
+        forward = directions >= 0
+        backward = directions <= 0
+        sources = np.concatenate([start[forward], end[backward]])
+        targets = np.concatenate([end[forward], start[backward]])
+        edge_ways = np.concatenate([segment_way[forward], segment_way[backward]])
+
+        # Узлы без координат (обрезанные краем выгрузки линии) и петли отбрасываются.
+        known = ~np.isnan(lon)
+        keep = known[sources] & known[targets] & (sources != targets)
+        sources, targets, edge_ways = sources[keep], targets[keep], edge_ways[keep]
+        remap = np.cumsum(known) - 1
+        graph = cls.from_edges(
+            node_ids[known], lon[known], lat[known],
+            remap[sources], remap[targets],
+            np.asarray(way_speeds, dtype=np.float32)[edge_ways],
+            np.asarray(way_ids, dtype=np.int64)[edge_ways]
+        )
+        graph.path = path
+        return graph
+
+    def save(self, directory):
+        """Сохраняет массивы графа в каталог файлами ``.npy``."""
+        os.makedirs(directory, exist_ok=True)
+        for name, dtype in _ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), np.asarray(getattr(self, name), dtype=dtype))
+        meta = {
+            'version': GRAPH_FORMAT_VERSION,
+            'nodes': self.node_count,
+            'edges': self.edge_count,
+            'source': self.path
+        }
+        with open(os.path.join(directory, 'meta.json'), 'w') as handle:
+            json.dump(meta, handle)
+        return directory
+
+    def _load_directory(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as handle:
+            meta = json.load(handle)
+        if meta.get('version') != GRAPH_FORMAT_VERSION:
+            raise ValueError('Unsupported graph format version: {}'.format(meta.get('version')))
+        for name, _ in _ARRAYS:
+            array = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+            if name in _WRITABLE:
+                array = np.array(array)
+            setattr(self, name, array)
+
+    def load(self, path):
+        """Загружает граф из каталога ``*.graph``, выгрузки OSM или по пути ``*.osrm``.
+
+        Для ``*.osrm`` ищется кэш ``*.graph`` рядом; если его нет, граф
+        строится из ``*.osm.pbf`` и кэш сохраняется, когда каталог доступен
+        для записи.
+        """
+        if path.endswith('.osrm'):
+            base = path[:-len('.osrm')]
+            cache = base + '.graph'
+            if os.path.exists(os.path.join(cache, 'meta.json')):
+                path = cache
+            else:
+                built = Graph.from_osm(base + '.osm.pbf')
+                try:
+                    built.save(cache)
+                except OSError:
+                    pass
+                return self._adopt(built)
+        if os.path.isdir(path):
+            self._load_directory(path)
+            self.path = path
+            self.index = None
+            self._way_edges = None
+            self._node_sorter = None
+            self.weights_version += 1
+            return self
+        return self._adopt(Graph.from_osm(path))
+
+    def _adopt(self, other):
+        for name, _ in _ARRAYS:
+            setattr(self, name, getattr(other, name))
+        self.path = other.path
+        self.index = other.index
+        self._way_edges = other._way_edges
+        self._node_sorter = other._node_sorter
+        self.weights_version += 1
+        return self
+
+    def edges_from(self, node):
+        """Возвращает срез рёбер, выходящих из узла."""
+        return slice(int(self.indptr[node]), int(self.indptr[node + 1]))
+
+    def node_index(self, osm_ids):
+        """Возвращает индексы узлов по OSM id; неизвестные — -1."""
+        osm_ids = np.asarray(osm_ids, dtype=np.int64).reshape(-1)
+        if not self.node_count:
+            return np.full(len(osm_ids), -1, dtype=np.int64)
+        if self._node_sorter is None:
+            self._node_sorter = np.argsort(self.node_ids, kind='stable')
+        slots = np.minimum(np.searchsorted(self.node_ids, osm_ids, sorter=self._node_sorter), self.node_count - 1)
+        positions = self._node_sorter[slots]
+        return np.where(self.node_ids[positions] == osm_ids, positions, -1)
+
+    def find_edges(self, from_nodes, to_nodes):
+        """Возвращает номера рёбер по парам OSM id узлов; пары без ребра — -1.
+
+        Рёбра CSR отсортированы по (источник, назначение), поэтому поиск —
+        два ``searchsorted`` на массивах; из параллельных рёбер берётся первое.
+        """
+        from_nodes = np.asarray(from_nodes, dtype=np.int64).reshape(-1)
+        to_nodes = np.asarray(to_nodes, dtype=np.int64).reshape(-1)
+        result = np.full(len(from_nodes), -1, dtype=np.int64)
+        if not self.node_count or not len(from_nodes):
+            return result
+        sources = self.node_index(from_nodes)
+        targets = self.node_index(to_nodes)
+        known = (sources >= 0) & (targets >= 0)
+        keys = self.sources.astype(np.int64) * self.node_count + self.targets
+        wanted = np.where(known, sources * self.node_count + targets, -1)
+        positions = np.minimum(np.searchsorted(keys, wanted), max(self.edge_count - 1, 0))
+        found = known & (keys[positions] == wanted) if self.edge_count else np.zeros(len(wanted), dtype=bool)
+        result[found] = positions[found]
+        return result
+
+    def build_index(self):
+        """Строит пространственный индекс узлов, если его ещё нет."""
+        if self.index is None and self.loaded:
+            self.index = GridIndex(self.lon, self.lat)
+        return self.index
+
+    def nearest(self, lon, lat, k=1):
+        """Пакетный поиск k ближайших узлов.
+
+        Возвращает (индексы узлов, расстояния в метрах) — массивы формы
+        (n, k); отсутствующие соседи помечены -1 и ``inf``.
+        """
+        indices, distances = self.build_index().query(lon, lat, k)
+        if not self.node_count:
+            return indices, distances
+        found = indices >= 0
+        safe = np.where(found, indices, 0)
+        distances = haversine(
+            np.atleast_1d(lon)[:, None], np.atleast_1d(lat)[:, None], self.lon[safe], self.lat[safe]
+        )
+        distances = np.where(found, distances, np.inf)
+        # Проекция на плоскость могла чуть переставить почти равноудалённых соседей.
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(indices, order, 1), np.take_along_axis(distances, order, 1)
+
+    def stats(self):
+        """Возвращает размеры графа и занимаемую массивами память."""
+        if not self.loaded:
+            return {'loaded': False}
+        return {
+            'loaded': True,
+            'path': self.path,
+            'nodes': self.node_count,
+            'edges': self.edge_count,
+            'bytes': int(sum(getattr(self, name).nbytes for name, _ in _ARRAYS)),
+            'index': self.index is not None
+        }
+
+    def way_edges(self):
+        """Возвращает индекс линия -> рёбра: (id линий по возрастанию, indptr, номера рёбер).
+
+        Рёбра линии ``way_keys[i]`` — ``edges[indptr[i]:indptr[i + 1]]``.
+        Индекс строится один раз и переиспользуется всеми обновлениями.
+        """
+        if self._way_edges is None:
+            edges = np.argsort(self.way_ids, kind='stable')
+            way_keys, counts = np.unique(self.way_ids[edges], return_counts=True)
+            indptr = np.zeros(len(way_keys) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self._way_edges = (way_keys, indptr, edges)
+        return self._way_edges
+
+    def _way_segments(self, edges, counts):
+        """Число различных отрезков (неупорядоченных пар узлов) в каждой группе рёбер ``edges``."""
+        group = np.repeat(np.arange(len(counts)), counts)
+        low = np.minimum(self.sources[edges], self.targets[edges])
+        high = np.maximum(self.sources[edges], self.targets[edges])
+        order = np.lexsort((high, low, group))
+        group, low, high = group[order], low[order], high[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (group[1:] != group[:-1]) | (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+        return np.bincount(group[first], minlength=len(counts))
+
+    def update_weights(self, data, values=None, key='way', kind='speed', blend=TRAFFIC_BLEND):
+        """Обновляет веса рёбер по наблюдениям трафика одной векторной операцией.
+
+        ``data`` — словарь {идентификатор: значение}, массив пар формы (n, 2)
+        или массив идентификаторов, если значения переданы в ``values``.
+        Идентификатор — OSM id линии (``key='way'``) или номер ребра в CSR
+        (``key='edge'``); значение — скорость в км/ч (``kind='speed'``) или
+        время проезда линии (в одном направлении) или ребра в секундах
+        (``kind='duration'``).
+        Повторные наблюдения одного объекта усредняются, неизвестные
+        идентификаторы и неположительные значения отбрасываются. Скорость
+        ограничивается долями ``TRAFFIC_MIN_FACTOR``..``TRAFFIC_MAX_FACTOR``
+        от скорости свободного потока и смешивается с ней с долей ``blend``.
+
+        Возвращает номера изменившихся рёбер по возрастанию.
+        """
+        if key not in ('way', 'edge'):
+            raise ValueError('Unknown observation key: {}'.format(key))
+        if kind not in ('speed', 'duration'):
+            raise ValueError('Unknown observation kind: {}'.format(kind))
+        ids, observed = _observations(data, values)
+        usable = np.isfinite(observed) & (observed > 0)
+        ids, observed = ids[usable], observed[usable]
+
+        if key == 'way':
+            way_keys, indptr, way_edges = self.way_edges()
+            slots = np.searchsorted(way_keys, ids)
+            slots[slots >= len(way_keys)] = 0
+            known = way_keys[slots] == ids if len(way_keys) else np.zeros(len(ids), dtype=bool)
+            slots, observed = slots[known], observed[known]
+            slot_count = len(way_keys)
+        else:
+            known = (ids >= 0) & (ids < self.edge_count)
+            slots, observed = ids[known], observed[known]
+            slot_count = self.edge_count
+
+        hits = np.bincount(slots, minlength=slot_count)
+        touched = np.flatnonzero(hits)
+        mean = np.bincount(slots, weights=observed, minlength=slot_count)[touched] / hits[touched]
+        if key == 'way':
+            counts = indptr[touched + 1] - indptr[touched]
+            starts = np.cumsum(counts) - counts
+            edges = way_edges[np.repeat(indptr[touched] - starts, counts) + np.arange(int(counts.sum()))]
+            if kind == 'duration' and len(edges):
+                # Время линии переводится в скорость по длине одного направления: у двусторонней
+                # линии каждый отрезок есть дважды, поэтому длина делится на число рёбер на отрезок.
+                way_length = np.add.reduceat(self.lengths[edges].astype(np.float64), starts)
+                mean = way_length * self._way_segments(edges, counts) / counts / mean * 3.6
+            speed = np.repeat(mean, counts)
+        else:
+            edges = touched
+            speed = self.lengths[edges] / mean * 3.6 if kind == 'duration' else mean
+
+        free_flow = self.speeds[edges].astype(np.float64)
+        speed = np.clip(speed, free_flow * TRAFFIC_MIN_FACTOR, free_flow * TRAFFIC_MAX_FACTOR)
+        speed = blend * speed + (1.0 - blend) * free_flow
+        weights = (self.lengths[edges] / (speed / 3.6)).astype(np.float32)
+        old = self.weights[edges]
+        changed = np.abs(weights - old) > WEIGHT_TOLERANCE * old
+        edges = edges[changed]
+        if len(edges):
+            self.weights[edges] = weights[changed]
+            self.weights_version += 1
+        return np.sort(edges)
+
+    def free_flow_weights(self):
+        """Веса рёбер без учёта трафика, по скоростям профиля."""
+        return (self.lengths / (self.speeds / np.float32(3.6))).astype(np.float32)
+
+    def reset_weights(self):
+        """Возвращает веса свободного потока; возвращает номера изменившихся рёбер."""
+        free = self.free_flow_weights()
+        changed = np.flatnonzero(free != self.weights)
+        if len(changed):
+            self.weights[changed] = free[changed]
+            self.weights_version += 1
+        return changed
+
+
+def _observations(data, values):
+    """Приводит наблюдения к паре массивов (идентификаторы int64, значения float64)."""
+    if values is not None:
+        return np.asarray(data, dtype=np.int64).reshape(-1), np.asarray(values, dtype=np.float64).reshape(-1)
+    if isinstance(data, dict):
+        return (np.fromiter(data.keys(), dtype=np.int64, count=len(data)),
+                np.fromiter(data.values(), dtype=np.float64, count=len(data)))
+    pairs = np.asarray(data, dtype=np.float64).reshape(-1, 2)
+    return pairs[:, 0].astype(np.int64), pairs[:, 1]
+
+def main(argv=None):
+    """Строит кэш графа из выгрузки OSM: ``python -m routing.graph map.osm.pbf [out.graph]``."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print('usage: python -m routing.graph MAP.osm.pbf [OUT.graph]')
+        return 2
+    source = argv[0]
+    target = argv[1] if len(argv) > 1 else source.replace('.osm.pbf', '').replace('.osm', '') + '.graph'
+    graph = Graph.from_osm(source)
+    graph.save(target)
+    print('{nodes} nodes, {edges} edges, {bytes} bytes -> {target}'.format(target=target, **graph.stats()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
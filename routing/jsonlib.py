@@ -0,0 +1,38 @@
+"""Быстрая сериализация JSON с запасным вариантом на стандартной библиотеке.
+
+Если установлен ``orjson``, разбор и сериализация больших ответов OSRM
+идут через него; иначе используется модуль ``json``.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+FAST = orjson is not None
+
+
+def loads(data):
+    """Разбирает JSON из bytes или str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Сериализует объект в компактный JSON в виде bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def response_json(resp):
+    """Разбирает тело ответа requests; без orjson ведёт себя как ``resp.json()``."""
+    if orjson is None:
+        return resp.json()
+    return orjson.loads(resp.content)
@@ -0,0 +1,188 @@
+"""Потоковое чтение JSON по кускам без загрузки всего документа в память.
+
+``JSONStreamReader`` проходит структуру документа (объекты и массивы)
+сам, а нужные значения целиком разбирает ``jsonlib.loads`` — так участок
+маршрута разбирается быстрым парсером, а геометрия и прочие ненужные поля
+пропускаются без накопления текста. В буфере одновременно держится только
+текущее значение и недочитанный кусок.
+"""
+
+import codecs
+import re
+
+from routing import jsonlib
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURAL = re.compile(r'["\[\]{}]')
+_STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_SCALAR = re.compile(r'[^,\]}\s]*')
+
+
+class JSONStreamReader:
+    """Читает JSON из итератора кусков bytes.
+
+    ``iter_object`` и ``iter_array`` отдают ключи и индексы; значение под
+    каждым из них вызывающий обязан прочитать (``read_value``,
+    ``skip_value`` или вложенный ``iter_*``) до следующей итерации.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, keep):
+        """Дочитывает кусок, отбрасывая буфер до ``keep``; возвращает сдвиг или None в конце."""
+        if self._eof:
+            return None
+        text = ''
+        while not text:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                text = self._decoder.decode(b'', final=True)
+                if not text:
+                    return None
+                break
+            text = self._decoder.decode(chunk)
+        self._buf = self._buf[keep:] + text
+        self._pos -= keep
+        return keep
+
+    def _more(self, keep):
+        shift = self._fill(keep)
+        if shift is None:
+            raise ValueError('unexpected end of JSON stream')
+        return shift
+
+    def peek(self):
+        """Возвращает следующий значащий символ, не потребляя его; None — конец потока."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._fill(self._pos) is None:
+                return None
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('expected {!r} in JSON stream, got {!r}'.format(char, found))
+        self._pos += 1
+
+    def _string_end(self, index, keep_from):
+        """Возвращает (индекс за закрывающей кавычкой, суммарный сдвиг буфера).
+
+        Тело строки начинается с ``index``; буфер до ``keep_from`` можно отбросить.
+        """
+        shifted = 0
+        while True:
+            match = _STRING_TAIL.match(self._buf, index)
+            if match is not None:
+                return match.end(), shifted
+            shift = self._more(keep_from)
+            index -= shift
+            keep_from -= shift
+            shifted += shift
+
+    def _scan(self, keep):
+        """Находит конец значения в текущей позиции; возвращает (start, end) в буфере.
+
+        При ``keep=False`` уже пройденный текст отбрасывается, и ``start``
+        не имеет смысла.
+        """
+        char = self.peek()
+        if char is None:
+            raise ValueError('unexpected end of JSON stream')
+        start = self._pos
+        if char == '"':
+            end, shifted = self._string_end(start + 1, start)
+            return start - shifted, end
+        if char not in '{[':
+            while True:
+                end = _SCALAR.match(self._buf, start).end()
+                if end < len(self._buf):
+                    break
+                shift = self._fill(start)
+                if shift is None:
+                    break
+                start -= shift
+            if end == start:
+                raise ValueError('invalid JSON value at {!r}'.format(self._buf[start:start + 20]))
+            return start, end
+
+        depth = 0
+        index = start
+        while True:
+            match = _STRUCTURAL.search(self._buf, index)
+            if match is None:
+                scanned = len(self._buf)
+                shift = self._more(start if keep else scanned)
+                start -= shift
+                index = scanned - shift
+                continue
+            char = match.group()
+            index = match.end()
+            if char == '"':
+                index, shifted = self._string_end(index, start if keep else index)
+                start -= shifted
+            elif char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return start, index
+
+    def read_raw(self):
+        """Возвращает текст следующего значения."""
+        start, end = self._scan(True)
+        self._pos = end
+        return self._buf[start:end]
+
+    def read_value(self):
+        """Разбирает следующее значение целиком."""
+        return jsonlib.loads(self.read_raw())
+
+    def skip_value(self):
+        """Пропускает следующее значение, не накапливая его текст."""
+        _, end = self._scan(False)
+        self._pos = end
+
+    def _separator(self, closing):
+        char = self.peek()
+        if char == ',':
+            self._pos += 1
+            return True
+        if char == closing:
+            self._pos += 1
+            return False
+        raise ValueError('expected "," or {!r} in JSON stream, got {!r}'.format(closing, char))
+
+    def iter_object(self):
+        """Отдаёт ключи объекта по очереди."""
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if not self._separator('}'):
+                return
+
+    def iter_array(self):
+        """Отдаёт индексы элементов массива по очереди."""
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if not self._separator(']'):
+                return
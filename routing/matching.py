@@ -0,0 +1,173 @@
+"""Склейка результатов map matching, посчитанных перекрывающимися окнами."""
+
+
+# Параметры /match со значением для каждой точки трека.
+PER_POINT_PARAMS = ('timestamps', 'radiuses', 'bearings', 'hints', 'approaches')
+
+
+def match_windows(count, size, overlap):
+    """Возвращает окна (start, end, own_start, own_end) для трека из count точек.
+
+    Соседние окна перекрываются на ``overlap`` точек; каждая точка
+    перекрытия принадлежит ровно одному окну — первая половина предыдущему,
+    вторая следующему. В каждом окне не меньше двух точек.
+    """
+    if count <= size:
+        return [(0, count, 0, count)]
+    overlap = max(0, min(overlap, size - 1))
+    step = size - overlap
+    starts = list(range(0, count - overlap, step))
+    windows = []
+    for index, start in enumerate(starts):
+        end = min(start + size, count)
+        own_start = 0 if index == 0 else start + overlap // 2
+        own_end = count if index == len(starts) - 1 else starts[index + 1] + overlap // 2
+        windows.append((start, end, own_start, own_end))
+        if end == count:
+            windows[-1] = (start, end, own_start, count)
+            break
+    start, end, own_start, own_end = windows[-1]
+    if end - start < 2:
+        # Одну точку OSRM не сопоставит, а удлинить предыдущее окно не даёт предел size:
+        # последнее окно забирает точку предыдущего, владея по-прежнему только хвостом.
+        windows[-1] = (end - 2, end, own_start, own_end)
+    return windows
+
+
+def window_params(params, start, end):
+    """Вырезает значения поточечных параметров для окна трека."""
+    query = {}
+    for key, value in params.items():
+        if key in PER_POINT_PARAMS:
+            query[key] = ';'.join(str(value).split(';')[start:end])
+        else:
+            query[key] = value
+    return query
+
+
+class MatchMerger:
+    """Последовательно склеивает ответы окон в один ответ /match.
+
+    Окна подаются по порядку; после ``add`` ответ окна больше не нужен,
+    поэтому в памяти остаются только итоговые tracepoints и legs.
+    Геометрия окон не склеивается — для длинных треков её следует
+    собирать из шагов (``steps=true``).
+    """
+
+    def __init__(self, count):
+        self.tracepoints = [None] * count
+        self.matchings = []
+        self.chunks = []
+        self._pending = None
+        self._first_error = None
+
+    def add(self, window, response):
+        """Добавляет ответ окна ``window`` = (start, end, own_start, own_end)."""
+        start, end, own_start, own_end = window
+        code = response.get('code')
+        local_matchings = response.get('matchings') or []
+        self.chunks.append({
+            'start': start,
+            'end': end,
+            'code': code,
+            'confidence': [matching.get('confidence') for matching in local_matchings]
+        })
+        if code != 'Ok':
+            if self._first_error is None:
+                self._first_error = response
+            self._pending = None
+            return
+
+        tracepoints = response.get('tracepoints') or []
+        mapped = {}
+        last = None
+        for position in range(own_start - start, own_end - start):
+            tracepoint = tracepoints[position] if position < len(tracepoints) else None
+            if tracepoint is None:
+                continue
+            local_index = tracepoint.get('matchings_index')
+            waypoint_index = tracepoint.get('waypoint_index')
+            if local_index is None or waypoint_index is None:
+                continue
+            merged_index = mapped.get(local_index)
+            if merged_index is None:
+                merged_index = self._start_matching(
+                    start + position, local_matchings[local_index], last is None
+                )
+                mapped[local_index] = merged_index
+            elif last is not None and last[0] == local_index:
+                legs = local_matchings[local_index].get('legs') or []
+                if waypoint_index - 1 < len(legs):
+                    self._append_leg(merged_index, legs[waypoint_index - 1])
+            merged = self.matchings[merged_index]
+            self.tracepoints[start + position] = dict(
+                tracepoint,
+                matchings_index=merged_index,
+                waypoint_index=merged['waypoints']
+            )
+            merged['waypoints'] += 1
+            last = (local_index, waypoint_index)
+
+        self._pending = self._continuation(start, tracepoints, local_matchings, mapped, last)
+
+    def _start_matching(self, global_index, local_matching, first_in_window):
+        """Продолжает матчинг предыдущего окна или открывает новый."""
+        pending = self._pending
+        self._pending = None
+        if first_in_window and pending is not None and pending['next'] == global_index:
+            merged_index = pending['matching']
+            self._append_leg(merged_index, pending['leg'])
+            self.matchings[merged_index]['confidence'].append(local_matching.get('confidence'))
+            return merged_index
+        self.matchings.append({
+            'legs': [],
+            'waypoints': 0,
+            'confidence': [local_matching.get('confidence')]
+        })
+        return len(self.matchings) - 1
+
+    def _continuation(self, start, tracepoints, local_matchings, mapped, last):
+        """Запоминает участок от последней своей точки окна до следующей точки матчинга."""
+        if last is None:
+            return None
+        local_index, waypoint_index = last
+        legs = local_matchings[local_index].get('legs') or []
+        if waypoint_index >= len(legs):
+            return None
+        for position, tracepoint in enumerate(tracepoints):
+            if (tracepoint is not None
+                    and tracepoint.get('matchings_index') == local_index
+                    and tracepoint.get('waypoint_index') == waypoint_index + 1):
+                return {
+                    'matching': mapped[local_index],
+                    'leg': legs[waypoint_index],
+                    'next': start + position
+                }
+        return None
+
+    def _append_leg(self, merged_index, leg):
+        self.matchings[merged_index]['legs'].append(leg)
+
+    def result(self):
+        """Возвращает итоговый ответ в формате OSRM /match."""
+        if not self.matchings and self._first_error is not None:
+            error = dict(self._first_error)
+            error['chunks'] = self.chunks
+            return error
+        matchings = []
+        for merged in self.matchings:
+            legs = merged['legs']
+            confidences = [value for value in merged['confidence'] if value is not None]
+            matchings.append({
+                'confidence': min(confidences) if confidences else None,
+                'distance': sum(leg.get('distance', 0.0) for leg in legs),
+                'duration': sum(leg.get('duration', 0.0) for leg in legs),
+                'weight': sum(leg.get('weight', 0.0) for leg in legs),
+                'legs': legs
+            })
+        return {
+            'code': 'Ok',
+            'matchings': matchings,
+            'tracepoints': self.tracepoints,
+            'chunks': self.chunks
+        }
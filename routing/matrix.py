@@ -0,0 +1,229 @@
+"""Локальные матрицы длительностей и расстояний «многие ко многим» по графу.
+
+Когда иерархия сжатия актуальна, матрица считается методом корзин
+(bucket-based many-to-many): для каждого назначения обратный поиск вверх
+по иерархии раскладывает метки по корзинам узлов, затем прямой поиск вверх
+от каждого источника сканирует корзины посещённых узлов. Без иерархии
+каждая строка — поиск Дейкстры от источника до всех назначений.
+
+Строки делятся на части по числу процессов пула. Воркеры получают массивы
+графа при старте (при ``fork`` — без копирования, страницы общие), а пул
+пересоздаётся, когда меняются веса графа или иерархия.
+"""
+
+import heapq
+import multiprocessing
+import os
+
+import numpy as np
+
+from routing.engine import _parse_point
+
+
+MATRIX_WORKERS = int(os.environ.get('MATRIX_WORKERS', str(os.cpu_count() or 1)))
+# Матрицы меньше стольких ячеек считаются в текущем процессе: пул дороже самой работы.
+MATRIX_PARALLEL_MIN_CELLS = int(os.environ.get('MATRIX_PARALLEL_MIN_CELLS', '20000'))
+_INF = float('inf')
+
+# Состояние воркера пула, заполняется инициализатором.
+_WORKER = {}
+
+
+def _ch_lengths(ch, graph_lengths):
+    """Длины рёбер иерархии: у исходного ребра — длина ребра графа, у ярлыка — сумма половин."""
+    originals = ch.second < 0
+    lengths = np.zeros(len(ch.first), dtype=np.float64)
+    lengths[originals] = graph_lengths[ch.first[originals]]
+    first, second = ch.first.tolist(), ch.second.tolist()
+    values = lengths.tolist()
+    # Ярлык всегда создаётся после рёбер, которые заменяет, поэтому хватает одного прохода.
+    for edge in np.flatnonzero(~originals).tolist():
+        values[edge] = values[first[edge]] + values[second[edge]]
+    return np.asarray(values, dtype=np.float64)
+
+
+class _MatrixState:
+    """Массивы, по которым считаются строки матрицы, в процессе или в воркере."""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.hierarchy = 'up_indptr' in arrays
+
+    def rows(self, sources, targets):
+        """Возвращает (длительности, расстояния) для строк ``sources``."""
+        sources = [int(node) for node in sources]
+        targets = [int(node) for node in targets]
+        if self.hierarchy:
+            return self._bucket_rows(sources, targets)
+        return self._dijkstra_rows(sources, targets)
+
+    def _upward(self, node, indptr, edges, ends, weights, lengths):
+        """Полный поиск вверх по иерархии: {узел: (вес, длина)}."""
+        labels = {node: (0.0, 0.0)}
+        heap = [(0.0, node)]
+        while heap:
+            cost, current = heapq.heappop(heap)
+            label = labels[current]
+            if cost > label[0]:
+                continue
+            for position in range(indptr[current], indptr[current + 1]):
+                edge = edges[position]
+                neighbour = ends[edge]
+                candidate = cost + weights[edge]
+                known = labels.get(neighbour)
+                if known is None or candidate < known[0]:
+                    labels[neighbour] = (candidate, label[1] + lengths[edge])
+                    heapq.heappush(heap, (candidate, neighbour))
+        return labels
+
+    def _bucket_rows(self, sources, targets):
+        arrays = self.arrays
+        weights, lengths = memoryview(arrays['weights']), memoryview(arrays['lengths'])
+        up = (memoryview(arrays['up_indptr']), memoryview(arrays['up_edges']), memoryview(arrays['heads']))
+        down = (memoryview(arrays['down_indptr']), memoryview(arrays['down_edges']), memoryview(arrays['tails']))
+        buckets = {}
+        for column, target in enumerate(targets):
+            for node, (cost, length) in self._upward(target, *(down + (weights, lengths))).items():
+                buckets.setdefault(node, []).append((column, cost, length))
+        durations = np.full((len(sources), len(targets)), np.inf)
+        distances = np.full((len(sources), len(targets)), np.inf)
+        for row, source in enumerate(sources):
+            best = [_INF] * len(targets)
+            best_length = [_INF] * len(targets)
+            for node, (cost, length) in self._upward(source, *(up + (weights, lengths))).items():
+                for column, rest, rest_length in buckets.get(node, ()):
+                    total = cost + rest
+                    if total < best[column]:
+                        best[column] = total
+                        best_length[column] = length + rest_length
+            durations[row] = best
+            distances[row] = best_length
+        return durations, distances
+
+    def _dijkstra_rows(self, sources, targets):
+        arrays = self.arrays
+        indptr, ends = memoryview(arrays['indptr']), memoryview(arrays['targets'])
+        weights, lengths = memoryview(arrays['weights']), memoryview(arrays['lengths'])
+        columns = {}
+        for column, target in enumerate(targets):
+            columns.setdefault(target, []).append(column)
+        durations = np.full((len(sources), len(targets)), np.inf)
+        distances = np.full((len(sources), len(targets)), np.inf)
+        for row, source in enumerate(sources):
+            labels = {source: (0.0, 0.0)}
+            heap = [(0.0, source)]
+            remaining = len(columns)
+            while heap and remaining:
+                cost, current = heapq.heappop(heap)
+                label = labels[current]
+                if cost > label[0]:
+                    continue
+                if current in columns:
+                    remaining -= 1
+                    for column in columns[current]:
+                        durations[row, column] = cost
+                        distances[row, column] = label[1]
+                for edge in range(indptr[current], indptr[current + 1]):
+                    neighbour = ends[edge]
+                    candidate = cost + weights[edge]
+                    known = labels.get(neighbour)
+                    if known is None or candidate < known[0]:
+                        labels[neighbour] = (candidate, label[1] + lengths[edge])
+                        heapq.heappush(heap, (candidate, neighbour))
+        return durations, distances
+
+
+def _init_worker(arrays):
+    _WORKER['state'] = _MatrixState(arrays)
+
+
+def _worker_rows(sources, targets):
+    return _WORKER['state'].rows(sources, targets)
+
+
+class MatrixEngine:
+    """Матрицы по графу ``ShortestPathEngine``: CH, если она актуальна, иначе Дейкстра."""
+
+    def __init__(self, engine, workers=MATRIX_WORKERS, parallel_min_cells=MATRIX_PARALLEL_MIN_CELLS):
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.parallel_min_cells = parallel_min_cells
+        self._state = None
+        self._state_key = None
+        self._pool = None
+        self._pool_key = None
+
+    def _current_state(self):
+        engine = self.engine
+        graph = engine.graph
+        ch = engine.ch if engine.ch_ready else None
+        key = (graph.weights_version, id(ch))
+        if self._state_key != key:
+            if ch is not None:
+                arrays = {name: getattr(ch, name) for name in
+                          ('up_indptr', 'up_edges', 'down_indptr', 'down_edges', 'tails', 'heads', 'weights')}
+                arrays['lengths'] = _ch_lengths(ch, graph.lengths)
+            else:
+                arrays = {
+                    'indptr': graph.indptr,
+                    'targets': graph.targets,
+                    'weights': np.array(graph.weights),
+                    'lengths': graph.lengths
+                }
+            self._state = _MatrixState(arrays)
+            self._state_key = key
+        return self._state, key
+
+    def _executor(self, state, key):
+        if self._pool is not None and self._pool_key != key:
+            self.close()
+        if self._pool is None:
+            # multiprocessing.Pool, а не ProcessPoolExecutor: initializer у последнего есть только с Python 3.7.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            self._pool = context.Pool(self.workers, initializer=_init_worker, initargs=(state.arrays,))
+            self._pool_key = key
+        return self._pool
+
+    def close(self):
+        """Останавливает процессы пула."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._pool_key = None
+
+    def table_nodes(self, sources, targets):
+        """Матрицы (длительность, с; расстояние, м) между узлами графа; недостижимые — ``inf``."""
+        sources = np.asarray(sources, dtype=np.int64).reshape(-1)
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1)
+        state, key = self._current_state()
+        if (self.workers <= 1 or len(sources) < 2
+                or len(sources) * len(targets) < self.parallel_min_cells):
+            return state.rows(sources, targets)
+        executor = self._executor(state, key)
+        parts = [part for part in np.array_split(sources, min(self.workers, len(sources))) if len(part)]
+        pending = [executor.apply_async(_worker_rows, (part.tolist(), targets.tolist())) for part in parts]
+        results = [result.get() for result in pending]
+        return (np.concatenate([durations for durations, _ in results]),
+                np.concatenate([distances for _, distances in results]))
+
+    def table(self, sources, destinations=None):
+        """Матрицы между координатами (``'lon,lat'`` или пары чисел).
+
+        Точки привязываются к ближайшим узлам графа; без ``destinations``
+        считается квадратная матрица между ``sources``.
+        """
+        graph = self.engine.graph
+        points = list(sources) + list(destinations if destinations is not None else [])
+        coordinates = [_parse_point(point) for point in points]
+        lons, lats = zip(*coordinates) if coordinates else ((), ())
+        nodes = graph.nearest(lons, lats, 1)[0][:, 0]
+        source_nodes = nodes[:len(sources)]
+        target_nodes = nodes[len(sources):] if destinations is not None else source_nodes
+        durations, distances = self.table_nodes(np.maximum(source_nodes, 0), np.maximum(target_nodes, 0))
+        missing = (source_nodes < 0)[:, None] | (target_nodes < 0)[None, :]
+        durations[missing] = np.inf
+        distances[missing] = np.inf
+        return durations, distances
+
@@ -0,0 +1,204 @@
+"""Лёгкие метрики в формате Prometheus и учёт времени, проведённого в OSRM."""
+
+import threading
+import time
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROBE_BUCKETS = (0, 1, 2, 4, 8, 16, 25)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(extra[0], extra[1]))
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Счётчик с метками; ``inc`` стоит одного захвата блокировки."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in items]
+
+
+class Gauge:
+    """Текущее значение с метками, например длина очереди."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in items]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, labels=()):
+        with self._lock:
+            entry = self._values.get(labels)
+            return sum(entry[0]) if entry is not None else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(entry[0]), entry[1])) for labels, entry in self._values.items())
+        result = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                result.append((
+                    self.name + '_bucket',
+                    _format_labels(self.labelnames, labels, ('le', _format_value(float(bound)))),
+                    cumulative
+                ))
+            plain = _format_labels(self.labelnames, labels)
+            result.append((self.name + '_sum', plain, total))
+            result.append((self.name + '_count', plain, cumulative))
+        return result
+
+
+class Registry:
+    """Набор метрик, который отдаётся одним текстом в формате Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате экспозиции Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+_local = threading.local()
+
+
+def start_request():
+    """Начинает учёт времени в OSRM для запроса, обслуживаемого текущим потоком."""
+    _local.active = True
+    _local.osrm_seconds = 0.0
+    _local.depth = 0
+
+
+def finish_request():
+    """Завершает учёт и возвращает суммарное время, проведённое в OSRM."""
+    _local.active = False
+    return getattr(_local, 'osrm_seconds', 0.0)
+
+
+class osrm_time:
+    """Контекст, время внутри которого считается временем ожидания OSRM.
+
+    Вложенные участки не суммируются повторно. В потоках без активного
+    запроса (пулы запасного поиска и тайлов) учёт не ведётся: их работу
+    поток запроса видит как ожидание результата.
+    """
+
+    __slots__ = ('_started',)
+
+    def __enter__(self):
+        self._started = None
+        if getattr(_local, 'active', False):
+            if _local.depth == 0:
+                self._started = time.perf_counter()
+            _local.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if getattr(_local, 'active', False) and _local.depth > 0:
+            _local.depth -= 1
+            if self._started is not None:
+                _local.osrm_seconds += time.perf_counter() - self._started
+        return False
@@ -0,0 +1,204 @@
+"""Чтение выгрузок OpenStreetMap (``.osm.pbf`` и ``.osm``) без внешних зависимостей.
+
+Читатели отдают события двух видов:
+
+- ``('nodes', ids, lons, lats)`` — пачка узлов (списки одинаковой длины);
+- ``('way', way_id, refs, tags)`` — линия с идентификаторами узлов и тегами.
+
+Формат PBF разбирается по спецификации OSM напрямую (protobuf + zlib).
+Это медленнее C-библиотек, но выполняется один раз при подготовке графа.
+"""
+
+import struct
+import xml.etree.ElementTree as ElementTree
+import zlib
+from itertools import accumulate
+
+
+NODE_BATCH = 8192
+
+
+def _varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data):
+    """Разбирает сообщение protobuf на (номер поля, значение)."""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = _varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('unsupported protobuf wire type {}'.format(wire_type))
+        yield key >> 3, value
+
+
+def _packed(data):
+    values = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        value, pos = _varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _signed(value):
+    """Приводит varint int64 к знаковому значению."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _read_blobs(handle):
+    """Отдаёт (тип, распакованные данные) для каждого блока файла PBF."""
+    while True:
+        head = handle.read(4)
+        if not head:
+            return
+        if len(head) < 4:
+            raise ValueError('truncated PBF file')
+        header_size = struct.unpack('>I', head)[0]
+        blob_type = None
+        data_size = 0
+        for number, value in _fields(memoryview(handle.read(header_size))):
+            if number == 1:
+                blob_type = bytes(value).decode('utf-8')
+            elif number == 3:
+                data_size = value
+        raw = None
+        for number, value in _fields(memoryview(handle.read(data_size))):
+            if number == 1:
+                raw = bytes(value)
+            elif number == 3:
+                raw = zlib.decompress(value)
+            elif number == 4:
+                raise ValueError('LZMA-compressed PBF blobs are not supported')
+        if raw is None:
+            raise ValueError('PBF blob without data')
+        yield blob_type, memoryview(raw)
+
+
+def _dense_nodes(data, granularity, lat_offset, lon_offset):
+    ids = lats = lons = ()
+    for number, value in _fields(data):
+        if number == 1:
+            ids = _packed(value)
+        elif number == 8:
+            lats = _packed(value)
+        elif number == 9:
+            lons = _packed(value)
+    ids = list(accumulate(_zigzag(value) for value in ids))
+    scale = 1e-9
+    lats = [(lat_offset + granularity * value) * scale for value in accumulate(_zigzag(v) for v in lats)]
+    lons = [(lon_offset + granularity * value) * scale for value in accumulate(_zigzag(v) for v in lons)]
+    return ids, lons, lats
+
+
+def _way(data, strings):
+    way_id = 0
+    keys = vals = refs = ()
+    for number, value in _fields(data):
+        if number == 1:
+            way_id = _signed(value)
+        elif number == 2:
+            keys = _packed(value)
+        elif number == 3:
+            vals = _packed(value)
+        elif number == 8:
+            refs = _packed(value)
+    tags = {strings[key]: strings[val] for key, val in zip(keys, vals)}
+    return way_id, list(accumulate(_zigzag(value) for value in refs)), tags
+
+
+def iter_pbf(path, nodes=True, ways=True):
+    """Читает узлы и линии из файла ``.osm.pbf``."""
+    with open(path, 'rb') as handle:
+        for blob_type, data in _read_blobs(handle):
+            if blob_type != 'OSMData':
+                continue
+            strings = []
+            groups = []
+            granularity = 100
+            lat_offset = lon_offset = 0
+            for number, value in _fields(data):
+                if number == 1:
+                    strings = [bytes(item).decode('utf-8') for _, item in _fields(value)]
+                elif number == 2:
+                    groups.append(value)
+                elif number == 17:
+                    granularity = value
+                elif number == 19:
+                    lat_offset = _signed(value)
+                elif number == 20:
+                    lon_offset = _signed(value)
+            for group in groups:
+                for number, value in _fields(group):
+                    if number == 2 and nodes:
+                        yield ('nodes',) + _dense_nodes(value, granularity, lat_offset, lon_offset)
+                    elif number == 1 and nodes:
+                        node_id = lat = lon = 0
+                        for field, item in _fields(value):
+                            if field == 1:
+                                node_id = _zigzag(item)
+                            elif field == 8:
+                                lat = _zigzag(item)
+                            elif field == 9:
+                                lon = _zigzag(item)
+                        yield ('nodes', [node_id], [(lon_offset + granularity * lon) * 1e-9],
+                               [(lat_offset + granularity * lat) * 1e-9])
+                    elif number == 3 and ways:
+                        yield ('way',) + _way(value, strings)
+
+
+def iter_xml(path, nodes=True, ways=True):
+    """Читает узлы и линии из файла ``.osm`` (XML)."""
+    ids, lons, lats = [], [], []
+    for _, element in ElementTree.iterparse(path, events=('end',)):
+        if element.tag == 'node':
+            if nodes:
+                ids.append(int(element.get('id')))
+                lons.append(float(element.get('lon')))
+                lats.append(float(element.get('lat')))
+                if len(ids) >= NODE_BATCH:
+                    yield 'nodes', ids, lons, lats
+                    ids, lons, lats = [], [], []
+            element.clear()
+        elif element.tag == 'way':
+            if ways:
+                refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                yield 'way', int(element.get('id')), refs, tags
+            element.clear()
+    if ids:
+        yield 'nodes', ids, lons, lats
+
+
+def iter_osm(path, nodes=True, ways=True):
+    """Выбирает читатель по расширению файла."""
+    if path.endswith('.pbf'):
+        return iter_pbf(path, nodes=nodes, ways=ways)
+    return iter_xml(path, nodes=nodes, ways=ways)
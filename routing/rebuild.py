@@ -0,0 +1,216 @@
+"""Фоновая перестройка весов OSRM с горячей перезагрузкой.
+
+Перестройка не трогает файлы, с которых работает osrm-routed:
+
+1. файлы ``OSRM_DATA*`` копируются в промежуточный каталог;
+2. ``osrm-customize`` применяет к копии файл скоростей сегментов
+   (``--segment-speed-file``, CSV ``from_node,to_node,speed_kmh``) —
+   для MLD это пересчёт только метрик ячеек, без extract/partition; для CH
+   (``OSRM_ALGORITHM=ch``) вместо него иерархию заново строит
+   ``osrm-contract``, это заметно дольше;
+3. ``osrm-datastore`` загружает копию в общую память, и osrm-routed,
+   запущенный с ``--shared-memory``, атомарно переключается на новые данные
+   между запросами.
+
+После успешной перезагрузки в промежуточном каталоге обновляется метка
+``rebuild.done``: файлы ``OSRM_DATA*`` не меняются, поэтому кэши ответов
+всех процессов узнают о новых весах по её времени изменения.
+
+Выполнение идёт в фоновом потоке; второй запуск во время работы не
+начинается. Между процессами (воркеры gunicorn) перестройку разделяет
+блокировка файла в промежуточном каталоге, туда же пишется состояние
+последнего запуска, поэтому его видит любой воркер.
+"""
+
+import fcntl
+import glob
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from routing.metrics import Registry
+
+
+OSRM_STAGING_DIR = os.environ.get('OSRM_STAGING_DIR', '')
+# Способ перезагрузки osrm-routed: 'datastore' (общая память) или 'none' (только пересчёт).
+OSRM_RELOAD = os.environ.get('OSRM_RELOAD', 'datastore')
+RELOAD_MODES = ('datastore', 'none')
+OSRM_ALGORITHM = os.environ.get('OSRM_ALGORITHM', 'mld')
+# Команда пересчёта весов для алгоритма osrm-routed.
+WEIGHT_COMMANDS = {'mld': 'osrm-customize', 'ch': 'osrm-contract'}
+REBUILD_TIMEOUT = float(os.environ.get('OSRM_REBUILD_TIMEOUT', '1800'))
+# Сколько последних байт вывода команды сохраняется в состоянии при ошибке.
+OUTPUT_TAIL = 2000
+REBUILD_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+_LOCK_NAME = '.rebuild.lock'
+_STATUS_NAME = 'rebuild.json'
+_DONE_NAME = 'rebuild.done'
+
+
+class RebuildError(Exception):
+    """Шаг перестройки завершился ошибкой."""
+
+
+class Rebuilder:
+    """Управляет фоновой перестройкой: один запуск за раз, состояние и метрики."""
+
+    def __init__(self, data_path, staging_dir=OSRM_STAGING_DIR, reload=OSRM_RELOAD,
+                 timeout=REBUILD_TIMEOUT, on_success=None, metrics=None, algorithm=OSRM_ALGORITHM):
+        if reload not in RELOAD_MODES:
+            raise ValueError('Unknown reload mode: {}'.format(reload))
+        self.data_path = data_path
+        self.set_algorithm(algorithm)
+        self.staging_dir = staging_dir or os.path.join(os.path.dirname(data_path) or '.', 'staging')
+        self.reload = reload
+        self.timeout = timeout
+        self.on_success = on_success
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = {'state': 'idle', 'runs': 0, 'failures': 0}
+        self.metrics = metrics if metrics is not None else Registry()
+        self._total = self.metrics.counter('osrm_rebuild_total', 'Запуски перестройки весов OSRM', ('result',))
+        self._seconds = self.metrics.histogram(
+            'osrm_rebuild_seconds', 'Длительность перестройки весов OSRM', ('result',), REBUILD_BUCKETS
+        )
+
+    @property
+    def staging_path(self):
+        """Путь ``*.osrm`` промежуточной копии."""
+        return os.path.join(self.staging_dir, os.path.basename(self.data_path))
+
+    @property
+    def marker_path(self):
+        """Метка, время изменения которой — момент последней успешной перезагрузки."""
+        return os.path.join(self.staging_dir, _DONE_NAME)
+
+    def set_algorithm(self, name):
+        if name not in WEIGHT_COMMANDS:
+            raise ValueError('Unknown routing algorithm: {}'.format(name))
+        self.algorithm = name
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, speed_file=None):
+        """Запускает перестройку в фоне; возвращает False, если она уже идёт."""
+        with self._lock:
+            if self.running:
+                return False
+            self._status = dict(
+                self._status, state='running', step='queued', started_at=time.time(),
+                finished_at=None, duration_s=None, error=None, speed_file=speed_file
+            )
+            self._thread = threading.Thread(target=self._run, args=(speed_file,), name='osrm-rebuild')
+            self._thread.daemon = True
+            self._thread.start()
+            return True
+
+    def wait(self, timeout=None):
+        """Ждёт завершения текущего запуска; возвращает состояние."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.status()
+
+    def status(self):
+        """Состояние последнего запуска в этом или другом процессе."""
+        with self._lock:
+            status = dict(self._status)
+        if status['state'] != 'running':
+            shared = self._read_shared_status()
+            if shared and (shared.get('started_at') or 0) > (status.get('started_at') or 0):
+                shared.setdefault('runs', status['runs'])
+                shared.setdefault('failures', status['failures'])
+                status = shared
+        return status
+
+    def _read_shared_status(self):
+        try:
+            with open(os.path.join(self.staging_dir, _STATUS_NAME)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _update(self, shared=True, **changes):
+        with self._lock:
+            self._status.update(changes)
+            status = dict(self._status)
+        if not shared:
+            return
+        try:
+            path = os.path.join(self.staging_dir, _STATUS_NAME)
+            with open(path + '.tmp', 'w') as handle:
+                json.dump(status, handle)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def _run(self, speed_file):
+        started = time.monotonic()
+        result = 'succeeded'
+        error = None
+        try:
+            os.makedirs(self.staging_dir, exist_ok=True)
+            with open(os.path.join(self.staging_dir, _LOCK_NAME), 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    result = 'busy'
+                    raise RebuildError('another process is rebuilding {}'.format(self.staging_dir))
+                self._steps(speed_file)
+        except (RebuildError, OSError, subprocess.SubprocessError) as exc:
+            result = 'busy' if result == 'busy' else 'failed'
+            error = str(exc)
+        duration = time.monotonic() - started
+        self._total.inc((result,))
+        self._seconds.observe(duration, (result,))
+        with self._lock:
+            runs = self._status['runs'] + 1
+            failures = self._status['failures'] + (result == 'failed')
+        # Состояние чужого запуска в общем файле не перезаписывается.
+        self._update(
+            shared=result != 'busy', state=result, step=None, finished_at=time.time(),
+            duration_s=round(duration, 3), error=error, runs=runs, failures=failures
+        )
+        if result == 'succeeded' and self.on_success is not None:
+            self.on_success()
+
+    def _steps(self, speed_file):
+        self._update(step='copy')
+        self._copy_to_staging()
+        self._update(step='customize' if self.algorithm == 'mld' else 'contract')
+        command = [WEIGHT_COMMANDS[self.algorithm], self.staging_path]
+        if speed_file:
+            command[1:1] = ['--segment-speed-file', speed_file]
+        self._call(command)
+        if self.reload == 'datastore':
+            self._update(step='reload')
+            self._call(['osrm-datastore', self.staging_path])
+            with open(self.marker_path, 'w') as handle:
+                handle.write(str(time.time()))
+
+    def _copy_to_staging(self):
+        """Копирует данные OSRM; копия пишется рядом и переименовывается, чтобы не оставить обрезанный файл."""
+        sources = [path for path in glob.glob(self.data_path + '*') if os.path.isfile(path)]
+        if not sources:
+            raise RebuildError('no OSRM data at {}'.format(self.data_path))
+        for source in sources:
+            target = os.path.join(self.staging_dir, os.path.basename(source))
+            shutil.copy2(source, target + '.tmp')
+            os.replace(target + '.tmp', target)
+
+    def _call(self, command):
+        try:
+            completed = subprocess.run(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise RebuildError('{} timed out after {} s'.format(command[0], self.timeout))
+        if completed.returncode != 0:
+            output = completed.stdout.decode('utf-8', 'replace')[-OUTPUT_TAIL:]
+            raise RebuildError('{} exited with {}: {}'.format(command[0], completed.returncode, output))
@@ -1,49 +1,535 @@
 """Обёртка над HTTP API OSRM с возможностью смены алгоритма."""
 
+import logging
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from routing import jsonlib
+from routing.coalesce import SingleFlight
+from routing.graph import Graph
+from routing.metrics import PROBE_BUCKETS, Registry, osrm_time
+from routing.cache import ResponseCache, SnapCache, data_version, make_key
+from routing.matching import MatchMerger, match_windows, window_params
+from routing.rebuild import Rebuilder
 
 
 OSRM_URL = os.environ.get('OSRM_URL', 'http://localhost:5000')
+OSRM_DATA = os.environ.get('OSRM_DATA', '/data/odessa_oblast.osrm')
 NEAREST_CANDIDATE_LIMIT = 5
+OSRM_POOL_SIZE = int(os.environ.get('OSRM_POOL_SIZE', '10'))
+OSRM_CONNECT_TIMEOUT = float(os.environ.get('OSRM_CONNECT_TIMEOUT', '3.05'))
+OSRM_READ_TIMEOUT = float(os.environ.get('OSRM_READ_TIMEOUT', '60'))
+OSRM_MAX_RETRIES = int(os.environ.get('OSRM_MAX_RETRIES', '2'))
+FALLBACK_WORKERS = int(os.environ.get('OSRM_FALLBACK_WORKERS', '4'))
+FALLBACK_DEADLINE = float(os.environ.get('OSRM_FALLBACK_DEADLINE', '15'))
+# Сколько проб одного запроса одновременно занимают общий пул запасного поиска.
+FALLBACK_PROBE_LIMIT = int(os.environ.get('OSRM_FALLBACK_PROBE_LIMIT', '2'))
+MAX_TABLE_SIZE = int(os.environ.get('OSRM_MAX_TABLE_SIZE', '800'))
+TABLE_WORKERS = int(os.environ.get('OSRM_TABLE_WORKERS', '4'))
+# Параметры со значением для каждой координаты, которые нужно переупорядочить в тайлах.
+_PER_COORDINATE_PARAMS = ('bearings', 'radiuses', 'hints', 'approaches')
+MAX_MATCHING_SIZE = int(os.environ.get('OSRM_MAX_MATCHING_SIZE', '100'))
+MATCH_OVERLAP = int(os.environ.get('OSRM_MATCH_OVERLAP', '10'))
+MATCH_WORKERS = int(os.environ.get('OSRM_MATCH_WORKERS', '4'))
+FALLBACK_STRATEGIES = ('table', 'probe')
+FALLBACK_STRATEGY = os.environ.get('OSRM_FALLBACK_STRATEGY', 'table')
+# Параметры маршрута, влияющие на достижимость и потому передаваемые в /table.
+_TABLE_FALLBACK_PARAMS = ('exclude', 'snapping')
+OSRM_COALESCE = os.environ.get('OSRM_COALESCE', 'true').lower() == 'true'
+# Сквозной ответ OSRM копируется для кэша, пока тело не больше этого числа байт.
+PASSTHROUGH_CACHE_MAX_BYTES = int(os.environ.get('OSRM_PASSTHROUGH_CACHE_MAX_BYTES', str(1024 * 1024)))
+# Граф дорог для локального поиска ближайших (каталог *.graph, выгрузка OSM или *.osrm).
+OSRM_GRAPH = os.environ.get('OSRM_GRAPH', '')
+# Параметры /nearest, которые понимает локальный поиск; с остальными запрос идёт в OSRM.
+_LOCAL_NEAREST_PARAMS = frozenset(['number'])
+
+# Повторяем только идемпотентные методы и только при сбоях соединения
+# или временной недоступности osrm-routed.
+_RETRY_METHODS = frozenset(['GET', 'HEAD'])
+_RETRY_STATUSES = (502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_timeout(default, timeout):
+    """Приводит таймаут вызова к паре (connect, read)."""
+    if timeout is None:
+        return default
+    if isinstance(timeout, (tuple, list)):
+        return (float(timeout[0]), float(timeout[1]))
+    return (default[0], float(timeout))
+
+
+def needs_table_chunking(max_table_size, sources, destinations):
+    """Проверяет, превышает ли матрица ограничение --max-table-size."""
+    if max_table_size <= 0 or sources is None or destinations is None:
+        return False
+    return len(sources) > max_table_size or len(destinations) > max_table_size
+
+
+def table_tiles(max_table_size, sources, destinations):
+    """Возвращает тайлы (row, col, tile_sources, tile_destinations) матрицы."""
+    return [
+        (row, col, sources[row:row + max_table_size], destinations[col:col + max_table_size])
+        for row in range(0, len(sources), max_table_size)
+        for col in range(0, len(destinations), max_table_size)
+    ]
+
+
+class TableStitcher:
+    """Собирает матрицу /table из тайлов в заранее выделенные строки."""
+
+    def __init__(self, n_sources, n_destinations):
+        self.n_sources = n_sources
+        self.n_destinations = n_destinations
+        self.matrices = {}
+        self.sources = [None] * n_sources
+        self.destinations = [None] * n_destinations
+
+    def add(self, row, col, response):
+        """Вписывает тайл с углом (row, col); возвращает ответ OSRM при ошибке."""
+        if response.get('code') != 'Ok':
+            return response
+        for name in ('durations', 'distances'):
+            tile_matrix = response.get(name)
+            if tile_matrix is None:
+                continue
+            matrix = self.matrices.get(name)
+            if matrix is None:
+                matrix = [[None] * self.n_destinations for _ in range(self.n_sources)]
+                self.matrices[name] = matrix
+            for offset, tile_row in enumerate(tile_matrix):
+                matrix[row + offset][col:col + len(tile_row)] = tile_row
+        if col == 0:
+            tile_sources = response.get('sources') or []
+            self.sources[row:row + len(tile_sources)] = tile_sources
+        if row == 0:
+            tile_destinations = response.get('destinations') or []
+            self.destinations[col:col + len(tile_destinations)] = tile_destinations
+        return None
+
+    def result(self):
+        result = {'code': 'Ok', 'sources': self.sources, 'destinations': self.destinations}
+        result.update(self.matrices)
+        return result
+
+
+def _build_session(pool_size, max_retries):
+    """Создаёт сессию requests с пулом keep-alive соединений."""
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=0.1,
+        allowed_methods=_RETRY_METHODS,
+        status_forcelist=_RETRY_STATUSES,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        pool_block=False
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _is_ok_body(body):
+    """Проверяет ``"code": "Ok"`` в теле ответа OSRM; OSRM пишет code первым, иначе тело разбирается."""
+    head = body[:64].replace(b' ', b'')
+    if head.startswith(b'{"code":'):
+        return head.startswith(b'{"code":"Ok"')
+    try:
+        payload = jsonlib.loads(body)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get('code') == 'Ok'
+
+
+class _CachedBody:
+    """Тело ответа из кэша с интерфейсом потокового ответа requests."""
+
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = body
+        self.headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _TeeResponse:
+    """Потоковый ответ OSRM, копирующий тело в буфер не больше ``limit`` байт.
+
+    ``on_done`` вызывается один раз: с байтами тела, если оно прочитано
+    целиком и уложилось в предел, иначе с None — при переполнении буфера,
+    ошибке чтения или ``close()`` до конца тела.
+    """
+
+    def __init__(self, upstream, limit, on_done):
+        self.status_code = upstream.status_code
+        self.headers = upstream.headers
+        self._upstream = upstream
+        self._limit = limit
+        self._on_done = on_done
+        self._done = False
+
+    def iter_content(self, chunk_size=1):
+        parts = []
+        size = 0
+        complete = False
+        try:
+            for chunk in self._upstream.iter_content(chunk_size=chunk_size):
+                if parts is not None:
+                    size += len(chunk)
+                    if size > self._limit:
+                        parts = None
+                    else:
+                        parts.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            self._finish(b''.join(parts) if complete and parts is not None else None)
+
+    def close(self):
+        self._upstream.close()
+        self._finish(None)
+
+    def _finish(self, body):
+        if self._done:
+            return
+        self._done = True
+        self._on_done(body)
 
 
 class Router:
     """Клиент OSRM с выбором алгоритма."""
 
-    def __init__(self, base_url=OSRM_URL):
+    def __init__(self, base_url=OSRM_URL, pool_size=OSRM_POOL_SIZE,
+                 connect_timeout=OSRM_CONNECT_TIMEOUT, read_timeout=OSRM_READ_TIMEOUT,
+                 max_retries=OSRM_MAX_RETRIES, fallback_workers=FALLBACK_WORKERS,
+                 fallback_deadline=FALLBACK_DEADLINE, fallback_strategy=FALLBACK_STRATEGY,
+                 data_path=OSRM_DATA, cache=None, snap_cache=None,
+                 max_table_size=MAX_TABLE_SIZE, table_workers=TABLE_WORKERS,
+                 max_matching_size=MAX_MATCHING_SIZE, match_overlap=MATCH_OVERLAP,
+                 match_workers=MATCH_WORKERS, coalesce=OSRM_COALESCE, metrics=None,
+                 graph=None, graph_path=OSRM_GRAPH,
+                 passthrough_cache_limit=PASSTHROUGH_CACHE_MAX_BYTES,
+                 fallback_probe_limit=FALLBACK_PROBE_LIMIT):
         self.base_url = base_url.rstrip('/')
         self.algorithm = os.environ.get('OSRM_ALGORITHM', 'mld')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = _build_session(pool_size, max_retries)
+        self._stats_lock = threading.Lock()
+        # Длина тела последнего ответа OSRM в потоке: по ней кэш считает размер записи без сериализации.
+        self._body_sizes = threading.local()
+        self._in_flight = 0
+        self._requests_total = 0
+        self.fallback_workers = fallback_workers
+        self.fallback_probe_limit = fallback_probe_limit
+        self.fallback_deadline = fallback_deadline
+        self.set_fallback_strategy(fallback_strategy)
+        self.max_table_size = max_table_size
+        self.table_workers = table_workers
+        self.max_matching_size = max_matching_size
+        self.match_overlap = match_overlap
+        self.match_workers = match_workers
+        self.data_path = data_path
+        self.metrics = metrics if metrics is not None else Registry()
+        self.rebuilder = Rebuilder(
+            data_path, on_success=self._clear_caches, metrics=self.metrics, algorithm=self.algorithm
+        )
+        if cache is None:
+            cache = ResponseCache(version_func=self._data_version)
+        self.cache = cache
+        if snap_cache is None:
+            snap_cache = SnapCache(version_func=self._data_version)
+        self.snap_cache = snap_cache
+        self.flights = SingleFlight(enabled=coalesce)
+        self.passthrough_cache_limit = passthrough_cache_limit
+        self._upstream_seconds = self.metrics.histogram(
+            'osrm_upstream_request_seconds', 'Время HTTP-запроса к osrm-routed', ('service',)
+        )
+        self._fallback_total = self.metrics.counter(
+            'osrm_fallback_total', 'Срабатывания запасного поиска по ближайшим точкам', ('strategy', 'result')
+        )
+        self._fallback_probes = self.metrics.histogram(
+            'osrm_fallback_probes', 'Запросов маршрута на одно срабатывание запасного поиска',
+            ('strategy',), PROBE_BUCKETS
+        )
+        self._executors = {}
+        self._executor_lock = threading.Lock()
+        if graph is None and graph_path:
+            graph = self._load_graph(graph_path)
+        self.graph = graph
+        if graph is not None and graph.loaded:
+            graph.build_index()
+
+    def _data_version(self):
+        """Версия данных OSRM: файлы ``OSRM_DATA*`` и метка перезагрузки после перестройки в любом процессе."""
+        return data_version(self.data_path, self.rebuilder.marker_path)
+
+    @staticmethod
+    def _load_graph(path):
+        """Загружает граф; при ошибке ближайшие точки ищутся через OSRM."""
+        try:
+            return Graph().load(path)
+        except (OSError, ValueError) as exc:
+            logger.warning('Road graph %s is not loaded, /nearest goes to OSRM: %s', path, exc)
+            return None
+
+    def serves_nearest_locally(self, params=None):
+        """Проверяет, можно ли ответить на /nearest по локальному индексу."""
+        if self.graph is None or self.graph.index is None:
+            return False
+        return not params or set(params) <= _LOCAL_NEAREST_PARAMS
 
     def set_algorithm(self, name):
         """Изменить алгоритм маршрутизации."""
+        self.rebuilder.set_algorithm(name)
         self.algorithm = name
 
-    def _request(self, path, params=None):
-        params = params or {}
+    def set_fallback_strategy(self, name):
+        """Выбрать стратегию запасного поиска: 'table' или 'probe'."""
+        if name not in FALLBACK_STRATEGIES:
+            raise ValueError("Unknown fallback strategy: {}".format(name))
+        self.fallback_strategy = name
+
+    def _resolve_timeout(self, timeout):
+        return resolve_timeout(self.timeout, timeout)
+
+    def _get(self, path, params, timeout, stream=False):
         url = "{}{}".format(self.base_url, path)
-        resp = requests.get(url, params=params, timeout=60)
+        with self._stats_lock:
+            self._in_flight += 1
+            self._requests_total += 1
+        started = time.perf_counter()
+        try:
+            with osrm_time():
+                if stream:
+                    return self.session.get(
+                        url, params=params, timeout=self._resolve_timeout(timeout), stream=True
+                    )
+                return self.session.get(url, params=params, timeout=self._resolve_timeout(timeout))
+        finally:
+            self._upstream_seconds.observe(time.perf_counter() - started, (path.split('/', 2)[1],))
+            with self._stats_lock:
+                self._in_flight -= 1
+
+    def _request(self, path, params=None, timeout=None):
+        resp = self._get(path, params or {}, timeout)
         resp.raise_for_status()
-        return resp.json()
+        self._body_sizes.last = len(resp.content)
+        return jsonlib.response_json(resp)
+
+    def _request_or_error(self, path, params=None, timeout=None):
+        """Как ``_request``, но ошибка OSRM с JSON-телом и ``code`` возвращается, а не бросается.
+
+        Нужно тайлам и окнам: ответ одной части передаётся склейке, которая
+        сама решает, что делать с ошибкой.
+        """
+        try:
+            return self._request(path, params, timeout=timeout)
+        except requests.HTTPError as exc:
+            payload = None
+            if exc.response is not None:
+                try:
+                    payload = jsonlib.response_json(exc.response)
+                except ValueError:
+                    pass
+            if not isinstance(payload, dict) or 'code' not in payload:
+                raise
+            return payload
+
+    def raw(self, service, points, timeout=None, **params):
+        """Возвращает потоковый ответ OSRM без разбора JSON и без проверки статуса.
+
+        Вызывающий должен прочитать и закрыть ответ.
+        """
+        path = "/{}/v1/driving/{}".format(service, points)
+        return self._get(path, params, timeout, stream=True)
+
+    def raw_cached(self, service, points, timeout=None, **params):
+        """Возвращает потоковый ответ OSRM с кэшем, без разбора JSON.
+
+        Тело передаётся клиенту по частям и по пути копируется в буфер не
+        больше ``passthrough_cache_limit`` байт; успешное тело, прочитанное
+        целиком и уложившееся в предел, кэшируется в байтах под тем же ключом,
+        что и разобранные ответы. Одновременные одинаковые запросы не
+        объединяются: ждущим пришлось бы ждать, пока тело получит самый
+        медленный клиент. Вызывающий должен прочитать и закрыть ответ.
+        """
+        key = make_key(service, points, params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return _CachedBody(cached if isinstance(cached, bytes) else jsonlib.dumps(cached))
+        upstream = self.raw(service, points, timeout=timeout, **params)
+        if upstream.status_code != 200 or not self.cache.enabled:
+            return upstream
+
+        def on_done(body):
+            if body is not None and _is_ok_body(body):
+                self.cache.put(key, body, size=len(body))
+
+        return _TeeResponse(upstream, self.passthrough_cache_limit, on_done)
+
+    def can_passthrough(self, service, points, params):
+        """Проверяет, можно ли отдать ответ OSRM клиенту как есть.
+
+        Нельзя, если Router должен обработать ответ: разбить матрицу на
+        тайлы или трек на окна.
+        """
+        if service == 'nearest':
+            return not self.serves_nearest_locally(params)
+        if service == 'trip':
+            return True
+        coordinates = points.split(';')
+        if service == 'table':
+            sources = self._table_indices(params.get('sources'), len(coordinates))
+            destinations = self._table_indices(params.get('destinations'), len(coordinates))
+            return not needs_table_chunking(self.max_table_size, sources, destinations)
+        if service == 'match':
+            return (self.max_matching_size <= 0 or len(coordinates) <= self.max_matching_size
+                    or 'waypoints' in params)
+        return False
+
+    def cached_response(self, service, points, params):
+        """Возвращает закэшированный ответ сервиса или None."""
+        return self._cache_get(make_key(service, points, params))
+
+    def _cache_get(self, key):
+        """Читает кэш; тело, сохранённое сквозной передачей в байтах, разбирается."""
+        response = self.cache.get(key)
+        if isinstance(response, bytes):
+            return jsonlib.loads(response)
+        return response
+
+    def pool_stats(self):
+        """Возвращает статистику пула соединений к OSRM."""
+        pools = []
+        adapter = self.session.get_adapter(self.base_url)
+        for key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': pool.host,
+                'port': pool.port,
+                'maxsize': pool.pool.maxsize if pool.pool is not None else 0,
+                'idle': pool.pool.qsize() if pool.pool is not None else 0,
+                'connections_created': pool.num_connections,
+                'requests': pool.num_requests
+            })
+        with self._stats_lock:
+            in_flight = self._in_flight
+            requests_total = self._requests_total
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'in_flight': in_flight,
+            'requests_total': requests_total,
+            'pools': pools
+        }
+
+    def close(self):
+        """Закрывает соединения пула и останавливает фоновые потоки."""
+        with self._executor_lock:
+            executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+        self.session.close()
+
+    def _executor(self, name, max_workers):
+        """Возвращает именованный ограниченный пул потоков, создавая его при первом обращении.
 
-    def route_points(self, points, **params):
+        У каждой задачи свой пул, чтобы вложенные вызовы не ждали друг друга.
+        """
+        with self._executor_lock:
+            executor = self._executors.get(name)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=max_workers)
+                self._executors[name] = executor
+            return executor
+
+    def _fallback_executor(self):
+        """Возвращает общий ограниченный пул потоков для запасного поиска."""
+        return self._executor('fallback', self.fallback_workers)
+
+    def _deadline_timeout(self, deadline):
+        """Сужает таймауты запроса до оставшегося времени, None — время вышло."""
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+    def route_points(self, points, timeout=None, **params):
         """Строит маршрут по заранее собранной строке координат."""
 
         query = {'overview': 'false'}
 
         query.update(params)
         path = "/route/v1/driving/{}".format(points)
-        return self._request(path, query)
+        return self._request(path, query, timeout=timeout)
+
+    def _coalesced(self, service, points, params, call):
+        """Выполняет вызов один раз для всех одновременных одинаковых запросов."""
+        return self.flights.do(make_key(service, points, params), call)
+
+    def _cached(self, service, points, params, call):
+        """Отдаёт успешный ответ из кэша или выполняет вызов и кэширует его.
+
+        Одновременные промахи по одному ключу объединяются: к OSRM уходит
+        один вызов, остальные потоки получают его результат.
+        """
+        key = make_key(service, points, params)
+        response = self._cache_get(key)
+        if response is not None:
+            return response
+
+        def call_and_store():
+            self._body_sizes.last = None
+            response = call()
+            if isinstance(response, dict) and response.get('code') == 'Ok':
+                self.cache.put(key, response, size=self._body_sizes.last)
+            return response
+
+        return self.flights.do(key, call_and_store)
 
-    def route(self, start, end, via=None, **params):
+    def route(self, start, end, via=None, timeout=None, **params):
         """Строит маршрут между стартом и финишем с необязательными via-точками."""
         coordinates = [start]
         if via:
             coordinates.extend(via)
         coordinates.append(end)
         points = ';'.join(coordinates)
-        response = self.route_points(points, **params)
+        return self._cached(
+            'route', points, params,
+            lambda: self._route_uncached(start, end, via, points, timeout, params)
+        )
+
+    def _route_uncached(self, start, end, via, points, timeout, params):
+        response = self.route_points(points, timeout=timeout, **params)
         if self._is_route_success(response):
             return response
 
@@ -67,60 +553,418 @@ class Router:
         lon, lat = location[0], location[1]
         return "{:.6f},{:.6f}".format(lon, lat)
 
-    def _nearest_candidates(self, point):
-        response = self.nearest(point, number=str(NEAREST_CANDIDATE_LIMIT))
+    def _nearest_candidates(self, point, deadline=None):
+        if self.serves_nearest_locally():
+            return self._local_candidates([point])[0]
+        cached = self.snap_cache.get(point, NEAREST_CANDIDATE_LIMIT)
+        if cached is not None:
+            return list(cached)
+        timeout = self._deadline_timeout(deadline)
+        if deadline is not None and timeout is None:
+            return []
+        response = self.nearest(point, timeout=timeout, number=str(NEAREST_CANDIDATE_LIMIT))
+        candidates = self._candidates_from_nearest(response)
+        self.snap_cache.put(point, NEAREST_CANDIDATE_LIMIT, candidates)
+        return candidates
+
+    @classmethod
+    def _candidates_from_nearest(cls, response):
+        """Извлекает уникальные координаты кандидатов из ответа /nearest."""
         if response.get('code') != 'Ok':
             return []
 
         candidates = []
         seen = set()
         for waypoint in response.get('waypoints') or []:
-            formatted = self._format_location(waypoint.get('location'))
+            formatted = cls._format_location(waypoint.get('location'))
             if formatted and formatted not in seen:
                 candidates.append(formatted)
                 seen.add(formatted)
         return candidates
 
-    def _route_with_nearest_points(self, start, end, via, params):
-        start_candidates = self._nearest_candidates(start)
-        if not start_candidates:
+    def _local_candidates(self, points):
+        """Ищет кандидатов для нескольких точек одним запросом к индексу."""
+        try:
+            coordinates = [self._parse_point(point) for point in points]
+        except ValueError:
+            return [[] for _ in points]
+        lons, lats = zip(*coordinates)
+        indices, _ = self.graph.nearest(lons, lats, NEAREST_CANDIDATE_LIMIT)
+        result = []
+        for row in indices:
+            candidates = []
+            for index in row:
+                if index < 0:
+                    break
+                formatted = self._format_location((self.graph.lon[index], self.graph.lat[index]))
+                if formatted not in candidates:
+                    candidates.append(formatted)
+            result.append(candidates)
+        return result
+
+    @staticmethod
+    def _parse_point(point):
+        lon, lat = point.split(',')
+        return float(lon), float(lat)
+
+    def _local_nearest(self, point, params):
+        """Отвечает на /nearest по индексу узлов графа в формате OSRM.
+
+        Точка привязывается к ближайшему узлу графа, а не к проекции на
+        отрезок дороги, как в OSRM; ``hint`` и название улицы не отдаются.
+        """
+        try:
+            lon, lat = self._parse_point(point)
+            number = int(params.get('number', 1))
+        except ValueError:
             return None
+        if number < 1:
+            return None
+        indices, distances = self.graph.nearest([lon], [lat], number)
+        waypoints = []
+        for index, distance in zip(indices[0], distances[0]):
+            if index < 0:
+                break
+            waypoints.append({
+                'nodes': [int(self.graph.node_ids[index]), 0],
+                'distance': round(float(distance), 6),
+                'name': '',
+                'location': [round(float(self.graph.lon[index]), 6), round(float(self.graph.lat[index]), 6)]
+            })
+        return {'code': 'Ok', 'waypoints': waypoints}
 
-        end_candidates = self._nearest_candidates(end)
-        if not end_candidates:
+    def _probe_route(self, points, params, deadline, stop, probes):
+        """Пробует построить маршрут, пока не найден успешный и не истёк срок."""
+        if stop.is_set():
+            return None
+        timeout = self._deadline_timeout(deadline)
+        if timeout is None:
             return None
+        probes.append(points)
+        try:
+            return self.route_points(points, timeout=timeout, **params)
+        except requests.RequestException:
+            return None
+
+    def _fallback_candidates(self, start, end, deadline):
+        """Параллельно ищет кандидатов для старта и финиша."""
+        if self.serves_nearest_locally():
+            start_candidates, end_candidates = self._local_candidates([start, end])
+            if not start_candidates or not end_candidates:
+                return None
+            return start_candidates, end_candidates
+        executor = self._fallback_executor()
+        start_future = executor.submit(self._nearest_candidates, start, deadline)
+        end_future = executor.submit(self._nearest_candidates, end, deadline)
+        try:
+            with osrm_time():
+                start_candidates = start_future.result(timeout=max(0.0, deadline - time.monotonic()))
+                if not start_candidates:
+                    return None
+                end_candidates = end_future.result(timeout=max(0.0, deadline - time.monotonic()))
+                if not end_candidates:
+                    return None
+        except FutureTimeoutError:
+            return None
+        finally:
+            end_future.cancel()
+        return start_candidates, end_candidates
 
-        via_points = list(via) if via else []
-        for start_point in start_candidates:
-            for end_point in end_candidates:
-                coordinates = [start_point]
-                if via_points:
-                    coordinates.extend(via_points)
-                coordinates.append(end_point)
-                points = ';'.join(coordinates)
-                response = self.route_points(points, **params)
-                if self._is_route_success(response):
-                    return response
+    def _route_with_nearest_points(self, start, end, via, params):
+        """Ищет маршрут между ближайшими к старту и финишу точками дороги."""
+        strategy = self.fallback_strategy
+        deadline = time.monotonic() + self.fallback_deadline
+        probes = []
+        response = None
+        candidates = self._fallback_candidates(start, end, deadline)
+        if candidates is not None:
+            start_candidates, end_candidates = candidates
+            via_points = list(via) if via else []
+            if strategy == 'table':
+                response = self._fallback_by_table(
+                    start_candidates, end_candidates, via_points, params, deadline, probes
+                )
+            else:
+                response = self._fallback_by_probing(
+                    start_candidates, end_candidates, via_points, params, deadline, probes
+                )
+        self._fallback_total.inc((strategy, 'ok' if response is not None else 'failed'))
+        self._fallback_probes.observe(len(probes), (strategy,))
+        return response
+
+    @staticmethod
+    def _join_route_points(start_point, via_points, end_point):
+        coordinates = [start_point]
+        if via_points:
+            coordinates.extend(via_points)
+        coordinates.append(end_point)
+        return ';'.join(coordinates)
+
+    @staticmethod
+    def _candidate_table_query(start_candidates, end_candidates, via_points, params):
+        """Собирает координаты и параметры /table для оценки пар кандидатов.
+
+        Без via-точек матрица строится как старты × финиши. С via-точками
+        стартам нужна достижимость первой via, а финишам — последней, поэтому
+        источники дополняются последней via, а назначения — первой.
+        """
+        sources = list(start_candidates)
+        destinations = list(end_candidates)
+        if via_points:
+            sources.append(via_points[-1])
+            destinations.insert(0, via_points[0])
+        points = ';'.join(sources + destinations)
+        query = {
+            'sources': ';'.join(str(i) for i in range(len(sources))),
+            'destinations': ';'.join(
+                str(len(sources) + i) for i in range(len(destinations))
+            )
+        }
+        for key in _TABLE_FALLBACK_PARAMS:
+            if key in params:
+                query[key] = params[key]
+        return points, query
+
+    @staticmethod
+    def _rank_pairs_by_table(response, start_candidates, end_candidates, via_points):
+        """Возвращает достижимые пары кандидатов по возрастанию длительности."""
+        if response.get('code') != 'Ok':
+            return []
+        durations = response.get('durations') or []
+
+        ranked = []
+        for s_index, start_point in enumerate(start_candidates):
+            for e_index, end_point in enumerate(end_candidates):
+                try:
+                    if via_points:
+                        head = durations[s_index][0]
+                        tail = durations[len(start_candidates)][e_index + 1]
+                        cost = None if head is None or tail is None else head + tail
+                    else:
+                        cost = durations[s_index][e_index]
+                except (IndexError, TypeError):
+                    cost = None
+                if cost is not None:
+                    ranked.append((cost, s_index, e_index, start_point, end_point))
+        ranked.sort()
+        return [(start_point, end_point) for _, _, _, start_point, end_point in ranked]
+
+    def _rank_candidate_pairs(self, start_candidates, end_candidates, via_points, params, deadline):
+        """Одним запросом /table оценивает достижимость и стоимость пар кандидатов."""
+        timeout = self._deadline_timeout(deadline)
+        if timeout is None:
+            return []
+        points, query = self._candidate_table_query(start_candidates, end_candidates, via_points, params)
+        try:
+            response = self.table(points, timeout=timeout, **query)
+        except requests.RequestException:
+            return []
+        return self._rank_pairs_by_table(response, start_candidates, end_candidates, via_points)
+
+    def _fallback_by_table(self, start_candidates, end_candidates, via_points, params, deadline, probes):
+        """Выбирает лучшую пару по матрице /table и строит по ней маршрут."""
+        pairs = self._rank_candidate_pairs(start_candidates, end_candidates, via_points, params, deadline)
+        for start_point, end_point in pairs:
+            timeout = self._deadline_timeout(deadline)
+            if timeout is None:
+                break
+            points = self._join_route_points(start_point, via_points, end_point)
+            probes.append(points)
+            try:
+                response = self.route_points(points, timeout=timeout, **params)
+            except requests.RequestException:
+                continue
+            if self._is_route_success(response):
+                return response
+        return None
+
+    def _fallback_by_probing(self, start_candidates, end_candidates, via_points, params, deadline, probes):
+        """Параллельно перебирает пары кандидатов, первый успешный маршрут побеждает.
+
+        В пуле одновременно не больше ``fallback_probe_limit`` проб запроса:
+        пул общий, и запрос с множеством кандидатов не должен занимать его
+        целиком, пока запасной поиск других запросов ждёт в очереди.
+        """
+        executor = self._fallback_executor()
+        stop = threading.Event()
+        pairs = [
+            self._join_route_points(start_point, via_points, end_point)
+            for start_point in start_candidates
+            for end_point in end_candidates
+        ]
+        limit = max(1, min(len(pairs), self.fallback_probe_limit, self.fallback_workers))
+        order = {}
+        pending = set()
+        next_pair = 0
+        try:
+            while next_pair < len(pairs) or pending:
+                while next_pair < len(pairs) and len(pending) < limit:
+                    future = executor.submit(self._probe_route, pairs[next_pair], params, deadline, stop, probes)
+                    order[future] = next_pair
+                    pending.add(future)
+                    next_pair += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                with osrm_time():
+                    done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=order.get):
+                    response = future.result()
+                    if self._is_route_success(response):
+                        return response
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
         return None
 
+    def table(self, points, timeout=None, **params):
+        """Строит матрицу, разбивая её на тайлы, если она больше --max-table-size."""
+        coordinates = points.split(';')
+        sources = self._table_indices(params.get('sources'), len(coordinates))
+        destinations = self._table_indices(params.get('destinations'), len(coordinates))
+        if not needs_table_chunking(self.max_table_size, sources, destinations):
+            path = "/table/v1/driving/{}".format(points)
+            return self._cached('table', points, params, lambda: self._request(path, params, timeout=timeout))
+        return self._coalesced(
+            'table', points, params,
+            lambda: self._chunked_table(coordinates, sources, destinations, params, timeout)
+        )
+
+    @staticmethod
+    def _table_indices(value, count):
+        """Разбирает параметр sources/destinations в список индексов, None — при ошибке."""
+        if value is None or value == 'all':
+            return list(range(count))
+        try:
+            return [int(index) for index in str(value).split(';')]
+        except ValueError:
+            return None
 
-    def table(self, points, **params):
+    @staticmethod
+    def _tile_params(params, coordinate_indices, n_sources, n_destinations):
+        """Формирует параметры запроса для одного тайла матрицы."""
+        query = {}
+        for key, value in params.items():
+            if key in ('sources', 'destinations'):
+                continue
+            if key in _PER_COORDINATE_PARAMS:
+                values = str(value).split(';')
+                query[key] = ';'.join(values[index] for index in coordinate_indices)
+            else:
+                query[key] = value
+        query['sources'] = ';'.join(str(i) for i in range(n_sources))
+        query['destinations'] = ';'.join(
+            str(n_sources + i) for i in range(n_destinations)
+        )
+        return query
+
+    def _table_tile(self, coordinates, tile_sources, tile_destinations, params, timeout):
+        coordinate_indices = tile_sources + tile_destinations
+        points = ';'.join(coordinates[index] for index in coordinate_indices)
+        query = self._tile_params(params, coordinate_indices, len(tile_sources), len(tile_destinations))
         path = "/table/v1/driving/{}".format(points)
-        return self._request(path, params)
+        return self._request_or_error(path, query, timeout=timeout)
+
+    def _chunked_table(self, coordinates, sources, destinations, params, timeout):
+        """Считает матрицу тайлами не больше max_table_size и склеивает результат.
 
-    def nearest(self, point, **params):
+        Тайлы выполняются параллельно; строки итоговой матрицы выделяются
+        заранее и заполняются срезами, без промежуточных копий.
+        """
+        executor = self._executor('table', self.table_workers)
+        tiles = {}
+        for row, col, tile_sources, tile_destinations in table_tiles(self.max_table_size, sources, destinations):
+            future = executor.submit(
+                self._table_tile, coordinates, tile_sources, tile_destinations, params, timeout
+            )
+            tiles[future] = (row, col)
+
+        stitcher = TableStitcher(len(sources), len(destinations))
+        try:
+            for future in tiles:
+                row, col = tiles[future]
+                with osrm_time():
+                    response = future.result()
+                error = stitcher.add(row, col, response)
+                if error is not None:
+                    return error
+        finally:
+            for future in tiles:
+                future.cancel()
+        return stitcher.result()
+
+    def nearest(self, point, timeout=None, **params):
+        if self.serves_nearest_locally(params):
+            response = self._local_nearest(point, params)
+            if response is not None:
+                return response
         path = "/nearest/v1/driving/{}".format(point)
-        return self._request(path, params)
+        return self._cached('nearest', point, params, lambda: self._request(path, params, timeout=timeout))
+
+    def match(self, points, timeout=None, **params):
+        """Привязывает трек к дорогам, длинные треки — перекрывающимися окнами."""
+        coordinates = points.split(';')
+        if (self.max_matching_size <= 0 or len(coordinates) <= self.max_matching_size
+                or 'waypoints' in params):
+            path = "/match/v1/driving/{}".format(points)
+            return self._coalesced('match', points, params, lambda: self._request(path, params, timeout=timeout))
+        return self._coalesced('match', points, params, lambda: self._chunked_match(coordinates, params, timeout))
+
+    def _match_window(self, coordinates, window, params, timeout):
+        start, end = window[0], window[1]
+        query = window_params(params, start, end)
+        query['overview'] = 'false'
+        path = "/match/v1/driving/{}".format(';'.join(coordinates[start:end]))
+        return self._request_or_error(path, query, timeout=timeout)
 
-    def match(self, points, **params):
-        path = "/match/v1/driving/{}".format(points)
-        return self._request(path, params)
+    def _chunked_match(self, coordinates, params, timeout):
+        """Считает окна параллельно и склеивает их по порядку.
 
-    def trip(self, points, **params):
+        Одновременно в работе не больше match_workers окон, а ответ окна
+        освобождается сразу после склейки, так что память на длинных
+        треках ограничена итоговым результатом.
+        """
+        windows = match_windows(len(coordinates), self.max_matching_size, self.match_overlap)
+        executor = self._executor('match', self.match_workers)
+        merger = MatchMerger(len(coordinates))
+        in_flight = []
+        next_window = 0
+        try:
+            while next_window < len(windows) or in_flight:
+                while next_window < len(windows) and len(in_flight) < self.match_workers:
+                    window = windows[next_window]
+                    future = executor.submit(self._match_window, coordinates, window, params, timeout)
+                    in_flight.append((window, future))
+                    next_window += 1
+                window, future = in_flight.pop(0)
+                with osrm_time():
+                    response = future.result()
+                merger.add(window, response)
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+        return merger.result()
+
+    def trip(self, points, timeout=None, **params):
 
         path = "/trip/v1/driving/{}".format(points)
-        return self._request(path, params)
+        return self._coalesced('trip', points, params, lambda: self._request(path, params, timeout=timeout))
+
+    def rebuild(self, speed_file=None, wait=False):
+        """Запускает фоновую перестройку весов с учётом трафика и возвращает её состояние.
+
+        ``speed_file`` — CSV скоростей сегментов для ``osrm-customize``.
+        Пока идёт перестройка, OSRM продолжает отвечать на старых данных;
+        кэши очищаются после успешной перезагрузки. Повторный вызов во
+        время работы новый запуск не начинает; ``accepted`` в ответе
+        показывает, начат ли запуск этим вызовом.
+        """
+        accepted = self.rebuilder.start(speed_file)
+        status = self.rebuilder.wait() if wait else self.rebuilder.status()
+        status['accepted'] = accepted
+        return status
 
-    def rebuild(self):
-        """Быстрая перестройка CH с учётом обновлённого трафика."""
-        os.system("osrm-customize /data/odessa_oblast.osrm")
+    def _clear_caches(self):
+        self.cache.clear()
+        self.snap_cache.clear()
@@ -0,0 +1,260 @@
+"""Планировщик перестройки весов OSRM по накопленным изменениям трафика.
+
+Обновления трафика приходят часто, а ``osrm-customize`` на области идёт
+минуты, поэтому перестройка по каждому обновлению держала бы OSRM занятым
+постоянно. Планировщик копит изменения и запускает одну перестройку на
+серию обновлений:
+
+* величина изменений — число сегментов, взвешенное относительным сдвигом
+  скорости (сдвиг больше 100% или новый сегмент считается за один). С
+  графом она считается по чистому дрейфу весов рёбер от последней
+  перестройки, поэтому изменения, вернувшиеся назад, не копятся;
+* пока обновления идут чаще ``quiet`` секунд, перестройка откладывается,
+  и серия сливается в один запуск;
+* запуск начинается, когда величина достигла ``min_change`` или самому
+  старому неучтённому изменению больше ``max_delay`` секунд;
+* после перестройки следующая не начинается раньше, чем через
+  ``cost_factor`` её длительностей, — доля времени OSRM на пересчёт
+  ограничена, как бы часто ни менялся трафик;
+* одновременно идёт одна перестройка (``Rebuilder``); изменения,
+  пришедшие во время неё, ждут следующего запуска, а изменения неудачного
+  запуска возвращаются в очередь.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from routing.metrics import Registry
+from routing.traffic import TRAFFIC_OUTPUT_DIR, write_speed_file
+
+
+REBUILD_MIN_CHANGE = float(os.environ.get('OSRM_REBUILD_MIN_CHANGE', '50'))
+REBUILD_QUIET = float(os.environ.get('OSRM_REBUILD_QUIET', '30'))
+REBUILD_MAX_DELAY = float(os.environ.get('OSRM_REBUILD_MAX_DELAY', '900'))
+# Пауза после перестройки в её длительностях: 4 — OSRM пересчитывает не больше 20% времени.
+REBUILD_COST_FACTOR = float(os.environ.get('OSRM_REBUILD_COST_FACTOR', '4'))
+REBUILD_CHECK_INTERVAL = float(os.environ.get('OSRM_REBUILD_CHECK_INTERVAL', '5'))
+GRAPH_SPEED_FILE_NAME = 'graph_speeds.csv'
+LATENCY_BUCKETS = (10, 30, 60, 120, 300, 600, 900, 1800, 3600)
+COALESCED_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+logger = logging.getLogger(__name__)
+
+
+def write_graph_speed_file(graph, path):
+    """Пишет скорости рёбер графа, отличающихся от свободного потока, в CSV для ``osrm-customize``."""
+    edges = np.flatnonzero(graph.weights != graph.free_flow_weights())
+    speeds = graph.lengths[edges] / graph.weights[edges] * 3.6
+    keys = zip(graph.node_ids[graph.sources[edges]].tolist(), graph.node_ids[graph.targets[edges]].tolist())
+    return write_speed_file(dict(zip(keys, speeds.tolist())), path)
+
+
+class RebuildScheduler:
+    """Решает, когда перестраивать веса ``router``, и запускает перестройку."""
+
+    def __init__(self, router, graph=None, output_dir=TRAFFIC_OUTPUT_DIR, min_change=REBUILD_MIN_CHANGE,
+                 quiet=REBUILD_QUIET, max_delay=REBUILD_MAX_DELAY, cost_factor=REBUILD_COST_FACTOR,
+                 interval=REBUILD_CHECK_INTERVAL, clock=time.monotonic):
+        self.router = router
+        self.rebuilder = router.rebuilder
+        self.graph = graph
+        self.graph_speed_file = os.path.join(output_dir, GRAPH_SPEED_FILE_NAME)
+        self.min_change = min_change
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.cost_factor = cost_factor
+        self.interval = interval
+        self.cost = 0.0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._baseline = np.array(graph.weights) if graph is not None else None
+        self._reset_pending()
+        self._in_flight = None
+        self._last_finished = None
+        self._decision = 'idle'
+        self._last_latency = None
+        self._stop = threading.Event()
+        self._thread = None
+        metrics = getattr(router, 'metrics', None)
+        self.metrics = metrics if metrics is not None else Registry()
+        self._pending_change_gauge = self.metrics.gauge(
+            'osrm_rebuild_pending_change', 'Накопленная величина изменений трафика до перестройки'
+        )
+        self._pending_updates_gauge = self.metrics.gauge(
+            'osrm_rebuild_pending_updates', 'Обновления трафика, ожидающие перестройки'
+        )
+        self._pending_age_gauge = self.metrics.gauge(
+            'osrm_rebuild_pending_age_seconds', 'Возраст самого старого неучтённого изменения'
+        )
+        self._scheduled = self.metrics.counter(
+            'osrm_rebuild_scheduled_total', 'Перестройки, запущенные планировщиком', ('reason',)
+        )
+        self._latency = self.metrics.histogram(
+            'osrm_rebuild_latency_seconds', 'Время от первого изменения трафика до новых весов в OSRM',
+            buckets=LATENCY_BUCKETS
+        )
+        self._coalesced = self.metrics.histogram(
+            'osrm_rebuild_coalesced_updates', 'Обновления трафика, объединённые в одну перестройку',
+            buckets=COALESCED_BUCKETS
+        )
+
+    def _reset_pending(self):
+        self._change = 0.0
+        self._updates = 0
+        self._edges = np.zeros(0, dtype=np.int64)
+        self._first_at = None
+        self._last_at = None
+        self._speed_file = None
+
+    def record(self, change=1.0, speed_file=None, edges=None, now=None):
+        """Учитывает одно обновление трафика.
+
+        ``change`` — величина изменений (без графа), ``edges`` — рёбра графа,
+        которые вернул ``Graph.update_weights``, ``speed_file`` — CSV
+        скоростей для следующей перестройки.
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._change += change
+            self._updates += 1
+            if edges is not None and len(edges):
+                self._edges = np.union1d(self._edges, np.asarray(edges, dtype=np.int64))
+            if speed_file:
+                self._speed_file = speed_file
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+            self._publish(now)
+
+    def pending_change(self):
+        """Величина изменений, ещё не попавших в OSRM."""
+        if self.graph is None:
+            return self._change
+        if len(self._baseline) != self.graph.edge_count:
+            # Граф перезагружен: дрейф считается от новых весов.
+            self._baseline = np.array(self.graph.weights)
+            self._edges = self._edges[:0]
+        edges = self._edges
+        baseline = self._baseline[edges].astype(np.float64)
+        drift = np.abs(self.graph.weights[edges] - baseline) / baseline
+        return float(np.minimum(drift, 1.0).sum())
+
+    def poll(self, now=None):
+        """Проверяет завершение перестройки и при необходимости запускает новую; возвращает решение."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._collect(now)
+            decision, reason = self._decide(now)
+            if decision == 'rebuild':
+                decision = self._launch(reason)
+            self._decision = decision
+            self._publish(now)
+            return decision
+
+    def _decide(self, now):
+        if self._in_flight is not None or self.rebuilder.running:
+            return 'running', None
+        if not self._updates:
+            return 'idle', None
+        change = self.pending_change()
+        if change <= 0:
+            # Веса вернулись к загруженным в OSRM: перестраивать нечего.
+            self._reset_pending()
+            return 'idle', None
+        if self._last_finished is not None and now - self._last_finished < self.cost_factor * self.cost:
+            return 'cooldown', None
+        if now - self._first_at >= self.max_delay:
+            return 'rebuild', 'age'
+        if now - self._last_at < self.quiet:
+            return 'debounce', None
+        if change >= self.min_change:
+            return 'rebuild', 'change'
+        return 'waiting', None
+
+    def _launch(self, reason):
+        speed_file = self._speed_file
+        if self.graph is not None:
+            speed_file = write_graph_speed_file(self.graph, self.graph_speed_file)
+        if not self.rebuilder.start(speed_file):
+            return 'running'
+        self._scheduled.inc((reason,))
+        self._in_flight = {
+            'change': self._change, 'updates': self._updates, 'edges': self._edges,
+            'first_at': self._first_at, 'last_at': self._last_at, 'speed_file': self._speed_file,
+            'baseline': self._baseline
+        }
+        if self.graph is not None:
+            self._baseline = np.array(self.graph.weights)
+        self._reset_pending()
+        return 'rebuild'
+
+    def _collect(self, now):
+        """Завершает учёт перестройки, если она закончилась."""
+        batch = self._in_flight
+        if batch is None or self.rebuilder.running:
+            return
+        self._in_flight = None
+        self._last_finished = now
+        status = self.rebuilder.status()
+        if status.get('duration_s') is not None:
+            self.cost = float(status['duration_s'])
+        if status.get('state') == 'succeeded':
+            self._last_latency = now - batch['first_at']
+            self._latency.observe(self._last_latency)
+            self._coalesced.observe(batch['updates'])
+            return
+        logger.warning('Scheduled rebuild ended with %s, %d updates requeued', status.get('state'), batch['updates'])
+        # Новые веса не загружены: изменения серии снова ждут перестройки.
+        self._change += batch['change']
+        self._updates += batch['updates']
+        self._edges = np.union1d(self._edges, batch['edges'])
+        self._first_at = batch['first_at']
+        self._last_at = max(self._last_at or batch['last_at'], batch['last_at'])
+        self._speed_file = self._speed_file or batch['speed_file']
+        self._baseline = batch['baseline']
+
+    def _publish(self, now):
+        self._pending_change_gauge.set(round(self.pending_change(), 3))
+        self._pending_updates_gauge.set(self._updates)
+        self._pending_age_gauge.set(round(now - self._first_at, 3) if self._first_at is not None else 0)
+
+    def status(self):
+        """Состояние очереди для ``/stats``."""
+        now = self._clock()
+        with self._lock:
+            return {
+                'decision': self._decision,
+                'pending_change': round(self.pending_change(), 3),
+                'pending_updates': self._updates,
+                'pending_age_s': round(now - self._first_at, 3) if self._first_at is not None else None,
+                'in_flight_updates': self._in_flight['updates'] if self._in_flight is not None else 0,
+                'rebuild_cost_s': self.cost,
+                'last_latency_s': round(self._last_latency, 3) if self._last_latency is not None else None
+            }
+
+    def start(self):
+        """Запускает проверки в фоновом потоке."""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='osrm-rebuild-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except OSError as exc:
+                logger.warning('Rebuild scheduling failed: %s', exc)
+            self._stop.wait(self.interval)
@@ -0,0 +1,148 @@
+"""Пространственный индекс узлов графа для пакетного поиска ближайших.
+
+Координаты проецируются на плоскость (равнопромежуточная проекция вокруг
+средней широты — для области размером с регион погрешность доли процента),
+узлы раскладываются по квадратной сетке, ячейки хранятся в виде CSR.
+Запрос по тысячам точек выполняется целиком на массивах NumPy: для всех
+точек сразу перебираются ячейки в квадрате радиуса ``r``, и только точки,
+для которых ответ ещё не гарантирован, переходят к следующему радиусу.
+"""
+
+import math
+
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371008.8
+DEFAULT_CELL_SIZE = 200.0
+# Больше стольких ячеек на точку квадрат не растёт: дальше полный перебор точек.
+MAX_SEARCH_CELLS = 1089
+# Ограничение размера промежуточных массивов одного шага (элементов).
+STEP_BUDGET = 1 << 22
+
+
+class GridIndex:
+    """Сеточный индекс точек с пакетным поиском k ближайших."""
+
+    def __init__(self, lon, lat, cell_size=DEFAULT_CELL_SIZE):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.size = len(lon)
+        self._lat0 = float(np.mean(lat)) if self.size else 0.0
+        self._kx = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(self._lat0))
+        self._ky = math.radians(1) * EARTH_RADIUS_M
+        x, y = self._project(lon, lat)
+        self._x0 = float(x.min()) if self.size else 0.0
+        self._y0 = float(y.min()) if self.size else 0.0
+        cx, cy = self._cells(x, y)
+        self.width = int(cx.max()) + 1 if self.size else 1
+        self.height = int(cy.max()) + 1 if self.size else 1
+        cell_ids = cy * self.width + cx
+        self._order = np.argsort(cell_ids, kind='stable').astype(np.int64)
+        self._x = x[self._order]
+        self._y = y[self._order]
+        counts = np.bincount(cell_ids, minlength=self.width * self.height)
+        self._cell_start = np.zeros(self.width * self.height + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._cell_start[1:])
+
+    def _project(self, lon, lat):
+        return lon * self._kx, lat * self._ky
+
+    def _cells(self, x, y):
+        cx = np.floor((x - self._x0) / self.cell_size).astype(np.int64)
+        cy = np.floor((y - self._y0) / self.cell_size).astype(np.int64)
+        return cx, cy
+
+    def query(self, lon, lat, k=1):
+        """Возвращает (индексы, расстояния в метрах) k ближайших точек для каждой точки запроса.
+
+        Результат — массивы формы (n, k); если точек в индексе меньше k,
+        недостающие места заполнены -1 и ``inf``.
+        """
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        count = len(lon)
+        indices = np.full((count, k), -1, dtype=np.int64)
+        distances = np.full((count, k), np.inf)
+        if not self.size or not count:
+            return indices, distances
+        qx, qy = self._project(lon, lat)
+        qcx, qcy = self._cells(qx, qy)
+        # Для точек за пределами сетки поиск начинается с ближайшей ячейки на краю.
+        qcx_clipped = np.clip(qcx, 0, self.width - 1)
+        qcy_clipped = np.clip(qcy, 0, self.height - 1)
+        outside = np.maximum(np.abs(qcx - qcx_clipped), np.abs(qcy - qcy_clipped))
+        pending = np.arange(count)
+        radius = 1
+        max_radius = max(self.width, self.height)
+        while len(pending):
+            if (2 * radius + 1) ** 2 > MAX_SEARCH_CELLS and radius < max_radius:
+                self._brute_force(qx[pending], qy[pending], k, indices, distances, pending)
+                break
+            step = max(1, STEP_BUDGET // (2 * radius + 1) ** 2)
+            unresolved = []
+            for first in range(0, len(pending), step):
+                rows = pending[first:first + step]
+                (cand_idx, cand_dist), kth = self._search(
+                    qx[rows], qy[rows], qcx_clipped[rows], qcy_clipped[rows], radius, k
+                )
+                # Ответ точен, если k-й кандидат ближе любой точки вне просмотренного квадрата.
+                reach = (radius - outside[rows]) * self.cell_size
+                done = (kth <= reach) | (radius >= max_radius)
+                indices[rows[done]] = cand_idx[done]
+                distances[rows[done]] = cand_dist[done]
+                unresolved.append(rows[~done])
+            pending = np.concatenate(unresolved)
+            radius = min(radius * 2, max_radius)
+        return indices, distances
+
+    def _brute_force(self, qx, qy, k, indices, distances, rows):
+        """Перебирает все точки для запросов вдали от узлов, частями по ``STEP_BUDGET``."""
+        take = min(k, self.size)
+        step = max(1, STEP_BUDGET // self.size)
+        for first in range(0, len(rows), step):
+            part = slice(first, first + step)
+            d2 = (self._x[None, :] - qx[part, None]) ** 2 + (self._y[None, :] - qy[part, None]) ** 2
+            if take < self.size:
+                nearest = np.argpartition(d2, take - 1, axis=1)[:, :take]
+            else:
+                nearest = np.broadcast_to(np.arange(self.size), d2.shape)
+            nearest_d2 = np.take_along_axis(d2, nearest, 1)
+            order = np.argsort(nearest_d2, axis=1)
+            nearest = np.take_along_axis(nearest, order, 1)
+            indices[rows[part], :take] = self._order[nearest]
+            distances[rows[part], :take] = np.sqrt(np.take_along_axis(nearest_d2, order, 1))
+
+    def _search(self, qx, qy, qcx, qcy, radius, k):
+        """Ищет кандидатов в квадрате ячеек радиуса ``radius`` вокруг каждой точки."""
+        count = len(qx)
+        span = np.arange(-radius, radius + 1)
+        dx, dy = np.meshgrid(span, span)
+        cx = qcx[:, None] + dx.ravel()[None, :]
+        cy = qcy[:, None] + dy.ravel()[None, :]
+        valid = (cx >= 0) & (cx < self.width) & (cy >= 0) & (cy < self.height)
+        cell = np.where(valid, cy * self.width + cx, 0)
+        starts = self._cell_start[cell]
+        counts = np.where(valid, self._cell_start[cell + 1] - starts, 0)
+        counts = counts.ravel()
+        total = int(counts.sum())
+        result_idx = np.full((count, k), -1, dtype=np.int64)
+        result_dist = np.full((count, k), np.inf)
+        if total == 0:
+            return (result_idx, result_dist), np.full(count, np.inf)
+        owner = np.repeat(np.repeat(np.arange(count), cell.shape[1]), counts)
+        first = np.repeat(starts.ravel(), counts)
+        offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        position = first + offset
+        d2 = (self._x[position] - qx[owner]) ** 2 + (self._y[position] - qy[owner]) ** 2
+        order = np.lexsort((d2, owner))
+        owner = owner[order]
+        position = position[order]
+        d2 = d2[order]
+        group_start = np.searchsorted(owner, np.arange(count))
+        rank = np.arange(total) - group_start[owner]
+        take = rank < k
+        result_idx[owner[take], rank[take]] = self._order[position[take]]
+        result_dist[owner[take], rank[take]] = np.sqrt(d2[take])
+        return (result_idx, result_dist), result_dist[:, k - 1]
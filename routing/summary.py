@@ -1,5 +1,7 @@
 """Утилиты форматирования маршрутов OSRM для интеграции с ботами."""
 
+from routing.jsonstream import JSONStreamReader
+
 
 
 _MANEUVER_TEXT = {
@@ -69,80 +71,201 @@ def _humanize_step(step):
     return text or 'Двигайтесь дальше'
 
 
-def build_route_summary(response):
-    """Преобразует ответ OSRM в удобный для Telegram формат."""
-    routes = response.get('routes') or []
-    if not routes:
-        return {
-            'distance_km': 0.0,
-            'duration_min': 0.0,
-            'legs': [],
-            'message': 'Маршрут не найден.'
-        }
+# Шаблоны инструкций по паре (type, modifier): текст без названия улицы и
+# префикс, к которому дописывается название. Число пар в OSRM невелико,
+# размер словаря ограничен на случай произвольных модификаторов.
+_TEMPLATES = {}
+_TEMPLATE_LIMIT = 512
+_NO_MANEUVER = {}
+
+
+def _instruction_template(key):
+    """Строит шаблон для пары (type, modifier) тем же кодом, что и _humanize_step."""
+    step_type, modifier = key
+    try:
+        text = _humanize_step({'maneuver': {'type': step_type, 'modifier': modifier}})
+    except (KeyError, IndexError, ValueError):
+        return None
+    template = (text, text + (' к ' if step_type == 'arrive' else ' по '))
+    if len(_TEMPLATES) < _TEMPLATE_LIMIT:
+        _TEMPLATES[key] = template
+    return template
 
-    route = routes[0]
-    legs = route.get('legs') or []
-    waypoints = response.get('waypoints') or []
+
+def _summarize_steps(steps):
+    """Возвращает шаги участка для резюме; результат совпадает с _humanize_step."""
+    templates = _TEMPLATES
+    result = []
+    append = result.append
+    for step in steps:
+        maneuver = step.get('maneuver', _NO_MANEUVER)
+        key = (maneuver.get('type'), maneuver.get('modifier'))
+        try:
+            template = templates[key]
+        except KeyError:
+            template = _instruction_template(key)
+        except TypeError:
+            template = None
+        name = step.get('name') or ''
+        if template is None:
+            instruction = _humanize_step(step)
+        elif not name:
+            instruction = template[0]
+        elif type(name) is str:
+            instruction = template[1] + name
+        else:
+            instruction = _humanize_step(step)
+        append({
+            'instruction': instruction,
+            'distance_km': round(step.get('distance', 0.0) / 1000, 2),
+            'duration_min': round(step.get('duration', 0.0) / 60, 1)
+        })
+    return result
+
+
+def _not_found_summary():
+    return {
+        'distance_km': 0.0,
+        'duration_min': 0.0,
+        'legs': [],
+        'message': 'Маршрут не найден.'
+    }
 
 
-    waypoint_names = []
+class RouteSummaryBuilder:
+    """Собирает резюме маршрута по участкам.
 
-    for idx, waypoint in enumerate(waypoints):
-        name = waypoint.get('name')
-        if not name:
-            name = _fallback_waypoint_name(waypoint.get('location', ()), idx + 1)
-        waypoint_names.append(name)
+    Шаги участка возвращаются из ``add_leg`` и дальше не хранятся: для
+    итогового резюме нужны только длина, время и название каждого участка
+    и имена точек, которые могут прийти и после участков.
+    """
 
-    legs_payload = []
-    total_distance = _meters_to_kilometers(route.get('distance', 0.0))
-    total_duration = _seconds_to_minutes(route.get('duration', 0.0))
-    message_lines = ["Маршрут: {:.1f} км · {:.0f} мин".format(total_distance, total_duration)]
+    def __init__(self):
+        self._legs = []
 
-    for index, leg in enumerate(legs):
-        leg_distance = _meters_to_kilometers(leg.get('distance', 0.0))
-        leg_duration = _seconds_to_minutes(leg.get('duration', 0.0))
+    def add_leg(self, leg):
+        """Возвращает резюме участка со шагами и запоминает его заголовок."""
+        distance = _meters_to_kilometers(leg.get('distance', 0.0))
+        duration = _seconds_to_minutes(leg.get('duration', 0.0))
         summary = leg.get('summary') or 'Безымянный участок'
-        origin = (
-            waypoint_names[index]
-            if index < len(waypoint_names)
-            else "Точка {}".format(index + 1)
-        )
-        destination = (
-            waypoint_names[index + 1]
-            if index + 1 < len(waypoint_names)
-            else "Точка {}".format(index + 2)
-        )
-        steps = []
-        for step in leg.get('steps') or []:
-            steps.append({
-                'instruction': _humanize_step(step),
-                'distance_km': _meters_to_kilometers(step.get('distance', 0.0)),
-                'duration_min': _seconds_to_minutes(step.get('duration', 0.0))
-            })
-
-        legs_payload.append({
-            'origin': origin,
-            'destination': destination,
-            'distance_km': leg_distance,
-            'duration_min': leg_duration,
+        self._legs.append((distance, duration, summary))
+        return {
+            'distance_km': distance,
+            'duration_min': duration,
             'summary': summary,
-            'steps': steps
-        })
+            'steps': _summarize_steps(leg.get('steps') or [])
+        }
 
-        message_lines.append(
-            "{}) {} → {}: {:.1f} км · {:.0f} мин".format(
-                index + 1,
-                origin,
-                destination,
-                leg_distance,
-                leg_duration
+    def finish(self, distance, duration, waypoints, steps=None):
+        """Возвращает резюме маршрута; ``steps`` — шаги по участкам, если их нужно вложить."""
+        waypoint_names = []
+        for idx, waypoint in enumerate(waypoints):
+            name = waypoint.get('name')
+            if not name:
+                name = _fallback_waypoint_name(waypoint.get('location', ()), idx + 1)
+            waypoint_names.append(name)
+
+        legs_payload = []
+        total_distance = _meters_to_kilometers(distance)
+        total_duration = _seconds_to_minutes(duration)
+        message_lines = ["Маршрут: {:.1f} км · {:.0f} мин".format(total_distance, total_duration)]
+
+        for index, (leg_distance, leg_duration, summary) in enumerate(self._legs):
+            origin = (
+                waypoint_names[index]
+                if index < len(waypoint_names)
+                else "Точка {}".format(index + 1)
+            )
+            destination = (
+                waypoint_names[index + 1]
+                if index + 1 < len(waypoint_names)
+                else "Точка {}".format(index + 2)
             )
-        )
+            leg_payload = {
+                'origin': origin,
+                'destination': destination,
+                'distance_km': leg_distance,
+                'duration_min': leg_duration,
+                'summary': summary
+            }
+            if steps is not None:
+                leg_payload['steps'] = steps[index]
+            legs_payload.append(leg_payload)
+
+            message_lines.append(
+                "{}) {} → {}: {:.1f} км · {:.0f} мин".format(
+                    index + 1,
+                    origin,
+                    destination,
+                    leg_distance,
+                    leg_duration
+                )
+            )
+
+        return {
+            'distance_km': total_distance,
+            'duration_min': total_duration,
+            'legs': legs_payload,
+            'message': '\n'.join(message_lines)
+        }
 
-    return {
-        'distance_km': total_distance,
-        'duration_min': total_duration,
-        'legs': legs_payload,
-        'message': '\n'.join(message_lines)
-    }
 
+def build_route_summary(response):
+    """Преобразует ответ OSRM в удобный для Telegram формат."""
+    routes = response.get('routes') or []
+    if not routes:
+        return _not_found_summary()
+
+    route = routes[0]
+    builder = RouteSummaryBuilder()
+    steps = [builder.add_leg(leg)['steps'] for leg in route.get('legs') or []]
+    return builder.finish(
+        route.get('distance', 0.0),
+        route.get('duration', 0.0),
+        response.get('waypoints') or [],
+        steps
+    )
+
+
+def iter_route_summary(chunks):
+    """Строит резюме по потоку байтов ответа OSRM /route, разбирая его по участкам.
+
+    Сначала отдаёт по словарю ``{'leg': номер, ...}`` на каждый участок первого
+    маршрута сразу после его разбора, затем ``{'summary': ...}`` — резюме, как у
+    ``build_route_summary``, но без шагов. В памяти одновременно находится
+    один участок; геометрия и альтернативные маршруты пропускаются.
+    """
+    reader = JSONStreamReader(chunks)
+    builder = RouteSummaryBuilder()
+    distance = duration = 0.0
+    waypoints = []
+    found = False
+    for key in reader.iter_object():
+        if key == 'routes' and reader.peek() == '[':
+            for route_index in reader.iter_array():
+                if route_index > 0:
+                    reader.skip_value()
+                    continue
+                found = True
+                for route_key in reader.iter_object():
+                    if route_key == 'legs' and reader.peek() == '[':
+                        for leg_index in reader.iter_array():
+                            item = {'leg': leg_index}
+                            item.update(builder.add_leg(reader.read_value()))
+                            yield item
+                    elif route_key == 'distance':
+                        distance = reader.read_value()
+                    elif route_key == 'duration':
+                        duration = reader.read_value()
+                    else:
+                        reader.skip_value()
+        elif key == 'waypoints' and reader.peek() == '[':
+            for _ in reader.iter_array():
+                waypoint = reader.read_value()
+                waypoints.append({'name': waypoint.get('name'), 'location': waypoint.get('location', ())})
+        else:
+            reader.skip_value()
+    if not found:
+        yield {'summary': _not_found_summary()}
+        return
+    yield {'summary': builder.finish(distance, duration, waypoints)}
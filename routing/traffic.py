@@ -1,8 +1,401 @@
-"""Получение и обработка live-traffic данных."""
+"""Получение и обработка live-traffic данных.
 
+Конвейер работает потоком и с ограниченной памятью:
 
+1. ``fetch(source)`` читает источник генератором: файл, каталог, куда
+   складываются файлы (обработанные переносятся в ``processed/``), или
+   HTTP-адрес. Строки — NDJSON или CSV (с заголовком или без, тогда
+   колонки ``from_node,to_node,speed[,timestamp]``); каждая запись
+   приводится к кортежу ``(from_node, to_node, speed_kmh, timestamp)``;
+2. записи идут пачками по ``TRAFFIC_BATCH_SIZE`` в ``SegmentAggregator``,
+   который усредняет скорость сегмента внутри окна ``TRAFFIC_WINDOW``;
+3. ``TrafficPipeline.run_once`` сравнивает свежие скорости с последними
+   опубликованными, пишет CSV для ``osrm-customize --segment-speed-file``
+   и запускает перестройку, только если заметно изменилось достаточно
+   сегментов. С ``scheduler`` (``routing.scheduler.RebuildScheduler``)
+   каждое изменение передаётся планировщику, и момент перестройки
+   выбирает он.
 
-def fetch(source):
+Перестройка каждый раз начинается с исходных данных, поэтому CSV содержит
+все актуальные сегменты, а не только изменившиеся; изменения определяют
+лишь, нужна ли перестройка.
 
-    """Заглушка получения трафика."""
-    return []
+Фоновый запуск: ``python -m routing.traffic ИСТОЧНИК``.
+"""
+
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+
+TRAFFIC_SOURCE = os.environ.get('TRAFFIC_SOURCE', '')
+TRAFFIC_INTERVAL = float(os.environ.get('TRAFFIC_INTERVAL', '60'))
+TRAFFIC_WINDOW = float(os.environ.get('TRAFFIC_WINDOW', '300'))
+TRAFFIC_BATCH_SIZE = int(os.environ.get('TRAFFIC_BATCH_SIZE', '10000'))
+# Перестройка запускается, когда изменилось не меньше стольких сегментов...
+TRAFFIC_MIN_CHANGED = int(os.environ.get('TRAFFIC_MIN_CHANGED', '50'))
+# ...а изменением считается сдвиг скорости не меньше чем на столько км/ч.
+TRAFFIC_SPEED_DELTA = float(os.environ.get('TRAFFIC_SPEED_DELTA', '5'))
+TRAFFIC_OUTPUT_DIR = os.environ.get('TRAFFIC_OUTPUT_DIR', '/data/traffic')
+# Порт /metrics фонового процесса (очередь и задержки перестройки); 0 — не отдавать.
+TRAFFIC_METRICS_PORT = int(os.environ.get('TRAFFIC_METRICS_PORT', '0'))
+SPEED_FILE_NAME = 'segment_speeds.csv'
+MAX_SPEED_KMH = 250.0
+HTTP_TIMEOUT = (3.05, 60)
+
+_FROM_KEYS = ('from_node', 'from', 'u')
+_TO_KEYS = ('to_node', 'to', 'v')
+_SPEED_KEYS = ('speed', 'speed_kmh')
+_TIME_KEYS = ('timestamp', 'ts', 'time')
+_COLUMNS = ('from_node', 'to_node', 'speed', 'timestamp')
+PROCESSED_DIR = 'processed'
+
+logger = logging.getLogger(__name__)
+
+
+def _first(raw, keys):
+    for key in keys:
+        value = raw.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def normalize(raw, now=None):
+    """Приводит запись к ``(from_node, to_node, speed_kmh, timestamp)`` или None.
+
+    Скорость берётся из ``speed``/``speed_kmh`` либо считается по
+    ``length`` (м) и ``duration`` (с); время — секунды Unix, по умолчанию
+    текущее.
+    """
+    try:
+        from_node = int(_first(raw, _FROM_KEYS))
+        to_node = int(_first(raw, _TO_KEYS))
+        speed = _first(raw, _SPEED_KEYS)
+        if speed is None:
+            speed = float(raw['length']) / float(raw['duration']) * 3.6
+        speed = float(speed)
+        stamp = _first(raw, _TIME_KEYS)
+        stamp = float(stamp) if stamp is not None else (time.time() if now is None else now)
+    except (TypeError, ValueError, KeyError, ZeroDivisionError):
+        return None
+    if not 0 < speed <= MAX_SPEED_KMH or from_node == to_node:
+        return None
+    return from_node, to_node, speed, stamp
+
+
+def parse_lines(lines):
+    """Разбирает строки NDJSON или CSV в словари, не накапливая их."""
+    header = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            try:
+                raw = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(raw, dict):
+                yield raw
+            continue
+        row = next(csv.reader([line]))
+        if header is None and not row[0].lstrip('-').isdigit():
+            header = [name.strip() for name in row]
+            continue
+        yield dict(zip(header or _COLUMNS, row))
+
+
+def iter_file(path):
+    with open(path, encoding='utf-8', errors='replace') as handle:
+        for raw in parse_lines(handle):
+            yield raw
+
+
+def iter_directory(path):
+    """Читает файлы каталога по порядку изменения и переносит прочитанные в ``processed/``."""
+    done = os.path.join(path, PROCESSED_DIR)
+    names = [name for name in os.listdir(path)
+             if not name.startswith('.') and os.path.isfile(os.path.join(path, name))]
+    names.sort(key=lambda name: os.stat(os.path.join(path, name)).st_mtime)
+    for name in names:
+        for raw in iter_file(os.path.join(path, name)):
+            yield raw
+        os.makedirs(done, exist_ok=True)
+        os.replace(os.path.join(path, name), os.path.join(done, name))
+
+
+def iter_http(url, session=None):
+    session = session or requests
+    response = session.get(url, stream=True, timeout=HTTP_TIMEOUT)
+    try:
+        response.raise_for_status()
+        for raw in parse_lines(response.iter_lines()):
+            yield raw
+    finally:
+        response.close()
+
+
+def fetch(source, now=None):
+    """Отдаёт нормализованные записи трафика из файла, каталога или по HTTP."""
+    if source.startswith(('http://', 'https://')):
+        records = iter_http(source)
+    elif os.path.isdir(source):
+        records = iter_directory(source)
+    else:
+        records = iter_file(source)
+    for raw in records:
+        record = normalize(raw, now)
+        if record is not None:
+            yield record
+
+
+def batched(records, size=TRAFFIC_BATCH_SIZE):
+    """Группирует записи в списки не длиннее ``size``."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SegmentAggregator:
+    """Средняя скорость каждого сегмента в окне времени.
+
+    Окна выровнены по ``window`` секунд. Запись из более нового окна
+    сбрасывает накопленное для сегмента, более старая отбрасывается;
+    память ограничена числом сегментов сети.
+    """
+
+    def __init__(self, window=TRAFFIC_WINDOW):
+        self.window = window
+        self._segments = {}
+
+    def __len__(self):
+        return len(self._segments)
+
+    def add(self, batch):
+        segments = self._segments
+        window = self.window
+        for from_node, to_node, speed, stamp in batch:
+            bucket = int(stamp // window)
+            key = (from_node, to_node)
+            state = segments.get(key)
+            if state is None or state[0] < bucket:
+                segments[key] = [bucket, speed, 1]
+            elif state[0] == bucket:
+                state[1] += speed
+                state[2] += 1
+
+    def snapshot(self, now=None):
+        """Возвращает {сегмент: средняя скорость} и забывает сегменты старше двух окон."""
+        now = time.time() if now is None else now
+        oldest = int(now // self.window) - 1
+        result = {}
+        for key in list(self._segments):
+            bucket, total, count = self._segments[key]
+            if bucket < oldest:
+                del self._segments[key]
+            else:
+                result[key] = total / count
+        return result
+
+
+def write_speed_file(speeds, path):
+    """Пишет CSV ``from,to,speed`` для ``osrm-customize`` атомарной заменой файла."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        for (from_node, to_node), speed in sorted(speeds.items()):
+            writer.writerow((from_node, to_node, max(1, int(round(speed)))))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+class TrafficPipeline:
+    """Периодически читает источник и публикует скорости сегментов."""
+
+    def __init__(self, source=TRAFFIC_SOURCE, router=None, graph=None, output_dir=TRAFFIC_OUTPUT_DIR,
+                 window=TRAFFIC_WINDOW, interval=TRAFFIC_INTERVAL, batch_size=TRAFFIC_BATCH_SIZE,
+                 min_changed=TRAFFIC_MIN_CHANGED, speed_delta=TRAFFIC_SPEED_DELTA, scheduler=None):
+        self.source = source
+        self.router = router
+        self.graph = graph
+        self.scheduler = scheduler
+        self.speed_file = os.path.join(output_dir, SPEED_FILE_NAME)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.min_changed = min_changed
+        self.speed_delta = speed_delta
+        self.aggregator = SegmentAggregator(window)
+        self.published = {}
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def changed_segments(self, speeds):
+        """Сегменты, чья скорость появилась, исчезла или сдвинулась не меньше чем на ``speed_delta``."""
+        changed = [key for key, speed in speeds.items()
+                   if key not in self.published or abs(speed - self.published[key]) >= self.speed_delta]
+        changed.extend(key for key in self.published if key not in speeds)
+        return changed
+
+    def change_magnitude(self, changed, speeds):
+        """Число изменившихся сегментов, взвешенное относительным сдвигом скорости (не больше 1 на сегмент)."""
+        total = 0.0
+        for key in changed:
+            before, after = self.published.get(key), speeds.get(key)
+            if before is None or after is None:
+                total += 1.0
+            else:
+                total += min(1.0, abs(after - before) / before)
+        return total
+
+    def run_once(self, now=None):
+        """Один цикл: чтение, агрегация, сравнение, публикация; возвращает статистику цикла."""
+        started = time.monotonic()
+        records = 0
+        for batch in batched(fetch(self.source, now), self.batch_size):
+            records += len(batch)
+            self.aggregator.add(batch)
+        speeds = self.aggregator.snapshot(now)
+        changed = self.changed_segments(speeds)
+        result = {
+            'records': records,
+            'segments': len(speeds),
+            'changed': len(changed),
+            'published': False,
+            'rebuild': None
+        }
+        # С планировщиком порог перестройки проверяет он, здесь публикуется любое изменение.
+        if len(changed) >= (1 if self.scheduler is not None else max(1, self.min_changed)):
+            write_speed_file(speeds, self.speed_file)
+            edges = None
+            if self.graph is not None:
+                edges = self._apply_to_graph(changed, speeds)
+                result['graph_edges'] = len(edges)
+            accepted = True
+            if self.scheduler is not None:
+                self.scheduler.record(self.change_magnitude(changed, speeds), speed_file=self.speed_file, edges=edges)
+                result['rebuild'] = 'scheduled'
+            elif self.router is not None:
+                status = self.router.rebuild(speed_file=self.speed_file)
+                accepted = status.get('accepted', True)
+                result['rebuild'] = status['state'] if accepted else 'busy'
+            # Если перестройка уже шла и файл не взяла, изменения останутся изменениями в следующем цикле.
+            if accepted:
+                self.published = speeds
+                result['published'] = True
+        result['seconds'] = round(time.monotonic() - started, 3)
+        self.last_run = result
+        return result
+
+    def _apply_to_graph(self, changed, speeds):
+        """Переносит изменившиеся скорости в локальный граф; исчезнувшие сегменты — к свободному потоку.
+
+        Возвращает номера изменившихся рёбер.
+        """
+        edges = self.graph.find_edges([key[0] for key in changed], [key[1] for key in changed])
+        pairs = [(int(edge), key) for edge, key in zip(edges, changed) if edge >= 0]
+        if not pairs:
+            return edges[:0]
+        values = [speeds[key] if key in speeds else float(self.graph.speeds[edge]) for edge, key in pairs]
+        return self.graph.update_weights([edge for edge, _ in pairs], values, key='edge')
+
+    def start(self):
+        """Запускает циклы в фоновом потоке."""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='traffic-pipeline')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                result = self.run_once()
+                logger.info('Traffic cycle: %s', result)
+            except (OSError, requests.RequestException) as exc:
+                logger.warning('Traffic cycle failed: %s', exc)
+            self._stop.wait(self.interval)
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve_metrics(registry, port, host=''):
+    """Отдаёт ``registry`` в формате Prometheus по ``/metrics`` в фоновом потоке."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _MetricsServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='traffic-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    """Фоновый конвейер трафика: ``python -m routing.traffic ИСТОЧНИК``."""
+    argv = sys.argv[1:] if argv is None else argv
+    source = argv[0] if argv else TRAFFIC_SOURCE
+    if not source:
+        print('usage: python -m routing.traffic SOURCE (file, directory or http URL)')
+        return 2
+    from routing.router import Router
+    from routing.scheduler import RebuildScheduler
+    logging.basicConfig(level=logging.INFO)
+    router = Router()
+    scheduler = RebuildScheduler(router)
+    pipeline = TrafficPipeline(source, router=router, scheduler=scheduler)
+    if TRAFFIC_METRICS_PORT:
+        serve_metrics(router.metrics, TRAFFIC_METRICS_PORT)
+    scheduler.start()
+    pipeline.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pipeline.stop()
+        scheduler.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
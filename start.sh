@@ -1,8 +1,31 @@
 #!/bin/sh
 set -e
 # Запуск OSRM и обёртки Flask
+# OSRM_RELOAD=datastore: данные загружаются в общую память, и Router.rebuild
+# переключает osrm-routed на пересчитанные веса без остановки.
+if [ "${OSRM_RELOAD:-datastore}" = "datastore" ] && osrm-datastore /data/odessa_oblast.osrm; then
+    set -- --shared-memory
+else
+    # Без общей памяти (например, мал /dev/shm) перестройка только пересчитывает копию данных.
+    export OSRM_RELOAD=none
+    set -- /data/odessa_oblast.osrm
+fi
 osrm-routed --algorithm "${OSRM_ALGORITHM:-mld}" \
     --max-table-size "${OSRM_MAX_TABLE_SIZE:-800}" \
     --max-matching-size "${OSRM_MAX_MATCHING_SIZE:-100}" \
-    --port 5001 /data/odessa_oblast.osrm &
-exec python3 /app/app.py
+    --port 5001 "$@" &
+# SERVER_MODE: gunicorn (pre-fork воркеры) или dev (сервер Flask)
+cd /app
+case "${SERVER_MODE:-gunicorn}" in
+    gunicorn)
+        exec python3 -m gunicorn --config /app/gunicorn.conf.py app:app
+        ;;
+    asgi)
+        # В образе Python 3.5 из Debian Stretch, а aiohttp и uvicorn требуют 3.7+.
+        echo "SERVER_MODE=asgi is not supported in this image, run api/asgi.py with Python 3.7+" >&2
+        exit 1
+        ;;
+    *)
+        exec python3 /app/app.py
+        ;;
+esac
@@ -1,10 +1,13 @@
 """Тесты устойчивости и CORS для Flask API."""
 
+import gzip
 import sys
 from unittest.mock import patch, MagicMock
 import importlib
+import json
 import os
 import logging
+import pytest
 import requests
 sys.path.append('.')
 
@@ -13,24 +16,33 @@ import app as app_module
 flask_app = app_module.app
 
 
-def _ok_resp():
+def _json_resp(payload, status=200):
+    """Фейковый ответ requests, пригодный и для разбора, и для потоковой передачи."""
+    body = json.dumps(payload).encode('utf-8')
     resp = MagicMock()
-    resp.json.return_value = {"code": "Ok", "routes": ["ok"]}
+    resp.json.return_value = payload
+    resp.content = body
+    resp.status_code = status
+    resp.headers = {'Content-Type': 'application/json; charset=UTF-8', 'Content-Length': str(len(body))}
+    resp.iter_content.side_effect = lambda chunk_size=1: iter([body[:5], body[5:]])
+    return resp
+
+
+def _ok_resp():
+    resp = _json_resp({"code": "Ok", "routes": ["ok"]})
     resp.raise_for_status.return_value = None
     return resp
 
 
 def _error_resp(status=400):
-    resp = MagicMock()
-    resp.json.return_value = {"code": "InvalidQuery"}
-    resp.status_code = status
+    resp = _json_resp({"code": "InvalidQuery"}, status)
     def raise_err():
         raise requests.HTTPError(response=resp)
     resp.raise_for_status.side_effect = raise_err
     return resp
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_route(mock_get):
     client = flask_app.test_client()
     r = client.get('/route?start=1,1&end=2,2')
@@ -38,7 +50,7 @@ def test_route(mock_get):
     assert r.get_json() == {"code": "Ok", "routes": ["ok"]}
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_route_with_via_param(mock_get):
     client = flask_app.test_client()
     r = client.get('/route?start=1,1&end=4,4&via=2,2&via=3,3&overview=full')
@@ -47,14 +59,27 @@ def test_route_with_via_param(mock_get):
     assert kwargs['params']['overview'] == 'full'
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
+def test_client_timeout_param_is_ignored(mock_get):
+    client = flask_app.test_client()
+    r = client.get('/route?start=1,1&end=9,9&timeout=abc&overview=full')
+    assert r.status_code == 200
+    _, kwargs = mock_get.call_args
+    assert kwargs['timeout'] == app_module.router.timeout
+    assert 'timeout' not in kwargs['params']
+    r = client.get('/nearest?point=9,9&timeout=0.001')
+    assert r.status_code == 200
+    assert mock_get.call_args[1]['timeout'] == app_module.router.timeout
+
+
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_cors_header(mock_get):
     client = flask_app.test_client()
     r = client.get('/route?start=1,1&end=2,2', headers={'Origin': 'http://ex.com'})
     assert r.headers.get('Access-Control-Allow-Origin') == '*'
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_stability(mock_get):
     client = flask_app.test_client()
     for _ in range(10):
@@ -62,35 +87,35 @@ def test_stability(mock_get):
         assert r.status_code == 200
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_table(mock_get):
     client = flask_app.test_client()
     r = client.get('/table?points=1,1;2,2')
     assert r.status_code == 200
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_nearest(mock_get):
     client = flask_app.test_client()
     r = client.get('/nearest?point=1,1')
     assert r.status_code == 200
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_match(mock_get):
     client = flask_app.test_client()
     r = client.get('/match?points=1,1;2,2')
     assert r.status_code == 200
 
 
-@patch('routing.router.requests.get', return_value=_ok_resp())
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
 def test_trip(mock_get):
     client = flask_app.test_client()
     r = client.get('/trip?points=1,1;2,2')
     assert r.status_code == 200
 
 
-@patch('routing.router.requests.get', return_value=_error_resp())
+@patch('routing.router.requests.Session.get', return_value=_error_resp())
 def test_error_forwarding(mock_get):
     client = flask_app.test_client()
     r = client.get('/trip?points=1,1;2,2')
@@ -178,3 +203,287 @@ def test_route_summary_validation():
     assert response.get_json() == {'error': 'points or start/end required'}
 
 
+
+
+@patch('app.router.route', autospec=True)
+def test_route_batch_preserves_order_and_status(mock_route):
+    def fake_route(start, end, via=None, **params):
+        if start == 'bad':
+            resp = MagicMock()
+            resp.status_code = 400
+            resp.json.return_value = {'code': 'InvalidQuery'}
+            raise requests.HTTPError(response=resp)
+        return {'code': 'Ok', 'routes': [start, end, via, params.get('alternatives')]}
+
+    mock_route.side_effect = fake_route
+    client = flask_app.test_client()
+    jobs = [
+        {'start': '1,1', 'end': '2,2'},
+        {'start': 'bad', 'end': '2,2'},
+        {'start': '3,3', 'end': '4,4', 'via': ['5,5'], 'params': {'alternatives': 'true'}},
+        {'end': '4,4'}
+    ]
+    response = client.post('/route/batch', json=jobs)
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [item['index'] for item in results] == [0, 1, 2, 3]
+    assert [item['status'] for item in results] == [200, 400, 200, 400]
+    assert results[0]['result']['routes'] == ['1,1', '2,2', None, None]
+    assert results[1]['error'] == {'code': 'InvalidQuery'}
+    assert results[2]['result']['routes'] == ['3,3', '4,4', ['5,5'], 'true']
+    assert results[3]['error'] == 'start and end required'
+
+
+@patch('app.router.route', autospec=True)
+def test_route_batch_with_summary(mock_route):
+    mock_route.return_value = _summary_route_response()
+    client = flask_app.test_client()
+    response = client.post('/route/batch?summary=true', json=[{'start': '1,1', 'end': '2,2'}])
+    item = response.get_json()['results'][0]
+    assert item['result']['summary']['distance_km'] == 1.0
+    assert mock_route.call_args.kwargs['steps'] == 'true'
+
+
+@patch('app.router.route', autospec=True)
+def test_route_batch_rejects_malformed_jobs_individually(mock_route):
+    mock_route.return_value = {'code': 'Ok', 'routes': []}
+    client = flask_app.test_client()
+    jobs = [
+        {'start': [30.7, 46.4], 'end': '2,2'},
+        {'start': '1,1', 'end': '2,2', 'via': [1]},
+        {'start': '1,1', 'end': '2,2', 'summary': 'false'},
+        {'start': '1,1', 'end': '2,2', 'summary': 1},
+        {'start': '1,1', 'end': '2,2', 'via': {'x': 1}}
+    ]
+    response = client.post('/route/batch', json=jobs)
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [item['status'] for item in results] == [400, 400, 200, 400, 400]
+    assert results[0]['error'] == 'points must be "lon,lat" strings'
+    assert results[2]['result'] == {'code': 'Ok', 'routes': []}
+    assert results[3]['error'] == 'summary must be a boolean'
+    assert mock_route.call_count == 1
+
+
+@patch('app.router.route', autospec=True)
+def test_route_batch_isolates_unexpected_errors(mock_route):
+    mock_route.side_effect = [RuntimeError('boom'), {'code': 'Ok', 'routes': []}]
+    client = flask_app.test_client()
+    jobs = [{'start': '1,1', 'end': '2,2'}, {'start': '3,3', 'end': '4,4'}]
+    with patch.object(app_module, 'batch_executor', app_module.ThreadPoolExecutor(max_workers=1)):
+        response = client.post('/route/batch', json=jobs)
+    results = response.get_json()['results']
+    assert [item['status'] for item in results] == [500, 200]
+
+
+def test_route_batch_validation(monkeypatch):
+    client = flask_app.test_client()
+    assert client.post('/route/batch', json={'start': '1,1'}).status_code == 400
+    monkeypatch.setattr(app_module, 'BATCH_MAX_JOBS', 1)
+    response = client.post('/route/batch', json=[{}, {}])
+    assert response.status_code == 413
+
+
+def test_stats_endpoint():
+    client = flask_app.test_client()
+    response = client.get('/stats')
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['osrm_pool']['pool_size'] == app_module.router.pool_size
+    assert 'hits' in payload['cache']
+    assert 'coalesced' in payload['coalescing']
+    assert 'accept_queue' in payload
+
+
+@patch('routing.router.requests.Session.get', return_value=_ok_resp())
+def test_proxy_passthrough_streams_osrm_bytes(mock_get):
+    client = flask_app.test_client()
+    r = client.get('/nearest?point=1,1&number=3')
+    assert r.status_code == 200
+    assert r.data == mock_get.return_value.content
+    assert mock_get.call_args.kwargs['stream'] is True
+    assert mock_get.call_args.kwargs['params'] == {'number': '3'}
+    mock_get.return_value.close.assert_called()
+
+
+def test_proxy_passthrough_uses_response_cache():
+    app_module.router.cache.clear()
+    with patch('routing.router.requests.Session.get', return_value=_ok_resp()) as mock_get:
+        client = flask_app.test_client()
+        first = client.get('/table?points=5,5;6,6')
+        # Тело попадает в кэш, когда клиент дочитал поток.
+        assert first.is_streamed and first.data == mock_get.return_value.content
+        second = client.get('/table?points=5.0,5;6,6.0')
+        assert second.data == mock_get.return_value.content
+    assert mock_get.call_count == 1
+    app_module.router.cache.clear()
+
+
+def test_proxy_passthrough_streams_in_default_configuration():
+    app_module.router.cache.clear()
+    assert app_module.router.cache.enabled and app_module.router.flights.enabled
+    upstream = _big_table_resp()
+    with patch('routing.router.requests.Session.get', return_value=upstream) as mock_get:
+        client = flask_app.test_client()
+        r = client.get('/table?points=7,7;8,8')
+        assert r.is_streamed
+        assert not upstream.close.called
+        assert r.data == upstream.content
+        upstream.close.assert_called()
+    app_module.router.cache.clear()
+
+
+def test_proxy_passthrough_skips_cache_for_bodies_over_limit(monkeypatch):
+    app_module.router.cache.clear()
+    monkeypatch.setattr(app_module.router, 'passthrough_cache_limit', 16)
+    with patch('routing.router.requests.Session.get', return_value=_big_table_resp()) as mock_get:
+        client = flask_app.test_client()
+        assert client.get('/table?points=9,9;8,8').data == mock_get.return_value.content
+        assert client.get('/table?points=9,9;8,8').data == mock_get.return_value.content
+    assert mock_get.call_count == 2
+    assert app_module.router.cache.stats()['entries'] == 0
+
+
+def test_proxy_passthrough_disabled_parses_response(monkeypatch):
+    monkeypatch.setattr(app_module, 'OSRM_PASSTHROUGH', False)
+    with patch('routing.router.requests.Session.get', return_value=_ok_resp()) as mock_get:
+        client = flask_app.test_client()
+        r = client.get('/trip?points=1,1;2,2')
+    assert r.get_json() == {"code": "Ok", "routes": ["ok"]}
+    assert 'stream' not in mock_get.call_args.kwargs
+
+
+def test_proxy_passthrough_skipped_for_chunked_table(monkeypatch):
+    monkeypatch.setattr(app_module.router, 'max_table_size', 1)
+    with patch.object(app_module.router, 'table', return_value={'code': 'Ok'}) as mock_table:
+        client = flask_app.test_client()
+        r = client.get('/table?points=1,1;2,2')
+    assert r.get_json() == {'code': 'Ok'}
+    mock_table.assert_called_once_with('1,1;2,2')
+
+
+def test_proxy_passthrough_connection_error():
+    with patch('routing.router.requests.Session.get', side_effect=requests.ConnectionError('down')):
+        client = flask_app.test_client()
+        r = client.get('/match?points=1,1;2,2')
+    assert r.status_code == 502
+    assert 'down' in r.get_json()['error']
+
+
+def _big_table_resp():
+    return _json_resp({'code': 'Ok', 'durations': [[float(i)] * 200 for i in range(50)]})
+
+
+def test_compression_gzip_streams_passthrough():
+    with patch('routing.router.requests.Session.get', return_value=_big_table_resp()) as mock_get:
+        client = flask_app.test_client()
+        r = client.get('/table?points=1,1;2,2', headers={'Accept-Encoding': 'gzip'})
+    assert r.status_code == 200
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in r.headers
+    assert 'Accept-Encoding' in r.headers['Vary']
+    assert gzip.decompress(r.data) == mock_get.return_value.content
+    mock_get.return_value.close.assert_called()
+    stats = app_module.compression_stats.stats()['table']
+    assert stats['bytes_in'] >= len(mock_get.return_value.content)
+    assert 0 < stats['ratio'] < 1
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'osrm_api_compression_ratio_count{service="table",encoding="gzip"}' in text
+    assert 'osrm_api_compression_seconds_bucket{service="table",encoding="gzip",le="+Inf"}' in text
+
+
+def test_compression_streams_large_proxied_body_with_cache_enabled(monkeypatch):
+    app_module.router.cache.clear()
+    assert app_module.router.cache.enabled
+    upstream = _big_table_resp()
+    chunks = [upstream.content[i:i + 4096] for i in range(0, len(upstream.content), 4096)]
+    upstream.iter_content.side_effect = lambda chunk_size=1: iter(chunks)
+    monkeypatch.setattr(app_module.router, 'passthrough_cache_limit', len(upstream.content) // 2)
+    with patch('routing.router.requests.Session.get', return_value=upstream):
+        client = flask_app.test_client()
+        r = client.get('/table?points=3,3;4,4', headers={'Accept-Encoding': 'gzip'})
+        assert r.is_streamed
+        assert r.headers['Content-Encoding'] == 'gzip'
+        assert not upstream.close.called
+        assert gzip.decompress(r.data) == upstream.content
+    # Тело больше предела буфера прошло через компрессор потоком и в кэш не попало.
+    assert app_module.router.cache.stats()['entries'] == 0
+
+
+def test_compression_brotli_preferred():
+    brotli = pytest.importorskip('brotli')
+    with patch('routing.router.requests.Session.get', return_value=_big_table_resp()) as mock_get:
+        client = flask_app.test_client()
+        r = client.get('/table?points=1,1;2,2', headers={'Accept-Encoding': 'gzip, br'})
+    assert r.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(r.data) == mock_get.return_value.content
+
+
+def test_compression_skips_small_and_unsupported():
+    with patch('routing.router.requests.Session.get', return_value=_ok_resp()):
+        client = flask_app.test_client()
+        small = client.get('/route?start=1,1&end=2,2', headers={'Accept-Encoding': 'gzip'})
+        plain = client.get('/nearest?point=1,1', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in small.headers
+    assert small.get_json() == {"code": "Ok", "routes": ["ok"]}
+    assert 'Content-Encoding' not in plain.headers
+
+
+def test_compression_disabled(monkeypatch):
+    monkeypatch.setattr(app_module.compression, 'COMPRESSION_ENABLED', False)
+    with patch('routing.router.requests.Session.get', return_value=_big_table_resp()) as mock_get:
+        client = flask_app.test_client()
+        r = client.get('/table?points=1,1;2,2', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in r.headers
+    assert r.data == mock_get.return_value.content
+
+
+def test_metrics_endpoint_reports_services():
+    with patch('routing.router.requests.Session.get', return_value=_ok_resp()):
+        client = flask_app.test_client()
+        client.get('/route?start=9,9&end=8,8')
+    with patch('routing.router.requests.Session.get', return_value=_error_resp()):
+        client.get('/trip?points=9,9;8,8')
+    r = client.get('/metrics')
+    assert r.status_code == 200
+    assert r.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = r.get_data(as_text=True)
+    assert 'osrm_api_requests_total{service="route",status="200"}' in text
+    assert 'osrm_api_errors_total{service="trip",status="400"}' in text
+    assert 'osrm_api_osrm_seconds_count{service="route"}' in text
+    assert 'osrm_api_python_seconds_count{service="route"}' in text
+    assert 'osrm_upstream_request_seconds_count{service="route"}' in text
+    assert 'service="metrics"' not in text
+
+
+@patch('app.router.route', autospec=True)
+def test_route_summary_without_route(mock_route):
+    mock_route.return_value = _summary_route_response()
+    client = flask_app.test_client()
+    response = client.get('/route/summary?start=1,1&end=2,2&include_route=false')
+    assert list(response.get_json()) == ['summary']
+    assert 'include_route' not in mock_route.call_args.kwargs
+
+
+def test_route_summary_stream_ndjson():
+    upstream = _json_resp(_summary_route_response())
+    with patch('routing.router.requests.Session.get', return_value=upstream) as mock_get:
+        client = flask_app.test_client()
+        r = client.get('/route/summary?start=1,1&end=2,2&stream=true')
+    assert r.status_code == 200
+    assert r.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert lines[0]['leg'] == 0
+    assert lines[0]['summary'] == 'Тестовый участок'
+    assert lines[-1]['summary']['legs'][0]['origin'] == 'Старт'
+    assert mock_get.call_args.kwargs['stream'] is True
+    assert 'stream' not in mock_get.call_args.kwargs['params']
+    upstream.close.assert_called()
+
+
+def test_route_summary_stream_forwards_osrm_error():
+    with patch('routing.router.requests.Session.get', return_value=_error_resp()):
+        client = flask_app.test_client()
+        r = client.get('/route/summary?start=1,1&end=2,2&stream=true')
+    assert r.status_code == 400
+    assert r.get_json() == {"code": "InvalidQuery"}
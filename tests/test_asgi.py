@@ -0,0 +1,126 @@
+"""Тесты ASGI-версии API."""
+
+import asyncio
+import json
+import sys
+from unittest.mock import patch
+
+sys.path.append('.')
+sys.path.append('api')
+import asgi as asgi_module
+from routing.async_router import OSRMHTTPError
+
+
+def _call(method, path, query=b'', body=b''):
+    """Выполняет запрос к ASGI-приложению и возвращает (статус, заголовки, тело)."""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_module.app(scope, receive, send))
+    start, body_message = sent
+    return start['status'], dict(start['headers']), body_message['body']
+
+
+def test_route_endpoint_forwards_params():
+    async def fake_route(start, end, via=None, **params):
+        return {'code': 'Ok', 'routes': [start, end, via, params]}
+
+    with patch.object(asgi_module.router, 'route', side_effect=fake_route):
+        status, headers, body = _call('GET', '/route', b'start=1,1&end=2,2&via=3,3&overview=full')
+    assert status == 200
+    assert headers[b'access-control-allow-origin'] == b'*'
+    assert json.loads(body)['routes'] == ['1,1', '2,2', ['3,3'], {'overview': 'full'}]
+
+    with patch.object(asgi_module.router, 'route', side_effect=fake_route):
+        status, _, body = _call('GET', '/route', b'start=1,1&end=2,2&timeout=abc')
+    assert status == 200
+    assert json.loads(body)['routes'][3] == {}
+
+
+def test_proxy_error_forwarding_and_validation():
+    async def failing_trip(points, **params):
+        raise OSRMHTTPError(400, {'code': 'InvalidQuery'})
+
+    with patch.object(asgi_module.router, 'trip', side_effect=failing_trip):
+        status, _, body = _call('GET', '/trip', b'points=1,1;2,2')
+    assert status == 400
+    assert json.loads(body) == {'code': 'InvalidQuery'}
+
+    status, _, body = _call('GET', '/table')
+    assert status == 400
+    assert json.loads(body) == {'error': 'points required'}
+    assert _call('GET', '/missing')[0] == 404
+
+
+def test_route_summary_and_batch():
+    fake_calls = []
+
+    async def fake_route(start, end, via=None, **params):
+        fake_calls.append(params)
+        return {
+            'code': 'Ok',
+            'routes': [{'distance': 1000.0, 'duration': 60.0, 'legs': []}],
+            'waypoints': []
+        }
+
+    with patch.object(asgi_module.router, 'route', side_effect=fake_route):
+        status, _, body = _call('GET', '/route/summary', b'start=1,1&end=2,2')
+        assert status == 200
+        assert json.loads(body)['summary']['distance_km'] == 1.0
+        status, _, body = _call('GET', '/route/summary', b'start=1,1&end=2,2&include_route=false')
+        assert list(json.loads(body)) == ['summary']
+        status, _, body = _call('GET', '/route/summary', b'start=1,1&end=2,2&stream=false')
+        assert status == 200 and 'stream' not in fake_calls[-1]
+        status, _, body = _call('GET', '/route/summary', b'start=1,1&end=2,2&stream=true')
+        assert status == 400 and 'stream' in json.loads(body)['error']
+
+        jobs = json.dumps([{'start': '1,1', 'end': '2,2'}, {'start': '1,1'}]).encode('utf-8')
+        status, _, body = _call('POST', '/route/batch', b'summary=true', jobs)
+    results = json.loads(body)['results']
+    assert status == 200
+    assert [item['status'] for item in results] == [200, 400]
+    assert results[0]['result']['summary']['duration_min'] == 1.0
+
+
+def test_stats_and_metrics_endpoints():
+    async def fake_nearest(point, **params):
+        return {'code': 'Ok', 'waypoints': []}
+
+    with patch.object(asgi_module.router, 'nearest', side_effect=fake_nearest):
+        assert _call('GET', '/nearest', b'point=1,1')[0] == 200
+    status, _, body = _call('GET', '/stats')
+    assert status == 200
+    stats = json.loads(body)
+    assert {'pid', 'osrm_pool', 'cache', 'snap_cache'} <= set(stats)
+
+    status, headers, body = _call('GET', '/metrics')
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/plain')
+    text = body.decode('utf-8')
+    assert 'osrm_api_requests_total{service="nearest",status="200"}' in text
+    assert 'osrm_api_request_seconds_count{service="nearest"}' in text
+    assert '# TYPE osrm_upstream_request_seconds histogram' in text
+
+
+def test_route_batch_rejects_malformed_jobs_individually():
+    async def fake_route(start, end, via=None, **params):
+        return {'code': 'Ok', 'routes': []}
+
+    jobs = json.dumps([
+        {'start': [30.7, 46.4], 'end': '2,2'},
+        {'start': '1,1', 'end': '2,2', 'via': [1]},
+        {'start': '1,1', 'end': '2,2', 'summary': 'false'}
+    ]).encode('utf-8')
+    with patch.object(asgi_module.router, 'route', side_effect=fake_route):
+        status, _, body = _call('POST', '/route/batch', b'', jobs)
+    results = json.loads(body)['results']
+    assert status == 200
+    assert [item['status'] for item in results] == [400, 400, 200]
+    assert results[2]['result'] == {'code': 'Ok', 'routes': []}
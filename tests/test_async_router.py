@@ -0,0 +1,121 @@
+"""Тесты асинхронного клиента OSRM."""
+
+import asyncio
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from routing.async_router import AsyncRouter, OSRMHTTPError
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _fake_fetch(handler):
+    """Подменяет AsyncRouter._fetch функцией handler(url, params) -> (status, payload)."""
+    calls = []
+
+    async def fetch(self, url, params, timeout):
+        calls.append((url, dict(params), timeout))
+        return handler(url, params)
+
+    return fetch, calls
+
+
+def test_route_builds_points_and_caches():
+    router = AsyncRouter("http://example.com/")
+    fetch, calls = _fake_fetch(lambda url, params: (200, {'code': 'Ok', 'routes': [{}]}))
+    with patch.object(AsyncRouter, '_fetch', fetch):
+        first = _run(router.route('1,1', '2,2', via=['1.5,1.5'], steps='true'))
+        second = _run(router.route('1,1', '2,2', via=['1.5,1.5'], steps='true'))
+    assert first is second
+    assert len(calls) == 1
+    url, params, timeout = calls[0]
+    assert url == 'http://example.com/route/v1/driving/1,1;1.5,1.5;2,2'
+    assert params == {'overview': 'false', 'steps': 'true'}
+    assert timeout == router.timeout
+
+
+def test_rebuild_marker_invalidates_cache(tmp_path):
+    (tmp_path / 'map.osrm').write_bytes(b'data')
+    router = AsyncRouter("http://example.com", data_path=str(tmp_path / 'map.osrm'))
+    router.cache._version_check_interval = 0
+    fetch, calls = _fake_fetch(lambda url, params: (200, {'code': 'Ok', 'routes': [{}]}))
+    with patch.object(AsyncRouter, '_fetch', fetch):
+        _run(router.route('1,1', '2,2'))
+        _run(router.route('1,1', '2,2'))
+        assert len(calls) == 1
+        # Перестройку завершил другой процесс: файлы данных те же, обновилась только метка.
+        marker = router.rebuilder.marker_path
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        open(marker, 'w').close()
+        os.utime(marker, (time.time() + 10, time.time() + 10))
+        _run(router.route('1,1', '2,2'))
+    assert len(calls) == 2
+
+
+def test_route_fallback_uses_table_strategy():
+    router = AsyncRouter("http://example.com")
+
+    def handler(url, params):
+        if '/nearest/' in url:
+            lon = url.rsplit('/', 1)[1].split(',')[0]
+            return 200, {'code': 'Ok', 'waypoints': [{'location': [float(lon), 0]}]}
+        if '/table/' in url:
+            return 200, {'code': 'Ok', 'durations': [[12.0]]}
+        if url.endswith('1.000000,0.000000;2.000000,0.000000'):
+            return 200, {'code': 'Ok', 'routes': [{'distance': 3.0}]}
+        return 400, {'code': 'NoRoute', 'routes': []}
+
+    fetch, calls = _fake_fetch(handler)
+    with patch.object(AsyncRouter, '_fetch', fetch):
+        with pytest.raises(OSRMHTTPError) as err:
+            _run(router.route_points('1,1;2,2'))
+        assert err.value.status == 400
+
+    def soft_handler(url, params):
+        status, payload = handler(url, params)
+        return 200, payload
+
+    fetch, calls = _fake_fetch(soft_handler)
+    with patch.object(AsyncRouter, '_fetch', fetch):
+        result = _run(router.route('1,1', '2,2'))
+    assert result['routes'] == [{'distance': 3.0}]
+    assert sum('/table/' in url for url, _, _ in calls) == 1
+
+
+def test_retries_on_unavailable_status():
+    router = AsyncRouter("http://example.com", max_retries=2)
+    statuses = iter([503, 200])
+    fetch, calls = _fake_fetch(lambda url, params: (next(statuses), {'code': 'Ok'}))
+    with patch.object(AsyncRouter, '_fetch', fetch), patch('routing.async_router._RETRY_BACKOFF', 0):
+        assert _run(router.trip('1,1;2,2')) == {'code': 'Ok'}
+    assert len(calls) == 2
+    assert router.pool_stats()['in_flight'] == 0
+    assert router._upstream_seconds.count(('trip',)) == 2
+
+
+def test_table_chunked_and_stitched():
+    router = AsyncRouter("http://example.com", max_table_size=2)
+
+    def handler(url, params):
+        coords = url.split('/table/v1/driving/')[1].split(';')
+        ids = [int(coord.split(',')[0]) for coord in coords]
+        sources = [ids[int(i)] for i in params['sources'].split(';')]
+        destinations = [ids[int(i)] for i in params['destinations'].split(';')]
+        return 200, {
+            'code': 'Ok',
+            'durations': [[10.0 * s + d for d in destinations] for s in sources],
+            'sources': [{} for _ in sources],
+            'destinations': [{} for _ in destinations]
+        }
+
+    fetch, calls = _fake_fetch(handler)
+    points = ';'.join('{0},{0}'.format(i) for i in range(3))
+    with patch.object(AsyncRouter, '_fetch', fetch):
+        result = _run(router.table(points))
+    assert len(calls) == 4
+    assert result['durations'] == [[10.0 * s + d for d in range(3)] for s in range(3)]
@@ -0,0 +1,97 @@
+"""Тесты кэша ответов OSRM."""
+
+from unittest.mock import patch
+
+from routing.cache import ResponseCache, SnapCache, canonical_coordinates, make_key
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_make_key_canonicalizes_coordinates_and_params():
+    first = make_key('route', '30.7,46.48;30.8,46.5', {'steps': 'true', 'overview': 'false'})
+    second = make_key('route', '30.700000,46.480000;30.80,46.5', {'overview': 'false', 'steps': 'true'})
+    assert first == second
+    assert canonical_coordinates('1,2;bad') == '1.000000,2.000000;bad'
+
+
+def test_ttl_expiration_per_service():
+    clock = _Clock()
+    cache = ResponseCache(ttls={'route': 10, 'nearest': 100}, clock=clock)
+    cache.put(make_key('route', '1,1;2,2', {}), {'code': 'Ok'})
+    cache.put(make_key('nearest', '1,1', {}), {'code': 'Ok'})
+    clock.now = 50
+    assert cache.get(make_key('route', '1,1;2,2', {})) is None
+    assert cache.get(make_key('nearest', '1,1', {})) == {'code': 'Ok'}
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['expirations'] == 1
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ResponseCache(max_entries=2, ttls={'route': 60})
+    keys = [make_key('route', '{0},{0};1,1'.format(i), {}) for i in range(3)]
+    cache.put(keys[0], {'code': 'Ok'})
+    cache.put(keys[1], {'code': 'Ok'})
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], {'code': 'Ok'})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.stats()['evictions'] == 1
+
+    small = ResponseCache(max_bytes=40, ttls={'route': 60})
+    small.put(keys[0], {'payload': 'x' * 10})
+    small.put(keys[1], {'payload': 'y' * 10})
+    assert small.stats()['entries'] == 1
+    small.put(keys[2], {'payload': 'z' * 100})
+    assert small.get(keys[2]) is None
+
+
+def test_put_uses_given_size_without_serializing():
+    cache = ResponseCache(max_bytes=100, ttls={'table': 60})
+    with patch('routing.cache._estimate_size', side_effect=AssertionError('serialized')):
+        cache.put(make_key('table', '1,1;2,2', {}), {'code': 'Ok'}, size=60)
+        cache.put(make_key('table', '3,3;4,4', {}), {'code': 'Ok'}, size=60)
+    assert cache.stats()['entries'] == 1
+    cache.put(make_key('table', '5,5;6,6', {}), {'code': 'Ok'}, size=1000)
+    assert cache.get(make_key('table', '5,5;6,6', {})) is None
+
+
+def test_cache_invalidated_when_data_version_changes():
+    clock = _Clock()
+    version = {'value': 1}
+    cache = ResponseCache(
+        ttls={'route': 60}, version_func=lambda: version['value'],
+        version_check_interval=5, clock=clock
+    )
+    key = make_key('route', '1,1;2,2', {})
+    cache.put(key, {'code': 'Ok'})
+    version['value'] = 2
+    clock.now = 1
+    assert cache.get(key) is not None
+    clock.now = 6
+    assert cache.get(key) is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(max_entries=0)
+    key = make_key('route', '1,1;2,2', {})
+    cache.put(key, {'code': 'Ok'})
+    assert cache.get(key) is None
+
+
+def test_snap_cache_shares_cell_between_nearby_points():
+    cache = SnapCache(precision=3)
+    cache.put('30.72311,46.48231', 5, ['30.723300,46.482500'])
+    assert cache.get('30.72349,46.48239', 5) == ('30.723300,46.482500',)
+    assert cache.get('30.72449,46.48249', 5) is None
+    assert cache.get('30.72311,46.48231', 3) is None
+    assert cache.get('garbage', 5) is None
+    assert cache.stats()['precision'] == 3
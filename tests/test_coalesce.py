@@ -0,0 +1,61 @@
+"""Тесты объединения одновременных запросов."""
+
+import sys
+import threading
+
+import pytest
+
+sys.path.append('.')
+
+from routing.coalesce import SingleFlight
+
+
+def _run_concurrently(flights, key, func, count):
+    results = []
+    errors = []
+
+    def worker():
+        try:
+            results.append(flights.do(key, func))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return {'code': 'Ok'}
+
+    threads, results, errors = _run_concurrently(flights, 'k', func, 5)
+    while flights.stats()['leaders'] + flights.stats()['coalesced'] < 5:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == [{'code': 'Ok'}] * 5
+    assert flights.stats() == {'enabled': True, 'in_flight': 0, 'leaders': 1, 'coalesced': 4}
+
+
+def test_error_shared_and_key_released():
+    flights = SingleFlight()
+    with pytest.raises(RuntimeError):
+        flights.do('k', lambda: (_ for _ in ()).throw(RuntimeError('boom')))
+    assert flights.do('k', lambda: 42) == 42
+    assert flights.stats()['leaders'] == 2
+
+
+def test_disabled_calls_directly():
+    flights = SingleFlight(enabled=False)
+    assert flights.do('k', lambda: 1) == 1
+    assert flights.stats()['leaders'] == 0
@@ -0,0 +1,81 @@
+"""Тесты потокового сжатия ответов API."""
+
+import gzip
+import sys
+
+import pytest
+
+sys.path.append('api')
+import compression
+
+
+def test_negotiate_respects_weights_and_order():
+    assert compression.negotiate('gzip, br', ('br', 'gzip')) == 'br'
+    assert compression.negotiate('gzip;q=1, br;q=0.5', ('br', 'gzip')) == 'gzip'
+    assert compression.negotiate('br;q=0, *', ('br', 'gzip')) == 'gzip'
+    assert compression.negotiate('identity', ('br', 'gzip')) is None
+    assert compression.negotiate('', ('gzip',)) is None
+    assert compression.negotiate('br', ('gzip',)) is None
+
+
+def test_is_compressible():
+    assert compression.is_compressible('application/json')
+    assert compression.is_compressible('text/html')
+    assert not compression.is_compressible('image/png')
+    assert not compression.is_compressible(None)
+
+
+def test_compress_stream_splits_chunks_and_reports():
+    body = b'{"durations": [' + b'1.5, ' * 20000 + b'0]}'
+    done = []
+
+    class Source:
+        closed = False
+
+        def __iter__(self):
+            return iter([body[:10], body[10:]])
+
+        def close(self):
+            self.closed = True
+
+    source = Source()
+    parts = list(compression.compress_stream(
+        source, 'gzip', lambda *args: done.append(args), chunk_size=1024
+    ))
+    assert gzip.decompress(b''.join(parts)) == body
+    assert source.closed
+    bytes_in, bytes_out, seconds = done[0]
+    assert bytes_in == len(body)
+    assert bytes_out == sum(len(part) for part in parts)
+    assert seconds >= 0
+
+
+def test_compress_stream_closes_source_on_abort():
+    closed = []
+
+    def source():
+        try:
+            yield b'a' * 100000
+            yield b'b' * 100000
+        finally:
+            closed.append(True)
+
+    stream = compression.compress_stream(source(), 'gzip', chunk_size=1024)
+    next(stream)
+    stream.close()
+    assert closed == [True]
+
+
+def test_make_encoder_rejects_unknown():
+    with pytest.raises(ValueError):
+        compression.make_encoder('zstd')
+
+
+def test_compression_stats_ratio():
+    stats = compression.CompressionStats()
+    stats.record('table', 'gzip', 1000, 250, 0.01)
+    stats.record('table', 'br', 1000, 150, 0.02)
+    item = stats.stats()['table']
+    assert item['responses'] == 2
+    assert item['ratio'] == 0.2
+    assert item['encodings'] == {'gzip': 1, 'br': 1}
@@ -0,0 +1,124 @@
+"""Тесты для модуля routing.engine."""
+
+import heapq
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append('.')
+
+from routing.engine import ContractionHierarchy, ShortestPathEngine
+from routing.graph import Graph
+
+
+def _grid_graph(size=12, seed=3):
+    """Решётка со случайно удалёнными односторонними рёбрами и разными скоростями."""
+    rng = np.random.RandomState(seed)
+    ids = np.arange(size * size)
+    lon = 30.0 + (ids % size) * 0.002
+    lat = 46.0 + (ids // size) * 0.002
+    sources, targets = [], []
+    for node in ids:
+        x, y = node % size, node // size
+        if x + 1 < size:
+            sources += [node, node + 1]
+            targets += [node + 1, node]
+        if y + 1 < size:
+            sources += [node, node + size]
+            targets += [node + size, node]
+    keep = rng.rand(len(sources)) > 0.1
+    sources = np.asarray(sources)[keep]
+    targets = np.asarray(targets)[keep]
+    speeds = rng.choice([25, 40, 65], len(sources))
+    return Graph.from_edges(ids + 1000, lon, lat, sources, targets, speeds, np.arange(len(sources)))
+
+
+def _reference(graph, source, target):
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if node == target:
+            return cost
+        if cost > dist[node]:
+            continue
+        for edge in range(graph.indptr[node], graph.indptr[node + 1]):
+            neighbour = int(graph.targets[edge])
+            candidate = cost + float(graph.weights[edge])
+            if candidate < dist.get(neighbour, float('inf')):
+                dist[neighbour] = candidate
+                heapq.heappush(heap, (candidate, neighbour))
+    return None
+
+
+@pytest.mark.parametrize('algorithm', ['dijkstra', 'astar', 'ch'])
+def test_algorithms_match_reference(algorithm):
+    graph = _grid_graph()
+    engine = ShortestPathEngine(graph)
+    engine.prepare_ch()
+    rng = random.Random(5)
+    for _ in range(60):
+        source, target = rng.randrange(graph.node_count), rng.randrange(graph.node_count)
+        expected = _reference(graph, source, target)
+        found = engine.shortest_path(source, target, algorithm)
+        if expected is None:
+            assert found is None
+            continue
+        cost, edges = found
+        assert cost == pytest.approx(expected, rel=1e-5)
+        node = source
+        for edge in edges:
+            assert graph.sources[edge] == node
+            node = int(graph.targets[edge])
+        assert node == target
+
+
+def test_route_between_coordinates():
+    graph = Graph.from_edges(
+        [1000, 1001, 1002, 1003], [30.0, 30.002, 30.004, 30.002], [46.0, 46.0, 46.0, 46.002],
+        [0, 1, 1, 2], [1, 2, 0, 1], [36, 36, 36, 36], [1, 1, 1, 1], lengths=[100, 200, 100, 200]
+    )
+    result = ShortestPathEngine(graph).route('30.0001,46.0', (30.004, 46.0))
+    assert result['nodes'] == [1000, 1001, 1002]
+    assert result['distance'] == pytest.approx(300)
+    assert result['duration'] == pytest.approx(30)
+    assert result['algorithm'] == 'dijkstra'
+    assert result['waypoints'][0]['location'] == [30.0, 46.0]
+    assert ShortestPathEngine(graph).route('30.004,46.0', '30.002,46.002') is None
+
+
+def test_ch_cached_on_disk_and_invalidated_by_weights(tmp_path):
+    graph = _grid_graph()
+    graph.save(str(tmp_path / 'grid.graph'))
+    graph = Graph().load(str(tmp_path / 'grid.graph'))
+    engine = ShortestPathEngine(graph)
+    ch = engine.prepare_ch()
+    assert (tmp_path / 'grid.graph' / 'ch.npz').exists()
+    assert ch.shortcut_count > 0
+    loaded = ContractionHierarchy.load(str(tmp_path / 'grid.graph' / 'ch.npz'))
+    assert loaded.digest == ch.digest
+    np.testing.assert_array_equal(loaded.up_edges, ch.up_edges)
+
+    source, target = 0, graph.node_count - 1
+    before = engine.shortest_path(source, target, 'ch')
+    # «Что если»: пробка на всех рёбрах первого пути — CH устаревает, маршрут ищется заново.
+    graph.update_weights(before[1], [1.0] * len(before[1]), key='edge')
+    assert not engine.ch_ready
+    with pytest.raises(ValueError):
+        engine.shortest_path(source, target, 'ch')
+    after = engine.shortest_path(source, target, 'dijkstra')
+    assert after[0] == pytest.approx(_reference(graph, source, target), rel=1e-5)
+    assert after[1] != before[1]
+    point = '{},{}'.format(graph.lon[source], graph.lat[source]), '{},{}'.format(graph.lon[target], graph.lat[target])
+    assert engine.route(*point, algorithm='ch')['algorithm'] == 'dijkstra'
+    rebuilt = engine.prepare_ch()
+    assert rebuilt.digest != ch.digest
+    assert engine.route(*point)['algorithm'] == 'ch'
+    assert engine.route(*point)['duration'] == pytest.approx(after[0], rel=1e-5)
+
+
+def test_unknown_algorithm_rejected():
+    with pytest.raises(ValueError):
+        ShortestPathEngine(_grid_graph(size=2)).shortest_path(0, 1, 'bellman-ford')
@@ -0,0 +1,231 @@
+"""Тесты графа дорожной сети."""
+
+import struct
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.append('.')
+
+from routing import graph as graph_module
+from routing.graph import Graph
+
+NODES = {
+    1: (30.700, 46.400),
+    2: (30.701, 46.400),
+    3: (30.702, 46.401),
+    4: (30.703, 46.401),
+    5: (30.704, 46.402)
+}
+WAYS = [
+    (10, [1, 2, 3], {'highway': 'residential', 'name': 'Дерибасовская'}),
+    (11, [3, 4], {'highway': 'primary', 'oneway': 'yes', 'maxspeed': '50'}),
+    (12, [4, 5], {'highway': 'footway'}),
+    (13, [4, 99], {'highway': 'service'}),
+    (14, [5, 4], {'highway': 'tertiary', 'oneway': '-1'})
+]
+
+
+def _osm_xml(path):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+    for node_id, (lon, lat) in NODES.items():
+        lines.append('<node id="{}" lon="{}" lat="{}"/>'.format(node_id, lon, lat))
+    for way_id, refs, tags in WAYS:
+        lines.append('<way id="{}">'.format(way_id))
+        lines.extend('<nd ref="{}"/>'.format(ref) for ref in refs)
+        lines.extend('<tag k="{}" v="{}"/>'.format(k, v) for k, v in tags.items())
+        lines.append('</way>')
+    lines.append('</osm>')
+    path.write_text('\n'.join(lines), encoding='utf-8')
+    return str(path)
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zz(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, payload):
+    if isinstance(payload, int):
+        return _varint(number << 3) + _varint(payload)
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _packed(values):
+    return b''.join(_varint(value) for value in values)
+
+
+def _deltas(values):
+    previous = 0
+    result = []
+    for value in values:
+        result.append(_zz(value - previous))
+        previous = value
+    return result
+
+
+def _blob(blob_type, payload):
+    blob = _field(2, len(payload)) + _field(3, zlib.compress(payload))
+    header = _field(1, blob_type.encode('utf-8')) + _field(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def _osm_pbf(path):
+    strings = ['']
+    def index(text):
+        if text not in strings:
+            strings.append(text)
+        return strings.index(text)
+
+    ids = sorted(NODES)
+    dense = (_field(1, _packed(_deltas(ids)))
+             + _field(8, _packed(_deltas([int(round(NODES[i][1] * 1e7)) for i in ids])))
+             + _field(9, _packed(_deltas([int(round(NODES[i][0] * 1e7)) for i in ids]))))
+    ways = b''
+    for way_id, refs, tags in WAYS:
+        keys = [index(k) for k in tags]
+        vals = [index(v) for v in tags.values()]
+        ways += _field(3, _field(1, way_id) + _field(2, _packed(keys)) + _field(3, _packed(vals))
+                       + _field(8, _packed(_deltas(refs))))
+    table = b''.join(_field(1, text.encode('utf-8')) for text in strings)
+    block = _field(1, table) + _field(2, _field(2, dense)) + _field(2, ways)
+    header = _field(4, b'OsmSchema-V0.6') + _field(4, b'DenseNodes')
+    path.write_bytes(_blob('OSMHeader', header) + _blob('OSMData', block))
+    return str(path)
+
+
+def _edges(graph):
+    ids = graph.node_ids
+    return sorted((int(ids[s]), int(ids[t]), int(w)) for s, t, w in zip(graph.sources, graph.targets, graph.way_ids))
+
+
+EXPECTED_EDGES = [(1, 2, 10), (2, 1, 10), (2, 3, 10), (3, 2, 10), (3, 4, 11), (4, 5, 14)]
+
+
+def test_from_osm_xml_builds_csr(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    assert list(graph.node_ids) == [1, 2, 3, 4, 5]
+    assert _edges(graph) == EXPECTED_EDGES
+    assert list(graph.indptr) == [0, 1, 3, 5, 6, 6]
+    for node in range(graph.node_count):
+        assert all(graph.sources[graph.edges_from(node)] == node)
+    edge = int(np.flatnonzero(graph.way_ids == 11)[0])
+    assert graph.speeds[edge] == 50
+    assert graph.lengths[edge] == pytest.approx(76.7, abs=0.5)
+    assert graph.weights[edge] == pytest.approx(graph.lengths[edge] / (50 / 3.6), rel=1e-5)
+
+
+def test_from_osm_pbf_matches_xml(tmp_path):
+    xml_graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    pbf_graph = Graph.from_osm(_osm_pbf(tmp_path / 'map.osm.pbf'))
+    assert _edges(pbf_graph) == EXPECTED_EDGES
+    np.testing.assert_allclose(pbf_graph.lon, xml_graph.lon)
+    np.testing.assert_allclose(pbf_graph.lat, xml_graph.lat)
+    np.testing.assert_allclose(pbf_graph.weights, xml_graph.weights, rtol=1e-5)
+
+
+def test_save_and_memory_mapped_load(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    graph.save(str(tmp_path / 'map.graph'))
+    loaded = Graph().load(str(tmp_path / 'map.graph'))
+    assert isinstance(loaded.targets, np.memmap)
+    assert not isinstance(loaded.weights, np.memmap)
+    assert loaded.weights.flags.writeable
+    assert _edges(loaded) == EXPECTED_EDGES
+    assert loaded.stats()['edges'] == 6
+
+
+def test_load_osrm_path_builds_and_caches(tmp_path):
+    _osm_pbf(tmp_path / 'region.osm.pbf')
+    graph = Graph().load(str(tmp_path / 'region.osrm'))
+    assert graph.edge_count == 6
+    assert (tmp_path / 'region.graph' / 'meta.json').exists()
+    cached = Graph().load(str(tmp_path / 'region.osrm'))
+    assert isinstance(cached.lon, np.memmap)
+
+
+def test_way_profile_rules():
+    assert graph_module.way_profile({'highway': 'footway'}) is None
+    assert graph_module.way_profile({'highway': 'service', 'access': 'private'}) is None
+    assert graph_module.way_profile({'highway': 'motorway'}) == (90, 1)
+    assert graph_module.way_profile({'highway': 'primary', 'junction': 'roundabout'}) == (65, 1)
+    assert graph_module.way_profile({'highway': 'residential', 'maxspeed': '20 mph'})[0] == pytest.approx(32.19, 0.01)
+    assert Graph().stats() == {'loaded': False}
+
+
+def test_nearest_nodes_batch(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    indices, distances = graph.nearest([30.7001, 30.7039, 35.0], [46.4, 46.4019, 46.4], k=2)
+    assert graph.node_ids[indices[0]].tolist() == [1, 2]
+    assert graph.node_ids[indices[1]].tolist() == [5, 4]
+    assert graph.node_ids[indices[2, 0]] == 5
+    assert distances[0, 0] == pytest.approx(7.7, abs=0.1)
+    assert (np.diff(distances, axis=1) >= 0).all()
+    assert graph.stats()['index'] is True
+
+
+def test_update_weights_by_way_speed(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    free = graph.weights.copy()
+    way_10 = np.flatnonzero(graph.way_ids == 10)
+    changed = graph.update_weights({10: 12.5, 11: 80, 999: 5})
+    # Скорость линии 11 выше свободного потока и обрезается до него — вес не меняется.
+    assert changed.tolist() == way_10.tolist()
+    np.testing.assert_allclose(graph.weights[way_10], free[way_10] * 2, rtol=1e-5)
+    assert graph.update_weights({10: 12.5}).tolist() == []
+    assert graph.reset_weights().tolist() == way_10.tolist()
+    np.testing.assert_array_equal(graph.weights, free)
+
+
+def test_update_weights_two_way_duration_per_direction(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    way_10 = np.flatnonzero(graph.way_ids == 10)
+    free = graph.weights.copy()
+    # Линия 10 двусторонняя: время проезда — на одно направление, а не на сумму рёбер обоих.
+    one_way_free = float(free[way_10].sum()) / 2
+    changed = graph.update_weights({10: one_way_free * 2}, kind='duration')
+    assert changed.tolist() == way_10.tolist()
+    np.testing.assert_allclose(graph.weights[way_10], free[way_10] * 2, rtol=1e-5)
+    forward = [edge for edge in way_10 if graph.node_ids[graph.sources[edge]] < graph.node_ids[graph.targets[edge]]]
+    assert float(graph.weights[forward].sum()) == pytest.approx(one_way_free * 2, rel=1e-5)
+
+
+def test_update_weights_durations_edges_and_blend(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    edge = int(np.flatnonzero(graph.way_ids == 11)[0])
+    length = float(graph.lengths[edge])
+    graph.update_weights({11: length / (25 / 3.6)}, kind='duration')
+    assert graph.weights[edge] == pytest.approx(length / (25 / 3.6), rel=1e-5)
+    # Повторные наблюдения усредняются: (10 + 30) / 2 = 20 км/ч, затем смешиваются 50/50 с 50 км/ч.
+    graph.update_weights([[edge, 10], [edge, 30], [-1, 5], [edge + 100, 5]], key='edge', blend=0.5)
+    assert graph.weights[edge] == pytest.approx(length / (35 / 3.6), rel=1e-5)
+    graph.update_weights([edge], [0.1], key='edge')
+    assert graph.weights[edge] == pytest.approx(length / (50 * graph_module.TRAFFIC_MIN_FACTOR / 3.6), rel=1e-5)
+    with pytest.raises(ValueError):
+        graph.update_weights({}, key='node')
+
+
+def test_find_edges_by_osm_node_pairs(tmp_path):
+    graph = Graph.from_osm(_osm_xml(tmp_path / 'map.osm'))
+    assert graph.node_index([3, 99, 1]).tolist() == [2, -1, 0]
+    edges = graph.find_edges([1, 3, 4, 4, 99], [2, 4, 3, 5, 1])
+    ids = graph.node_ids
+    found = [(int(ids[graph.sources[edge]]), int(ids[graph.targets[edge]])) for edge in edges[:2]]
+    assert found == [(1, 2), (3, 4)]
+    # 4 -> 3 нет: линия 11 односторонняя.
+    assert edges[2] == -1 and edges[4] == -1
+    assert graph.way_ids[edges[3]] == 14
+    assert Graph().find_edges([1], [2]).tolist() == [-1]
@@ -0,0 +1,31 @@
+"""Тесты обёртки над JSON-бэкендами."""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from routing import jsonlib
+
+
+def test_roundtrip_with_available_backend():
+    payload = {'code': 'Ok', 'durations': [[0.0, 1.5], [None, 0.0]], 'name': 'Дерибасовская'}
+    assert jsonlib.loads(jsonlib.dumps(payload)) == payload
+    assert jsonlib.loads(jsonlib.dumps(payload).decode('utf-8')) == payload
+
+
+def test_stdlib_fallback_without_orjson():
+    resp = MagicMock()
+    resp.json.return_value = {'code': 'Ok'}
+    with patch.object(jsonlib, 'orjson', None):
+        assert jsonlib.dumps({'a': [1, 2]}) == b'{"a":[1,2]}'
+        assert jsonlib.loads(b'{"a": 1}') == {'a': 1}
+        assert jsonlib.response_json(resp) == {'code': 'Ok'}
+
+
+def test_response_json_invalid_body_raises_value_error():
+    if not jsonlib.FAST:
+        pytest.skip('orjson is not installed')
+    resp = MagicMock()
+    resp.content = b'not json'
+    with pytest.raises(ValueError):
+        jsonlib.response_json(resp)
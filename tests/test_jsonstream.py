@@ -0,0 +1,67 @@
+"""Тесты потокового чтения JSON."""
+
+import json
+import sys
+
+import pytest
+
+sys.path.append('.')
+
+from routing.jsonstream import JSONStreamReader
+
+DOCUMENT = {
+    'code': 'Ok',
+    'routes': [{
+        'geometry': {'type': 'LineString', 'coordinates': [[30.5, 46.25]] * 50},
+        'legs': [{'summary': 'кав"ычки \\ и юникод', 'steps': [1, {}, [], None, True, -1.5e3]}] * 3,
+        'distance': 12.5
+    }],
+    'waypoints': [{'name': 'Дом', 'location': [30.5, 46.25]}],
+    'empty_object': {},
+    'empty_array': []
+}
+
+
+def _chunks(size):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=1).encode('utf-8')
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _walk(reader):
+    char = reader.peek()
+    if char == '{':
+        return {key: _walk(reader) for key in reader.iter_object()}
+    if char == '[':
+        return [_walk(reader) for _ in reader.iter_array()]
+    return reader.read_value()
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_walk_rebuilds_document_for_any_chunking(size):
+    reader = JSONStreamReader(_chunks(size))
+    assert _walk(reader) == DOCUMENT
+    assert reader.peek() is None
+
+
+@pytest.mark.parametrize('size', [1, 5, 100000])
+def test_skip_value_discards_unneeded_fields(size):
+    reader = JSONStreamReader(_chunks(size))
+    legs = []
+    for key in reader.iter_object():
+        if key != 'routes':
+            reader.skip_value()
+            continue
+        for _ in reader.iter_array():
+            for route_key in reader.iter_object():
+                if route_key == 'legs':
+                    legs = [reader.read_value() for _ in reader.iter_array()]
+                else:
+                    reader.skip_value()
+    assert legs == DOCUMENT['routes'][0]['legs']
+
+
+def test_truncated_stream_raises():
+    text = json.dumps(DOCUMENT).encode('utf-8')
+    reader = JSONStreamReader([text[:len(text) // 2]])
+    with pytest.raises(ValueError):
+        _walk(reader)
@@ -0,0 +1,93 @@
+"""Тесты склейки map matching по окнам."""
+
+from routing.matching import MatchMerger, match_windows, window_params
+
+
+def _window_response(start, end, confidence=0.9, unmatched=()):
+    """Ответ /match, где все точки окна, кроме unmatched, в одном матчинге."""
+    tracepoints = []
+    waypoint = 0
+    for index in range(start, end):
+        if index in unmatched:
+            tracepoints.append(None)
+            continue
+        tracepoints.append({'matchings_index': 0, 'waypoint_index': waypoint, 'location': [index, 0]})
+        waypoint += 1
+    legs = [{'distance': 1.0, 'duration': 2.0, 'weight': 2.0} for _ in range(waypoint - 1)]
+    return {
+        'code': 'Ok',
+        'matchings': [{'confidence': confidence, 'legs': legs}],
+        'tracepoints': tracepoints
+    }
+
+
+def test_match_windows_cover_every_point_once():
+    windows = match_windows(10, 4, 2)
+    assert windows[0][:2] == (0, 4)
+    assert windows[-1][1] == 10
+    owned = []
+    for start, end, own_start, own_end in windows:
+        assert end - start <= 4
+        assert start <= own_start < own_end <= end
+        owned.extend(range(own_start, own_end))
+    assert owned == list(range(10))
+    assert match_windows(3, 4, 2) == [(0, 3, 0, 3)]
+
+
+def test_match_windows_never_leave_single_point_tail():
+    # Без перекрытия хвост из одной точки берёт последнюю точку предыдущего окна.
+    assert match_windows(5, 4, 0) == [(0, 4, 0, 4), (3, 5, 4, 5)]
+    for count in range(5, 30):
+        windows = match_windows(count, 4, 0)
+        owned = []
+        for start, end, own_start, own_end in windows:
+            assert 2 <= end - start <= 4
+            owned.extend(range(own_start, own_end))
+        assert owned == list(range(count))
+
+
+def test_window_params_slice_per_point_values():
+    params = {'timestamps': '1;2;3;4;5', 'gaps': 'split'}
+    assert window_params(params, 1, 3) == {'timestamps': '2;3', 'gaps': 'split'}
+
+
+def test_merger_joins_windows_into_single_matching():
+    windows = match_windows(10, 4, 2)
+    merger = MatchMerger(10)
+    confidences = [0.9, 0.5, 0.8, 0.7]
+    for window, confidence in zip(windows, confidences):
+        merger.add(window, _window_response(window[0], window[1], confidence))
+    result = merger.result()
+    assert result['code'] == 'Ok'
+    assert len(result['matchings']) == 1
+    matching = result['matchings'][0]
+    assert len(matching['legs']) == 9
+    assert matching['distance'] == 9.0
+    assert matching['confidence'] == 0.5
+    assert [tp['waypoint_index'] for tp in result['tracepoints']] == list(range(10))
+    assert [tp['location'][0] for tp in result['tracepoints']] == list(range(10))
+    assert [chunk['confidence'] for chunk in result['chunks']] == [[c] for c in confidences]
+
+
+def test_merger_splits_on_failed_window():
+    windows = match_windows(10, 4, 2)
+    merger = MatchMerger(10)
+    for index, window in enumerate(windows):
+        if index == 1:
+            merger.add(window, {'code': 'NoMatch', 'message': 'no'})
+        else:
+            merger.add(window, _window_response(window[0], window[1]))
+    result = merger.result()
+    assert len(result['matchings']) == 2
+    assert result['tracepoints'][3] is None
+    assert result['tracepoints'][5]['matchings_index'] == 1
+    assert result['tracepoints'][5]['waypoint_index'] == 0
+    assert [chunk['code'] for chunk in result['chunks']] == ['Ok', 'NoMatch', 'Ok', 'Ok']
+
+
+def test_merger_returns_error_when_nothing_matched():
+    merger = MatchMerger(4)
+    merger.add((0, 4, 0, 4), {'code': 'NoMatch', 'message': 'no'})
+    result = merger.result()
+    assert result['code'] == 'NoMatch'
+    assert result['chunks'][0]['code'] == 'NoMatch'
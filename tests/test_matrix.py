@@ -0,0 +1,92 @@
+"""Тесты для модуля routing.matrix."""
+
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append('.')
+
+from routing.engine import ShortestPathEngine
+from routing.graph import Graph
+from routing.matrix import MatrixEngine
+
+
+def _grid_graph(size=10, seed=11):
+    rng = np.random.RandomState(seed)
+    ids = np.arange(size * size)
+    sources, targets = [], []
+    for node in ids:
+        x, y = node % size, node // size
+        if x + 1 < size:
+            sources += [node, node + 1]
+            targets += [node + 1, node]
+        if y + 1 < size:
+            sources += [node, node + size]
+            targets += [node + size, node]
+    keep = rng.rand(len(sources)) > 0.1
+    sources = np.asarray(sources)[keep]
+    targets = np.asarray(targets)[keep]
+    return Graph.from_edges(
+        ids, 30.0 + (ids % size) * 0.002, 46.0 + (ids // size) * 0.002, sources, targets,
+        rng.choice([25, 40, 65], len(sources)), np.arange(len(sources))
+    )
+
+
+def _expected(engine, sources, targets):
+    graph = engine.graph
+    durations = np.full((len(sources), len(targets)), np.inf)
+    distances = np.full((len(sources), len(targets)), np.inf)
+    for row, source in enumerate(sources):
+        for column, target in enumerate(targets):
+            found = engine.shortest_path(int(source), int(target), 'dijkstra')
+            if found is not None:
+                durations[row, column] = found[0]
+                distances[row, column] = graph.lengths[found[1]].sum(dtype=np.float64)
+    return durations, distances
+
+
+@pytest.mark.parametrize('hierarchy', [False, True])
+def test_matrix_matches_point_to_point(hierarchy):
+    engine = ShortestPathEngine(_grid_graph())
+    if hierarchy:
+        engine.prepare_ch()
+    rng = np.random.RandomState(2)
+    sources = rng.randint(0, engine.graph.node_count, 12)
+    targets = rng.randint(0, engine.graph.node_count, 9)
+    durations, distances = MatrixEngine(engine, workers=1).table_nodes(sources, targets)
+    expected_durations, expected_distances = _expected(engine, sources, targets)
+    assert durations.shape == (12, 9)
+    np.testing.assert_allclose(durations, expected_durations, rtol=1e-5)
+    # При равных по времени путях длины могут различаться, поэтому сравниваются конечные значения.
+    assert (np.isfinite(distances) == np.isfinite(expected_distances)).all()
+
+
+def test_process_pool_rows_match_in_process_and_follow_weights():
+    engine = ShortestPathEngine(_grid_graph())
+    nodes = np.arange(0, engine.graph.node_count, 7)
+    matrix = MatrixEngine(engine, workers=2, parallel_min_cells=0)
+    try:
+        serial = MatrixEngine(engine, workers=1).table_nodes(nodes, nodes)
+        parallel = matrix.table_nodes(nodes, nodes)
+        np.testing.assert_allclose(parallel[0], serial[0])
+        np.testing.assert_allclose(parallel[1], serial[1])
+        assert np.diag(parallel[0]).tolist() == [0.0] * len(nodes)
+        # После изменения весов пул пересоздаётся с новыми массивами.
+        engine.graph.update_weights(np.arange(engine.graph.edge_count), np.full(engine.graph.edge_count, 5.0),
+                                    key='edge')
+        slowed = matrix.table_nodes(nodes, nodes)
+        finite = np.isfinite(serial[0]) & (serial[0] > 0)
+        assert (slowed[0][finite] > serial[0][finite]).all()
+    finally:
+        matrix.close()
+
+
+def test_table_between_coordinates():
+    engine = ShortestPathEngine(_grid_graph(size=4))
+    points = ['30.0,46.0', (30.006, 46.006)]
+    durations, distances = MatrixEngine(engine, workers=1).table(points)
+    assert durations.shape == distances.shape == (2, 2)
+    assert durations[0, 0] == durations[1, 1] == 0
+    durations, _ = MatrixEngine(engine, workers=1).table(points, ['30.002,46.0'])
+    assert durations.shape == (2, 1)
@@ -0,0 +1,70 @@
+"""Тесты метрик в формате Prometheus."""
+
+import sys
+import threading
+import time
+
+sys.path.append('.')
+
+from routing import metrics
+
+
+def test_counter_and_histogram_render():
+    registry = metrics.Registry()
+    counter = registry.counter('api_requests_total', 'Запросы', ('service', 'status'))
+    histogram = registry.histogram('api_seconds', 'Время', ('service',), buckets=(0.1, 1.0))
+    counter.inc(('route', '200'))
+    counter.inc(('route', '200'))
+    histogram.observe(0.05, ('route',))
+    histogram.observe(0.5, ('route',))
+    histogram.observe(3.0, ('route',))
+    text = registry.render()
+    assert '# TYPE api_requests_total counter' in text
+    assert 'api_requests_total{service="route",status="200"} 2' in text
+    assert '# TYPE api_seconds histogram' in text
+    assert 'api_seconds_bucket{service="route",le="0.1"} 1' in text
+    assert 'api_seconds_bucket{service="route",le="1"} 2' in text
+    assert 'api_seconds_bucket{service="route",le="+Inf"} 3' in text
+    assert 'api_seconds_sum{service="route"} 3.55' in text
+    assert 'api_seconds_count{service="route"} 3' in text
+    assert histogram.count(('route',)) == 3
+
+
+def test_gauge_keeps_last_value():
+    registry = metrics.Registry()
+    gauge = registry.gauge('queue_depth', 'Очередь')
+    gauge.set(5)
+    gauge.set(2.5)
+    text = registry.render()
+    assert '# TYPE queue_depth gauge' in text
+    assert 'queue_depth 2.5' in text
+    assert gauge.value() == 2.5
+
+
+def test_label_values_escaped():
+    registry = metrics.Registry()
+    registry.counter('c', 'doc', ('path',)).inc(('a"b\\c',))
+    assert 'c{path="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_osrm_time_counts_outer_section_once():
+    metrics.start_request()
+    with metrics.osrm_time():
+        with metrics.osrm_time():
+            time.sleep(0.01)
+    elapsed = metrics.finish_request()
+    assert 0.01 <= elapsed < 0.5
+
+
+def test_osrm_time_inactive_outside_request():
+    results = []
+
+    def worker():
+        with metrics.osrm_time():
+            pass
+        results.append(metrics.finish_request())
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert results == [0.0]
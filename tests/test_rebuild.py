@@ -0,0 +1,117 @@
+"""Тесты для модуля routing.rebuild."""
+
+import fcntl
+import subprocess
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.append('.')
+
+from routing.rebuild import Rebuilder
+
+
+def _data(tmp_path):
+    for suffix in ('', '.cell_metrics', '.mldgr'):
+        (tmp_path / ('map.osrm' + suffix)).write_bytes(b'data' + suffix.encode())
+    return str(tmp_path / 'map.osrm')
+
+
+def _completed(returncode=0, output=b''):
+    return subprocess.CompletedProcess([], returncode, stdout=output)
+
+
+def test_rebuild_customizes_staging_copy_and_reloads(tmp_path):
+    data_path = _data(tmp_path)
+    done = MagicMock()
+    rebuilder = Rebuilder(data_path, on_success=done)
+    with patch('routing.rebuild.subprocess.run', return_value=_completed()) as mock_run:
+        assert rebuilder.start('/tmp/speeds.csv')
+        status = rebuilder.wait(5)
+    staging = str(tmp_path / 'staging' / 'map.osrm')
+    commands = [call.args[0] for call in mock_run.call_args_list]
+    assert commands == [
+        ['osrm-customize', '--segment-speed-file', '/tmp/speeds.csv', staging],
+        ['osrm-datastore', staging]
+    ]
+    assert (tmp_path / 'staging' / 'map.osrm.mldgr').read_bytes() == b'data.mldgr'
+    assert status['state'] == 'succeeded'
+    assert status['runs'] == 1 and status['failures'] == 0
+    assert status['duration_s'] >= 0
+    done.assert_called_once_with()
+    assert 'osrm_rebuild_total{result="succeeded"} 1' in rebuilder.metrics.render()
+    # Состояние видно и другому процессу через файл в промежуточном каталоге.
+    assert Rebuilder(data_path).status()['state'] == 'succeeded'
+
+
+def test_failed_step_reported_without_reload(tmp_path):
+    done = MagicMock()
+    rebuilder = Rebuilder(_data(tmp_path), reload='none', on_success=done)
+    with patch('routing.rebuild.subprocess.run', return_value=_completed(1, b'bad speed file')) as mock_run:
+        rebuilder.start()
+        status = rebuilder.wait(5)
+    assert mock_run.call_count == 1
+    assert status['state'] == 'failed'
+    assert 'osrm-customize exited with 1: bad speed file' == status['error']
+    assert status['failures'] == 1
+    done.assert_not_called()
+
+    with patch('routing.rebuild.subprocess.run', return_value=_completed()) as mock_run:
+        rebuilder.start()
+        assert rebuilder.wait(5)['state'] == 'succeeded'
+    assert [call.args[0][0] for call in mock_run.call_args_list] == ['osrm-customize']
+
+
+def test_second_start_while_running_is_ignored(tmp_path):
+    release = threading.Event()
+    rebuilder = Rebuilder(_data(tmp_path))
+
+    def slow_run(command, **kwargs):
+        release.wait(5)
+        return _completed()
+
+    with patch('routing.rebuild.subprocess.run', side_effect=slow_run) as mock_run:
+        assert rebuilder.start()
+        assert not rebuilder.start()
+        assert rebuilder.status()['state'] == 'running'
+        release.set()
+        assert rebuilder.wait(5)['state'] == 'succeeded'
+    assert mock_run.call_count == 2
+
+
+def test_rebuild_in_other_process_is_not_overwritten(tmp_path):
+    rebuilder = Rebuilder(_data(tmp_path))
+    (tmp_path / 'staging').mkdir()
+    with open(str(tmp_path / 'staging' / '.rebuild.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with patch('routing.rebuild.subprocess.run') as mock_run:
+            rebuilder.start()
+            status = rebuilder.wait(5)
+    mock_run.assert_not_called()
+    assert status['state'] == 'busy'
+    assert not (tmp_path / 'staging' / 'rebuild.json').exists()
+
+
+def test_missing_data_and_unknown_reload(tmp_path):
+    rebuilder = Rebuilder(str(tmp_path / 'absent.osrm'))
+    rebuilder.start()
+    status = rebuilder.wait(5)
+    assert status['state'] == 'failed'
+    assert 'no OSRM data' in status['error']
+    with pytest.raises(ValueError):
+        Rebuilder(str(tmp_path / 'absent.osrm'), reload='restart')
+
+
+def test_ch_rebuild_contracts_and_touches_reload_marker(tmp_path):
+    data_path = _data(tmp_path)
+    rebuilder = Rebuilder(data_path, algorithm='ch')
+    with patch('routing.rebuild.subprocess.run', return_value=_completed()) as mock_run:
+        rebuilder.start('/tmp/speeds.csv')
+        assert rebuilder.wait(5)['state'] == 'succeeded'
+    staging = str(tmp_path / 'staging' / 'map.osrm')
+    assert mock_run.call_args_list[0].args[0] == ['osrm-contract', '--segment-speed-file', '/tmp/speeds.csv', staging]
+    assert (tmp_path / 'staging' / 'rebuild.done').exists()
+    with pytest.raises(ValueError):
+        Rebuilder(data_path, algorithm='dijkstra')
@@ -2,23 +2,44 @@
 
 from unittest.mock import patch, MagicMock
 import importlib
+import json
+import os
 import sys
+import threading
+import time
+
+import pytest
+import requests
 
 sys.path.append('.')
 
 import routing.router as router_module
 
 
-def _mock_resp():
+def _json_resp(payload, status=200):
+    """Фейковый ответ requests с JSON-телом и в виде объекта, и в байтах."""
     resp = MagicMock()
-    resp.json.return_value = {"code": "Ok", "routes": [{}]}
+    resp.status_code = status
     resp.raise_for_status.return_value = None
+    resp.json.return_value = payload
+    resp.content = json.dumps(payload).encode('utf-8')
+    return resp
+
+
+def _http_error_resp(payload, status=400):
+    """Ответ OSRM с HTTP-ошибкой и JSON-телом, как 400 NoMatch или NoSegment."""
+    resp = _json_resp(payload, status)
+    resp.raise_for_status.side_effect = requests.HTTPError(response=resp)
     return resp
 
 
+def _mock_resp():
+    return _json_resp({"code": "Ok", "routes": [{}]})
+
+
 def test_route_call_builds_points():
     router = router_module.Router("http://example.com/")
-    with patch('routing.router.requests.get', return_value=_mock_resp()) as mock_get:
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
         router.route('1,1', '2,2')
         mock_get.assert_called_once()
         args, kwargs = mock_get.call_args
@@ -28,42 +49,50 @@ def test_route_call_builds_points():
 
 def test_route_with_via_points():
     router = router_module.Router("http://example.com")
-    with patch('routing.router.requests.get', return_value=_mock_resp()) as mock_get:
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
         router.route('1,1', '4,4', via=['2,2', '3,3'], steps='true')
         args, kwargs = mock_get.call_args
         assert args[0].endswith('/route/v1/driving/1,1;2,2;3,3;4,4')
         assert kwargs['params']['steps'] == 'true'
 
 
+def _fallback_fake_get(route_payloads, nearest_payloads, table_payload=None):
+    """Возвращает фейковый GET, отвечающий по URL, а не по порядку вызовов."""
+
+    def fake_get(url, params=None, timeout=None):
+        prefix, coords = url.split('/v1/driving/')
+        if prefix.endswith('/route'):
+            payload = route_payloads.get(coords, {"code": "NoRoute", "routes": []})
+        elif prefix.endswith('/table'):
+            payload = table_payload
+        else:
+            payload = nearest_payloads[coords]
+        return _json_resp(payload)
+
+    return fake_get
+
+
 def test_route_fallback_to_nearest_points():
-    router = router_module.Router("http://example.com")
+    router = router_module.Router("http://example.com", fallback_strategy='probe')
 
-    route_responses = iter([
-        {"code": "NoRoute", "routes": []},
-        {"code": "Ok", "routes": [{"distance": 1000.0}], "waypoints": []}
-    ])
-    nearest_responses = iter([
-        {"code": "Ok", "waypoints": [
+    route_payloads = {
+        '1,1;2,2': {"code": "NoRoute", "routes": []},
+        '1.100000,2.200000;3.300000,4.400000': {
+            "code": "Ok", "routes": [{"distance": 1000.0}], "waypoints": []
+        }
+    }
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [
             {"location": [1.1, 2.2]},
             {"location": [1.2, 2.3]}
         ]},
-        {"code": "Ok", "waypoints": [
+        '2,2': {"code": "Ok", "waypoints": [
             {"location": [3.3, 4.4]}
         ]}
-    ])
+    }
 
-    def fake_get(url, params=None, timeout=None):
-        resp = MagicMock()
-        resp.raise_for_status.return_value = None
-        resp.status_code = 200
-        if '/route/v1/driving/' in url:
-            payload = next(route_responses)
-        else:
-            payload = next(nearest_responses)
-        resp.json.return_value = payload
-        return resp
-
-    with patch('routing.router.requests.get', side_effect=fake_get) as mock_get:
+    fake_get = _fallback_fake_get(route_payloads, nearest_payloads)
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
         result = router.route('1,1', '2,2')
 
         assert result['code'] == 'Ok'
@@ -72,50 +101,191 @@ def test_route_fallback_to_nearest_points():
         first_route_call = mock_get.call_args_list[0]
         assert first_route_call.args[0].endswith('/route/v1/driving/1,1;2,2')
 
-        first_nearest_call = mock_get.call_args_list[1]
-        assert first_nearest_call.args[0].endswith('/nearest/v1/driving/1,1')
-        assert first_nearest_call.kwargs['params']['number'] == '5'
-
-        second_nearest_call = mock_get.call_args_list[2]
-        assert second_nearest_call.args[0].endswith('/nearest/v1/driving/2,2')
-        assert second_nearest_call.kwargs['params']['number'] == '5'
-
-        fallback_route_call = mock_get.call_args_list[3]
-        assert fallback_route_call.args[0].endswith('/route/v1/driving/1.100000,2.200000;3.300000,4.400000')
+        urls = [call.args[0] for call in mock_get.call_args_list]
+        nearest_calls = [call for call in mock_get.call_args_list if '/nearest/' in call.args[0]]
+        assert sorted(call.args[0].rsplit('/', 1)[1] for call in nearest_calls) == ['1,1', '2,2']
+        assert all(call.kwargs['params']['number'] == '5' for call in nearest_calls)
+        assert any(url.endswith('/route/v1/driving/1.100000,2.200000;3.300000,4.400000') for url in urls)
+    router.close()
 
 
 def test_route_returns_original_when_fallback_not_possible():
     router = router_module.Router("http://example.com")
 
-    route_responses = iter([
-        {"code": "NoRoute", "routes": []}
-    ])
-    nearest_responses = iter([
-        {"code": "Error", "waypoints": []}
-    ])
+    nearest_payloads = {
+        '1,1': {"code": "Error", "waypoints": []},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [3.3, 4.4]}]}
+    }
 
-    def fake_get(url, params=None, timeout=None):
-        resp = MagicMock()
-        resp.raise_for_status.return_value = None
-        resp.status_code = 200
-        if '/route/v1/driving/' in url:
-            payload = next(route_responses)
-        else:
-            payload = next(nearest_responses)
-        resp.json.return_value = payload
-        return resp
+    fake_get = _fallback_fake_get({}, nearest_payloads)
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.route('1,1', '2,2')
+
+        assert result['code'] == 'NoRoute'
+        urls = [call.args[0] for call in mock_get.call_args_list]
+        assert any(url.endswith('/nearest/v1/driving/1,1') for url in urls)
+        assert sum('/route/' in url for url in urls) == 1
+    router.close()
+
+
+def test_fallback_probes_pairs_concurrently_and_stops_on_success():
+    router = router_module.Router("http://example.com", fallback_workers=4, fallback_strategy='probe')
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [{"location": [1, i]} for i in range(5)]},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [2, i]} for i in range(5)]}
+    }
+    ok_points = '1.000000,0.000000;2.000000,0.000000'
+    fake_get = _fallback_fake_get(
+        {ok_points: {"code": "Ok", "routes": [{"distance": 1.0}]}},
+        nearest_payloads
+    )
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.route('1,1', '2,2')
+        assert result['code'] == 'Ok'
+        probes = [call for call in mock_get.call_args_list if '/route/' in call.args[0]][1:]
+        assert len(probes) < 25
+        for call in probes:
+            connect, read = call.kwargs['timeout']
+            assert read <= router.fallback_deadline
+    router.close()
 
-    with patch('routing.router.requests.get', side_effect=fake_get) as mock_get:
+
+def test_fallback_probes_capped_per_request():
+    router = router_module.Router(
+        "http://example.com", fallback_workers=4, fallback_probe_limit=2, fallback_strategy='probe'
+    )
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [{"location": [1, i]} for i in range(3)]},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [2, i]} for i in range(3)]}
+    }
+    base_get = _fallback_fake_get({}, nearest_payloads)
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def tracked_get(url, params=None, timeout=None):
+        probing = '/route/' in url and not url.endswith('1,1;2,2')
+        if probing:
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(url)
+        return base_get(url, params=params, timeout=timeout)
+
+    with patch('routing.router.requests.Session.get', side_effect=tracked_get):
+        result = router.route('1,1', '2,2')
+    assert result['code'] == 'NoRoute'
+    # Все 9 пар проверены, но не больше двух одновременно.
+    assert len(peak) == 9
+    assert max(peak) == 2
+    router.close()
+
+
+def test_fallback_respects_overall_deadline():
+    router = router_module.Router(
+        "http://example.com", fallback_workers=2, fallback_deadline=0.2, fallback_strategy='probe'
+    )
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [{"location": [1, i]} for i in range(5)]},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [2, i]} for i in range(5)]}
+    }
+    base_get = _fallback_fake_get({}, nearest_payloads)
+
+    def slow_get(url, params=None, timeout=None):
+        if '/route/' in url and not url.endswith('1,1;2,2'):
+            time.sleep(0.1)
+        return base_get(url, params=params, timeout=timeout)
+
+    with patch('routing.router.requests.Session.get', side_effect=slow_get):
+        started = time.monotonic()
         result = router.route('1,1', '2,2')
+        elapsed = time.monotonic() - started
+    assert result['code'] == 'NoRoute'
+    assert elapsed < 1.0
+    router.close()
+
+
+def test_table_fallback_routes_cheapest_reachable_pair():
+    router = router_module.Router("http://example.com")
+    assert router.fallback_strategy == 'table'
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [{"location": [1, 0]}, {"location": [1, 1]}]},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [2, 0]}, {"location": [2, 1]}]}
+    }
+    table_payload = {"code": "Ok", "durations": [[None, 50.0], [30.0, None]]}
+    best = '1.000000,1.000000;2.000000,0.000000'
+    fake_get = _fallback_fake_get(
+        {best: {"code": "Ok", "routes": [{"distance": 5.0}]}},
+        nearest_payloads,
+        table_payload
+    )
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.route('1,1', '2,2', exclude='ferry')
+        assert result['routes'] == [{"distance": 5.0}]
+        urls = [call.args[0] for call in mock_get.call_args_list]
+        table_call = [call for call in mock_get.call_args_list if '/table/' in call.args[0]][0]
+        assert table_call.args[0].endswith(
+            '/table/v1/driving/1.000000,0.000000;1.000000,1.000000;2.000000,0.000000;2.000000,1.000000'
+        )
+        assert table_call.kwargs['params']['sources'] == '0;1'
+        assert table_call.kwargs['params']['destinations'] == '2;3'
+        assert table_call.kwargs['params']['exclude'] == 'ferry'
+        assert sum('/route/' in url for url in urls) == 2
+    router.close()
+
+
+def test_table_fallback_with_via_points_checks_both_sides():
+    router = router_module.Router("http://example.com")
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [{"location": [1, 0]}]},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [2, 0]}]}
+    }
+    table_payload = {"code": "Ok", "durations": [[10.0, 99.0], [99.0, 20.0]]}
+    target = '1.000000,0.000000;5,5;2.000000,0.000000'
+    fake_get = _fallback_fake_get(
+        {target: {"code": "Ok", "routes": [{"distance": 7.0}]}},
+        nearest_payloads,
+        table_payload
+    )
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.route('1,1', '2,2', via=['5,5'])
+        assert result['routes'] == [{"distance": 7.0}]
+        table_call = [call for call in mock_get.call_args_list if '/table/' in call.args[0]][0]
+        assert table_call.args[0].endswith('/table/v1/driving/1.000000,0.000000;5,5;5,5;2.000000,0.000000')
+        assert table_call.kwargs['params']['sources'] == '0;1'
+        assert table_call.kwargs['params']['destinations'] == '2;3'
+    router.close()
+
 
+def test_table_fallback_returns_original_when_unreachable():
+    router = router_module.Router("http://example.com")
+    nearest_payloads = {
+        '1,1': {"code": "Ok", "waypoints": [{"location": [1, 0]}]},
+        '2,2': {"code": "Ok", "waypoints": [{"location": [2, 0]}]}
+    }
+    fake_get = _fallback_fake_get({}, nearest_payloads, {"code": "Ok", "durations": [[None]]})
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.route('1,1', '2,2')
         assert result['code'] == 'NoRoute'
-        assert mock_get.call_args_list[1].args[0].endswith('/nearest/v1/driving/1,1')
-        assert len(mock_get.call_args_list) == 2
+        assert sum('/route/' in call.args[0] for call in mock_get.call_args_list) == 1
+    router.close()
+
+
+def test_unknown_fallback_strategy_rejected():
+    router = router_module.Router("http://example.com")
+    try:
+        router.set_fallback_strategy('brute')
+    except ValueError as exc:
+        assert 'brute' in str(exc)
+    else:
+        raise AssertionError('ValueError expected')
 
 
 def test_route_points_direct_call():
     router = router_module.Router("http://example.com")
-    with patch('routing.router.requests.get', return_value=_mock_resp()) as mock_get:
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
         router.route_points('1,1;2,2', annotations='false')
         args, kwargs = mock_get.call_args
         assert args[0].endswith('/route/v1/driving/1,1;2,2')
@@ -134,3 +304,378 @@ def test_default_algorithm(monkeypatch):
     importlib.reload(router_module)
     router = router_module.Router()
     assert router.algorithm == 'mld'
+
+
+def test_router_reuses_pooled_session():
+    router = router_module.Router("http://example.com", pool_size=4)
+    adapter = router.session.get_adapter('http://example.com')
+    assert adapter._pool_maxsize == 4
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
+        router.table('1,1;2,2')
+        router.nearest('1,1')
+        assert mock_get.call_count == 2
+        assert router.pool_stats()['requests_total'] == 2
+        assert router.pool_stats()['in_flight'] == 0
+
+
+def test_request_timeouts_default_and_per_call():
+    router = router_module.Router("http://example.com", connect_timeout=2.0, read_timeout=30.0)
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
+        router.table('1,1;2,2')
+        assert mock_get.call_args.kwargs['timeout'] == (2.0, 30.0)
+        router.table('1,1;3,3', timeout=5)
+        assert mock_get.call_args.kwargs['timeout'] == (2.0, 5.0)
+        router.nearest('1,1', timeout=(1, 2))
+        assert mock_get.call_args.kwargs['timeout'] == (1.0, 2.0)
+        assert 'timeout' not in mock_get.call_args.kwargs['params']
+
+
+def test_retries_only_idempotent_methods():
+    router = router_module.Router("http://example.com", max_retries=3)
+    retry = router.session.get_adapter('http://example.com').max_retries
+    assert retry.total == 3
+    assert 'GET' in retry.allowed_methods
+    assert 'POST' not in retry.allowed_methods
+
+
+def test_pool_stats_structure():
+    router = router_module.Router("http://example.com", pool_size=7)
+    stats = router.pool_stats()
+    assert stats['pool_size'] == 7
+    assert stats['base_url'] == 'http://example.com'
+    assert stats['pools'] == []
+
+
+def test_route_responses_cached_until_rebuild(tmp_path):
+    (tmp_path / 'map.osrm').write_bytes(b'data')
+    router = router_module.Router("http://example.com", data_path=str(tmp_path / 'map.osrm'))
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
+        first = router.route('1,1', '2,2', steps='true')
+        second = router.route('1.0,1.0', '2.000000,2', steps='true')
+        assert first is second
+        assert mock_get.call_count == 1
+        router.route('1,1', '2,2', steps='false')
+        assert mock_get.call_count == 2
+        completed = MagicMock(returncode=0, stdout=b'')
+        with patch('routing.rebuild.subprocess.run', return_value=completed) as mock_run:
+            status = router.rebuild(wait=True)
+        assert status['state'] == 'succeeded'
+        assert status['accepted'] is True
+        assert mock_run.call_args_list[0].args[0] == ['osrm-customize', str(tmp_path / 'staging' / 'map.osrm')]
+        router.route('1,1', '2,2', steps='true')
+        assert mock_get.call_count == 3
+    stats = router.cache.stats()
+    assert stats['hits'] == 1
+    assert stats['invalidations'] == 1
+
+
+def test_rebuild_in_another_process_invalidates_cache(tmp_path):
+    (tmp_path / 'map.osrm').write_bytes(b'data')
+    worker = router_module.Router("http://example.com", data_path=str(tmp_path / 'map.osrm'))
+    worker.cache._version_check_interval = 0
+    with patch('routing.router.requests.Session.get', return_value=_mock_resp()) as mock_get:
+        worker.route('1,1', '2,2')
+        worker.route('1,1', '2,2')
+        assert mock_get.call_count == 1
+        # Перестройку выполнил другой процесс: OSRM_DATA* не менялись, обновилась только метка.
+        other = router_module.Router("http://example.com", data_path=str(tmp_path / 'map.osrm'))
+        completed = MagicMock(returncode=0, stdout=b'')
+        with patch('routing.rebuild.subprocess.run', return_value=completed):
+            assert other.rebuild(wait=True)['state'] == 'succeeded'
+        os.utime(other.rebuilder.marker_path, (time.time() + 10, time.time() + 10))
+        worker.route('1,1', '2,2')
+        assert mock_get.call_count == 2
+
+
+def test_cached_entry_sized_by_upstream_body():
+    router = router_module.Router("http://example.com")
+    resp = _mock_resp()
+    with patch('routing.router.requests.Session.get', return_value=resp), \
+            patch('routing.cache._estimate_size', side_effect=AssertionError('serialized')):
+        router.route('1,1', '2,2')
+    assert router.cache.stats()['bytes'] == len(resp.content)
+
+
+def test_failed_responses_not_cached():
+    router = router_module.Router("http://example.com")
+    resp = _json_resp({"code": "NoSegment", "waypoints": []})
+    with patch('routing.router.requests.Session.get', return_value=resp) as mock_get:
+        router.nearest('1,1')
+        router.nearest('1,1')
+        assert mock_get.call_count == 2
+
+
+def test_nearest_candidates_reuse_snapped_cell():
+    router = router_module.Router("http://example.com")
+    resp = _json_resp({"code": "Ok", "waypoints": [{"location": [30.7233, 46.4825]}]})
+    with patch('routing.router.requests.Session.get', return_value=resp) as mock_get:
+        first = router._nearest_candidates('30.72331,46.48251')
+        second = router._nearest_candidates('30.72334,46.48249')
+        assert first == second == ['30.723300,46.482500']
+        assert mock_get.call_count == 1
+
+
+def _matrix_fake_get(url, params=None, timeout=None):
+    """Отвечает на /table матрицей duration = 10 * источник + назначение."""
+    coords = url.split('/table/v1/driving/')[1].split(';')
+    ids = [int(coord.split(',')[0]) for coord in coords]
+    sources = [ids[int(i)] for i in params['sources'].split(';')]
+    destinations = [ids[int(i)] for i in params['destinations'].split(';')]
+    return _json_resp({
+        'code': 'Ok',
+        'durations': [[10.0 * s + d for d in destinations] for s in sources],
+        'sources': [{'location': [s, s]} for s in sources],
+        'destinations': [{'location': [d, d]} for d in destinations],
+        'radiuses': params.get('radiuses')
+    })
+
+
+def test_table_chunked_beyond_max_table_size():
+    router = router_module.Router("http://example.com", max_table_size=2)
+    points = ';'.join('{0},{0}'.format(i) for i in range(5))
+    radiuses = ';'.join(str(100 + i) for i in range(5))
+    with patch('routing.router.requests.Session.get', side_effect=_matrix_fake_get) as mock_get:
+        result = router.table(points, radiuses=radiuses, sources='0;1;2;3;4', destinations='4;3;2')
+    assert mock_get.call_count == 6
+    assert result['code'] == 'Ok'
+    assert result['durations'] == [[10.0 * s + d for d in (4, 3, 2)] for s in range(5)]
+    assert [w['location'][0] for w in result['sources']] == [0, 1, 2, 3, 4]
+    assert [w['location'][0] for w in result['destinations']] == [4, 3, 2]
+    assert 'distances' not in result
+    tile_radiuses = {call.kwargs['params']['radiuses'] for call in mock_get.call_args_list}
+    assert '100;101;104;103' in tile_radiuses
+    router.close()
+
+
+def test_table_chunk_error_returned():
+    router = router_module.Router("http://example.com", max_table_size=2)
+
+    def fake_get(url, params=None, timeout=None):
+        if '4,4' in url:
+            return _http_error_resp({'code': 'NoSegment', 'message': 'bad'})
+        return _matrix_fake_get(url, params=params, timeout=timeout)
+
+    points = ';'.join('{0},{0}'.format(i) for i in range(5))
+    with patch('routing.router.requests.Session.get', side_effect=fake_get):
+        result = router.table(points)
+    # Ошибка одного тайла доходит до склейки и возвращается, а не обрывает матрицу исключением.
+    assert result == {'code': 'NoSegment', 'message': 'bad'}
+    server_error = _http_error_resp({'error': 'boom'}, status=500)
+    with patch('routing.router.requests.Session.get', return_value=server_error):
+        with pytest.raises(requests.HTTPError):
+            router.table(points)
+    router.close()
+
+
+def test_long_trace_matched_in_windows():
+    router = router_module.Router("http://example.com", max_matching_size=4, match_overlap=2)
+
+    def fake_get(url, params=None, timeout=None):
+        coords = url.split('/match/v1/driving/')[1].split(';')
+        ids = [int(coord.split(',')[0]) for coord in coords]
+        assert len(ids) <= 4
+        assert params['timestamps'] == ';'.join(str(100 + i) for i in ids)
+        assert params['overview'] == 'false'
+        return _json_resp({
+            'code': 'Ok',
+            'matchings': [{'confidence': 1.0, 'legs': [{'distance': 1.0}] * (len(ids) - 1)}],
+            'tracepoints': [
+                {'matchings_index': 0, 'waypoint_index': i, 'location': [ids[i], 0]}
+                for i in range(len(ids))
+            ]
+        })
+
+    points = ';'.join('{},0'.format(i) for i in range(12))
+    timestamps = ';'.join(str(100 + i) for i in range(12))
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.match(points, timestamps=timestamps)
+    assert mock_get.call_count == 5
+    assert len(result['matchings']) == 1
+    assert result['matchings'][0]['distance'] == 11.0
+    assert [tp['location'][0] for tp in result['tracepoints']] == list(range(12))
+    router.close()
+
+
+def test_long_trace_keeps_windows_around_unmatched_one():
+    router = router_module.Router("http://example.com", max_matching_size=4, match_overlap=0)
+
+    def fake_get(url, params=None, timeout=None):
+        coords = url.split('/match/v1/driving/')[1].split(';')
+        ids = [int(coord.split(',')[0]) for coord in coords]
+        if ids[0] == 4:
+            return _http_error_resp({'code': 'NoMatch', 'message': 'no match'})
+        return _json_resp({
+            'code': 'Ok',
+            'matchings': [{'confidence': 1.0, 'legs': [{'distance': 1.0}] * (len(ids) - 1)}],
+            'tracepoints': [
+                {'matchings_index': 0, 'waypoint_index': i, 'location': [ids[i], 0]}
+                for i in range(len(ids))
+            ]
+        })
+
+    points = ';'.join('{},0'.format(i) for i in range(12))
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        result = router.match(points)
+    assert mock_get.call_count == 3
+    assert result['code'] == 'Ok'
+    assert [chunk['code'] for chunk in result['chunks']] == ['Ok', 'NoMatch', 'Ok']
+    assert len(result['matchings']) == 2
+    located = [tp['location'][0] if tp is not None else None for tp in result['tracepoints']]
+    assert located == [0, 1, 2, 3, None, None, None, None, 8, 9, 10, 11]
+    router.close()
+
+
+def test_concurrent_identical_routes_coalesced_with_fallback():
+    router = router_module.Router("http://example.com")
+    release = threading.Event()
+    calls = []
+    fake = _fallback_fake_get(
+        {'1.000000,1.000000;2.000000,2.000000': {"code": "Ok", "routes": [{"distance": 1}]}},
+        {'0,0': {"code": "Ok", "waypoints": [{"location": [1, 1]}]},
+         '3,3': {"code": "Ok", "waypoints": [{"location": [2, 2]}]}},
+        {"code": "Ok", "durations": [[10.0]]}
+    )
+
+    def slow_get(url, params=None, timeout=None):
+        calls.append(url)
+        release.wait(5)
+        return fake(url, params=params, timeout=timeout)
+
+    results = []
+    with patch('routing.router.requests.Session.get', side_effect=slow_get):
+        threads = [threading.Thread(target=lambda: results.append(router.route('0,0', '3,3')))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while router.flights.stats()['coalesced'] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+    assert results[0]['routes'] == [{"distance": 1}]
+    assert len([url for url in calls if '/route/' in url and url.endswith('0,0;3,3')]) == 1
+    assert router.flights.stats()['coalesced'] == 3
+
+
+def test_fallback_metrics_count_fires_and_probes():
+    router = router_module.Router("http://example.com")
+    fake = _fallback_fake_get(
+        {'1.000000,1.000000;2.000000,2.000000': {"code": "Ok", "routes": [{}]}},
+        {'0,0': {"code": "Ok", "waypoints": [{"location": [1, 1]}]},
+         '3,3': {"code": "Ok", "waypoints": [{"location": [2, 2]}]}},
+        {"code": "Ok", "durations": [[10.0]]}
+    )
+    with patch('routing.router.requests.Session.get', side_effect=fake):
+        router.route('0,0', '3,3')
+    assert router._fallback_total.value(('table', 'ok')) == 1
+    assert router._fallback_probes.count(('table',)) == 1
+    text = router.metrics.render()
+    assert 'osrm_fallback_total{strategy="table",result="ok"} 1' in text
+    assert 'osrm_fallback_probes_sum{strategy="table"} 1' in text
+
+
+def _local_graph():
+    from routing.graph import Graph
+    return Graph.from_edges(
+        [101, 102, 103, 104], [1.0, 1.0, 2.0, 2.0], [0.0, 0.001, 0.0, 0.001],
+        [0, 1, 2, 3], [1, 0, 3, 2], [50, 50, 50, 50], [7, 7, 8, 8]
+    )
+
+
+def test_nearest_served_by_local_index():
+    router = router_module.Router("http://example.com", graph=_local_graph())
+    with patch('routing.router.requests.Session.get') as mock_get:
+        result = router.nearest('1.0,0.0009', number='2')
+        assert mock_get.call_count == 0
+    assert result['code'] == 'Ok'
+    assert [waypoint['location'] for waypoint in result['waypoints']] == [[1.0, 0.001], [1.0, 0.0]]
+    assert result['waypoints'][0]['nodes'][0] == 102
+    assert result['waypoints'][0]['distance'] < result['waypoints'][1]['distance']
+    assert not router.can_passthrough('nearest', '1.0,0.0009', {'number': '2'})
+    # Параметры, которых нет у локального индекса, уходят в OSRM.
+    assert router.can_passthrough('nearest', '1.0,0.0009', {'radiuses': '10'})
+    resp = _json_resp({"code": "Ok", "waypoints": []})
+    with patch('routing.router.requests.Session.get', return_value=resp) as mock_get:
+        router.nearest('1.0,0.0009', radiuses='10')
+        assert mock_get.call_count == 1
+    router.close()
+
+
+def test_fallback_candidates_from_local_index():
+    router = router_module.Router("http://example.com", graph=_local_graph(), fallback_strategy='probe')
+    best = '1.000000,0.000000;2.000000,0.001000'
+    fake_get = _fallback_fake_get({best: {"code": "Ok", "routes": [{"distance": 5.0}]}}, {})
+    with patch('routing.router.requests.Session.get', side_effect=fake_get) as mock_get:
+        assert router._fallback_candidates('1,-0.001', '2,0.002', time.monotonic() + 5) == (
+            ['1.000000,0.000000', '1.000000,0.001000', '2.000000,0.000000', '2.000000,0.001000'],
+            ['2.000000,0.001000', '2.000000,0.000000', '1.000000,0.001000', '1.000000,0.000000']
+        )
+        result = router.route('1,-0.001', '2,0.002')
+        assert result['routes'] == [{"distance": 5.0}]
+        assert not any('/nearest/' in call.args[0] for call in mock_get.call_args_list)
+    router.close()
+
+
+def test_missing_graph_falls_back_to_osrm(tmp_path):
+    router = router_module.Router("http://example.com", graph_path=str(tmp_path / 'missing.graph'))
+    assert router.graph is None
+    assert router.can_passthrough('nearest', '1,1', {})
+    router.close()
+
+
+def _read(upstream, chunk_size=4):
+    try:
+        return b''.join(upstream.iter_content(chunk_size=chunk_size))
+    finally:
+        upstream.close()
+
+
+def test_raw_cached_streams_and_caches_complete_body():
+    router = router_module.Router("http://example.com")
+    resp = _json_resp({"code": "Ok", "durations": [[0.0]]})
+    resp.headers = {'Content-Type': 'application/json'}
+    resp.iter_content.side_effect = lambda chunk_size=1: iter([resp.content[:5], resp.content[5:]])
+    with patch('routing.router.requests.Session.get', return_value=resp) as mock_get:
+        upstream = router.raw_cached('table', '1,1;2,2')
+        assert mock_get.call_args.kwargs['stream'] is True
+        # Пока тело не дочитано, кэшировать нечего.
+        assert router.cached_response('table', '1,1;2,2', {}) is None
+        assert _read(upstream) == resp.content
+        cached = router.raw_cached('table', '1.0,1;2,2.0')
+        assert cached.status_code == 200
+        assert _read(cached) == resp.content
+        assert cached.headers['Content-Length'] == str(len(resp.content))
+        assert mock_get.call_count == 1
+    # Разобранный вызов того же ключа получает dict из закэшированных байтов.
+    assert router.table('1,1;2,2') == {"code": "Ok", "durations": [[0.0]]}
+
+
+def test_raw_cached_skips_oversized_and_unfinished_bodies():
+    router = router_module.Router("http://example.com", passthrough_cache_limit=8)
+    resp = _json_resp({"code": "Ok", "durations": [[0.0]]})
+    resp.iter_content.side_effect = lambda chunk_size=1: iter([resp.content[:5], resp.content[5:]])
+    with patch('routing.router.requests.Session.get', return_value=resp) as mock_get:
+        assert _read(router.raw_cached('table', '1,1;2,2')) == resp.content
+        router.passthrough_cache_limit = 1024
+        # Клиент оборвал передачу: неполное тело не кэшируется.
+        upstream = router.raw_cached('table', '1,1;2,2')
+        next(upstream.iter_content(chunk_size=4))
+        upstream.close()
+        router.raw_cached('table', '1,1;2,2').close()
+    assert mock_get.call_count == 3
+    assert router.cache.stats()['entries'] == 0
+
+
+def test_raw_cached_skips_failed_bodies():
+    router = router_module.Router("http://example.com")
+    resp = _json_resp({"code": "NoTable"}, status=400)
+    resp.headers = {}
+    with patch('routing.router.requests.Session.get', return_value=resp) as mock_get:
+        assert router.raw_cached('table', '1,1;2,2').status_code == 400
+        router.raw_cached('table', '1,1;2,2')
+    assert mock_get.call_count == 2
+    assert router_module._is_ok_body(b'{"code":"Ok","routes":[]}')
+    assert router_module._is_ok_body(b'{"waypoints":[],"code":"Ok"}')
+    assert not router_module._is_ok_body(b'{"code":"NoRoute"}')
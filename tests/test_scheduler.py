@@ -0,0 +1,118 @@
+"""Тесты планировщика перестройки routing.scheduler."""
+
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append('.')
+
+from routing.graph import Graph
+from routing.metrics import Registry
+from routing.scheduler import RebuildScheduler
+
+
+class FakeRebuilder:
+    """Перестройка, которая завершается по команде теста."""
+
+    def __init__(self):
+        self.running = False
+        self.starts = []
+        self.result = {'state': 'succeeded', 'duration_s': 10.0}
+
+    def start(self, speed_file=None):
+        if self.running:
+            return False
+        self.running = True
+        self.starts.append(speed_file)
+        return True
+
+    def finish(self, state='succeeded', duration=10.0):
+        self.running = False
+        self.result = {'state': state, 'duration_s': duration}
+
+    def status(self):
+        return dict(self.result, state='running') if self.running else dict(self.result)
+
+
+class FakeRouter:
+    def __init__(self):
+        self.rebuilder = FakeRebuilder()
+        self.metrics = Registry()
+
+
+def _scheduler(graph=None, **kwargs):
+    options = dict(min_change=10, quiet=30, max_delay=600, cost_factor=4)
+    options.update(kwargs)
+    return RebuildScheduler(FakeRouter(), graph=graph, **options)
+
+
+def test_burst_is_debounced_into_one_rebuild():
+    scheduler = _scheduler()
+    rebuilder = scheduler.rebuilder
+    for second in range(0, 50, 10):
+        scheduler.record(4, speed_file='/tmp/speeds.csv', now=second)
+        assert scheduler.poll(now=second + 1) == 'debounce'
+    assert scheduler.poll(now=75) == 'rebuild'
+    assert rebuilder.starts == ['/tmp/speeds.csv']
+    assert scheduler.status()['in_flight_updates'] == 5
+
+    # Во время перестройки новые изменения ждут, второй запуск не начинается.
+    scheduler.record(20, now=80)
+    assert scheduler.poll(now=200) == 'running'
+    assert len(rebuilder.starts) == 1
+
+    rebuilder.finish(duration=10.0)
+    # Пауза после перестройки — cost_factor её длительностей.
+    assert scheduler.poll(now=210) == 'cooldown'
+    assert scheduler.poll(now=251) == 'rebuild'
+    assert len(rebuilder.starts) == 2
+    text = scheduler.metrics.render()
+    assert 'osrm_rebuild_scheduled_total{reason="change"} 2' in text
+    assert 'osrm_rebuild_latency_seconds_count 1' in text
+    assert 'osrm_rebuild_coalesced_updates_sum 5' in text
+
+
+def test_small_changes_wait_until_max_delay():
+    scheduler = _scheduler()
+    scheduler.record(1, now=0)
+    assert scheduler.poll(now=100) == 'waiting'
+    assert scheduler.status()['pending_updates'] == 1
+    assert scheduler.metrics.render().count('osrm_rebuild_pending_updates 1') == 1
+    assert scheduler.poll(now=600) == 'rebuild'
+    assert 'osrm_rebuild_scheduled_total{reason="age"} 1' in scheduler.metrics.render()
+
+
+def test_failed_rebuild_requeues_changes():
+    scheduler = _scheduler()
+    scheduler.record(12, speed_file='/tmp/a.csv', now=0)
+    assert scheduler.poll(now=40) == 'rebuild'
+    scheduler.rebuilder.finish('failed', duration=5.0)
+    assert scheduler.poll(now=50) == 'cooldown'
+    assert scheduler.status()['pending_change'] == 12
+    assert scheduler.poll(now=71) == 'rebuild'
+    assert scheduler.rebuilder.starts == ['/tmp/a.csv', '/tmp/a.csv']
+
+
+def test_graph_drift_counts_net_change_and_writes_speed_file(tmp_path):
+    graph = Graph.from_edges(
+        np.array([10, 20, 30]), np.array([30.0, 30.01, 30.02]), np.array([46.0, 46.0, 46.0]),
+        np.array([0, 1, 1]), np.array([1, 2, 0]), np.array([50, 50, 50]), np.array([1, 2, 3])
+    )
+    scheduler = _scheduler(graph, output_dir=str(tmp_path), min_change=0.5)
+    scheduler.record(edges=graph.update_weights([0], [25], key='edge'), now=0)
+    assert scheduler.pending_change() == 1.0
+    # Вес вернулся к исходному — перестраивать нечего.
+    scheduler.record(edges=graph.reset_weights(), now=10)
+    assert scheduler.poll(now=100) == 'idle'
+    assert scheduler.status()['pending_updates'] == 0
+
+    scheduler.record(edges=graph.update_weights([2], [40], key='edge'), now=200)
+    assert scheduler.pending_change() == pytest.approx(0.25)
+    assert scheduler.poll(now=300) == 'waiting'
+    scheduler.record(edges=graph.update_weights([1], [10], key='edge'), now=310)
+    assert scheduler.poll(now=400) == 'rebuild'
+    path = scheduler.rebuilder.starts[0]
+    assert path == str(tmp_path / 'graph_speeds.csv')
+    assert open(path).read().split() == ['20,10,10', '20,30,40']
+    assert scheduler.pending_change() == 0.0
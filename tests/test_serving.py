@@ -0,0 +1,41 @@
+"""Тесты сведений о серверном сокете и конфигурации gunicorn."""
+
+import runpy
+import sys
+
+sys.path.append('api')
+import serving
+
+_TCP_TABLE = """  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000:1388 00000000:0000 0A 00000000:00000003 00:00000000 00000000     0        0 1 1 0
+   1: 0100007F:1389 00000000:0000 0A 00000000:00000007 00:00000000 00000000     0        0 2 1 0
+   2: 0100007F:1388 0100007F:D2F0 01 00000000:00000000 00:00000000 00000000     0        0 3 1 0
+"""
+
+
+def test_accept_queue_depth_reads_listen_socket(tmp_path):
+    table = tmp_path / 'tcp'
+    table.write_text(_TCP_TABLE)
+    assert serving.accept_queue_depth(5000, tables=[str(table)]) == {'port': 5000, 'queued': 3}
+    assert serving.accept_queue_depth(5002, tables=[str(table)]) is None
+    assert serving.accept_queue_depth(5000, tables=[str(tmp_path / 'absent')]) is None
+
+
+def test_gunicorn_config_from_env(monkeypatch):
+    monkeypatch.setenv('PORT', '8080')
+    monkeypatch.setenv('WEB_CONCURRENCY', '3')
+    monkeypatch.setenv('GUNICORN_KEEPALIVE', '10')
+    monkeypatch.setenv('GUNICORN_BACKLOG', '128')
+    config = runpy.run_path('api/gunicorn.conf.py')
+    assert config['bind'] == '0.0.0.0:8080'
+    assert config['workers'] == 3
+    assert config['keepalive'] == 10
+    assert config['backlog'] == 128
+    assert config['graceful_timeout'] > 0
+
+
+def test_gunicorn_default_workers_follow_cpu_count(monkeypatch):
+    monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    monkeypatch.setattr('multiprocessing.cpu_count', lambda: 4)
+    config = runpy.run_path('api/gunicorn.conf.py')
+    assert config['workers'] == 9
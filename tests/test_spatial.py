@@ -0,0 +1,46 @@
+"""Тесты для модуля routing.spatial."""
+
+import sys
+
+import numpy as np
+
+sys.path.append('.')
+
+from routing.graph import haversine
+from routing.spatial import GridIndex
+
+
+def _brute_force(lon, lat, qlon, qlat, k):
+    distances = haversine(lon[None, :], lat[None, :], qlon[:, None], qlat[:, None])
+    return np.sort(distances, axis=1)[:, :k]
+
+
+def test_batch_query_matches_brute_force():
+    rng = np.random.RandomState(7)
+    lon = 30.5 + rng.rand(3000) * 0.3
+    lat = 46.3 + rng.rand(3000) * 0.2
+    # Часть запросов лежит за пределами сетки и далеко от точек.
+    qlon = 30.3 + rng.rand(400) * 0.7
+    qlat = 46.1 + rng.rand(400) * 0.6
+    index = GridIndex(lon, lat, cell_size=150)
+    indices, distances = index.query(qlon, qlat, k=4)
+    assert indices.shape == distances.shape == (400, 4)
+    found = haversine(lon[indices], lat[indices], qlon[:, None], qlat[:, None])
+    expected = _brute_force(lon, lat, qlon, qlat, 4)
+    np.testing.assert_allclose(np.sort(found, axis=1), expected, rtol=1e-3)
+    np.testing.assert_allclose(distances, found, rtol=1e-2)
+
+
+def test_missing_neighbours_padded():
+    index = GridIndex([30.0, 30.001, 31.0], [46.0, 46.0, 47.0])
+    indices, distances = index.query([30.0001, 40.0], [46.0, 50.0], k=4)
+    assert list(indices[0]) == [0, 1, 2, -1]
+    assert list(indices[1]) == [2, 1, 0, -1]
+    assert np.isinf(distances[:, 3]).all()
+    assert distances[0, 0] < 10
+
+
+def test_empty_index():
+    indices, distances = GridIndex([], []).query([30.0], [46.0], k=2)
+    assert indices.tolist() == [[-1, -1]]
+    assert np.isinf(distances).all()
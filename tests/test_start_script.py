@@ -7,3 +7,12 @@ def test_start_script_uses_python3():
     script = pathlib.Path('start.sh').read_text()
     assert 'python3' in script
     assert '--algorithm' in script
+
+
+def test_start_script_supports_server_modes():
+    script = pathlib.Path('start.sh').read_text()
+    assert 'SERVER_MODE' in script
+    assert 'gunicorn --config /app/gunicorn.conf.py app:app' in script
+    # Образ на Python 3.5 не может запустить ASGI-сервер, режим отклоняется явно.
+    assert 'exec python3 /app/asgi.py' not in script
+    assert 'SERVER_MODE=asgi is not supported' in script
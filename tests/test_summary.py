@@ -66,3 +66,103 @@ def test_build_route_summary_empty():
     summary = build_route_summary({'routes': []})
     assert summary['message'] == 'Маршрут не найден.'
     assert summary['legs'] == []
+
+
+def test_summarize_steps_matches_humanize_step():
+    import json
+    import random
+    from routing import summary as summary_module
+
+    types = ['depart', 'arrive', 'turn', 'new name', 'roundabout', 'fork', 'exit rotary', None]
+    modifiers = ['left', 'sharp right', 'uturn', 'straight', 'Unknown Mod', '', None]
+    names = ['Дерибасовская', '', None, 'улица Пушкинская']
+    rng = random.Random(7)
+    steps = []
+    for _ in range(500):
+        maneuver = {'type': rng.choice(types)}
+        if rng.random() < 0.8:
+            maneuver['modifier'] = rng.choice(modifiers)
+        step = {'distance': rng.uniform(0, 5000), 'duration': rng.uniform(0, 900), 'maneuver': maneuver}
+        if rng.random() < 0.9:
+            step['name'] = rng.choice(names)
+        steps.append(step)
+    steps.append({'distance': 1.0})
+
+    expected = [{
+        'instruction': summary_module._humanize_step(step),
+        'distance_km': summary_module._meters_to_kilometers(step.get('distance', 0.0)),
+        'duration_min': summary_module._seconds_to_minutes(step.get('duration', 0.0))
+    } for step in steps]
+    actual = summary_module._summarize_steps(steps)
+    assert json.dumps(actual, ensure_ascii=False) == json.dumps(expected, ensure_ascii=False)
+
+
+def test_instruction_template_does_not_hide_bugs():
+    from unittest.mock import patch
+
+    import pytest
+
+    from routing import summary as summary_module
+
+    with patch.object(summary_module, '_humanize_step', side_effect=RuntimeError('bug')):
+        with pytest.raises(RuntimeError):
+            summary_module._instruction_template(('bug probe', 'left'))
+    assert ('bug probe', 'left') not in summary_module._TEMPLATES
+    with patch.object(summary_module, '_humanize_step', side_effect=ValueError('bad modifier')):
+        assert summary_module._instruction_template(('bug probe', 'left')) is None
+
+
+def _multi_leg_response():
+    legs = []
+    for index in range(3):
+        legs.append({
+            'distance': 1000.0 + index,
+            'duration': 120.0 + index,
+            'summary': 'Участок {}'.format(index) if index else '',
+            'steps': [
+                {'distance': 400.0, 'duration': 50.0, 'name': 'Дерибасовская',
+                 'maneuver': {'type': 'depart'}},
+                {'distance': 600.0, 'duration': 70.0, 'name': '',
+                 'maneuver': {'type': 'turn', 'modifier': 'slight left'}}
+            ]
+        })
+    return {
+        'routes': [
+            {'geometry': {'type': 'LineString', 'coordinates': [[30.7, 46.4]] * 20},
+             'legs': legs, 'distance': 3003.0, 'duration': 363.0},
+            {'legs': [{'distance': 1.0}], 'distance': 1.0, 'duration': 1.0}
+        ],
+        'waypoints': [
+            {'name': 'Старт', 'location': [30.7, 46.4]},
+            {'name': '', 'location': [30.71, 46.41]},
+            {'name': 'Склад', 'location': [30.72, 46.42]},
+            {'name': 'Финиш', 'location': [30.73, 46.43]}
+        ],
+        'code': 'Ok'
+    }
+
+
+def test_iter_route_summary_matches_build_route_summary():
+    import json
+    from routing.summary import iter_route_summary
+
+    response = _multi_leg_response()
+    for order in (['routes', 'waypoints', 'code'], ['waypoints', 'code', 'routes']):
+        body = json.dumps({key: response[key] for key in order}, ensure_ascii=False).encode('utf-8')
+        items = list(iter_route_summary(body[i:i + 16] for i in range(0, len(body), 16)))
+        expected = build_route_summary(response)
+        legs = items[:-1]
+        assert [item['leg'] for item in legs] == [0, 1, 2]
+        summary = items[-1]['summary']
+        for leg_payload, item in zip(summary['legs'], legs):
+            leg_payload['steps'] = item['steps']
+            assert item['distance_km'] == leg_payload['distance_km']
+            assert item['summary'] == leg_payload['summary']
+        assert json.dumps(summary, ensure_ascii=False) == json.dumps(expected, ensure_ascii=False)
+
+
+def test_iter_route_summary_without_routes():
+    from routing.summary import iter_route_summary
+
+    items = list(iter_route_summary([b'{"code": "NoRoute", "message": "x"}']))
+    assert items == [{'summary': build_route_summary({'routes': []})}]
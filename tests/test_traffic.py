@@ -0,0 +1,196 @@
+"""Тесты конвейера live-traffic routing.traffic."""
+
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import requests
+
+sys.path.append('.')
+
+from routing import traffic
+from routing.graph import Graph
+from routing.metrics import Registry
+from routing.traffic import SegmentAggregator, TrafficPipeline, batched, fetch, normalize
+
+NOW = 1000000.0
+
+
+def _feed(path, lines):
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_normalize_aliases_and_invalid_records():
+    assert normalize({'from': '1', 'to': 2, 'speed_kmh': '40', 'ts': 5}) == (1, 2, 40.0, 5.0)
+    assert normalize({'u': 1, 'v': 2, 'length': 100, 'duration': 10}, now=7) == (1, 2, 36.0, 7)
+    assert normalize({'from_node': 1, 'to_node': 2, 'speed': 0}) is None
+    assert normalize({'from_node': 1, 'to_node': 1, 'speed': 30}) is None
+    assert normalize({'from_node': 'x', 'to_node': 2, 'speed': 30}) is None
+    assert normalize({'from_node': 1, 'to_node': 2, 'length': 10, 'duration': 0}) is None
+
+
+def test_fetch_reads_csv_and_ndjson_files(tmp_path):
+    plain = _feed(tmp_path / 'plain.csv', ['1,2,30,{}'.format(NOW), '# comment', '2,3,abc', '3,4,50'])
+    assert list(fetch(plain, now=NOW)) == [(1, 2, 30.0, NOW), (3, 4, 50.0, NOW)]
+    named = _feed(tmp_path / 'named.csv', ['speed,to,from', '25,2,1'])
+    assert list(fetch(named, now=NOW)) == [(1, 2, 25.0, NOW)]
+    ndjson = _feed(tmp_path / 'feed.ndjson', ['{"from": 5, "to": 6, "speed": 70}', '{broken', '[1, 2]'])
+    assert list(fetch(ndjson, now=NOW)) == [(5, 6, 70.0, NOW)]
+
+
+def test_fetch_directory_moves_processed_files(tmp_path):
+    drop = tmp_path / 'drop'
+    drop.mkdir()
+    _feed(drop / 'a.csv', ['1,2,30'])
+    _feed(drop / 'b.csv', ['2,3,40'])
+    assert sorted(fetch(str(drop), now=NOW)) == [(1, 2, 30.0, NOW), (2, 3, 40.0, NOW)]
+    assert sorted(path.name for path in (drop / 'processed').iterdir()) == ['a.csv', 'b.csv']
+    assert list(fetch(str(drop), now=NOW)) == []
+
+
+def test_fetch_http_streams_lines():
+    response = MagicMock()
+    response.iter_lines.return_value = iter([b'from_node,to_node,speed', b'1,2,45'])
+    with patch('routing.traffic.requests.get', return_value=response) as mock_get:
+        assert list(fetch('http://feed.local/traffic', now=NOW)) == [(1, 2, 45.0, NOW)]
+    assert mock_get.call_args.kwargs['stream'] is True
+    response.close.assert_called_once_with()
+
+
+def test_batched_bounds_batch_size():
+    assert [len(batch) for batch in batched(iter(range(7)), 3)] == [3, 3, 1]
+
+
+def test_aggregator_averages_within_latest_window():
+    aggregator = SegmentAggregator(window=60)
+    aggregator.add([(1, 2, 30.0, 60), (1, 2, 50.0, 100), (3, 4, 20.0, 0)])
+    # Запись из более нового окна вытесняет старое окно, более старая отбрасывается.
+    aggregator.add([(3, 4, 60.0, 70), (3, 4, 10.0, 10)])
+    assert aggregator.snapshot(now=110) == {(1, 2): 40.0, (3, 4): 60.0}
+    assert aggregator.snapshot(now=250) == {}
+    assert len(aggregator) == 0
+
+
+def test_pipeline_publishes_and_rebuilds_only_on_enough_change(tmp_path):
+    feed = tmp_path / 'feed.csv'
+    router = MagicMock()
+    router.rebuild.return_value = {'state': 'running', 'accepted': True}
+    pipeline = TrafficPipeline(str(feed), router=router, output_dir=str(tmp_path / 'out'),
+                               window=300, min_changed=2, speed_delta=5)
+    _feed(feed, ['1,2,30.4', '2,3,40', '3,4,-1'])
+    result = pipeline.run_once(now=NOW)
+    assert result['records'] == 2 and result['changed'] == 2
+    assert result['published'] and result['rebuild'] == 'running'
+    router.rebuild.assert_called_once_with(speed_file=pipeline.speed_file)
+    assert open(pipeline.speed_file).read().split() == ['1,2,30', '2,3,40']
+
+    # Сдвиги меньше порога не считаются изменением, один изменившийся сегмент — мало для перестройки.
+    _feed(feed, ['1,2,32', '2,3,52'])
+    result = pipeline.run_once(now=NOW + 1)
+    assert result['changed'] == 1 and not result['published']
+    assert router.rebuild.call_count == 1
+
+    # Наблюдения одного окна усредняются между циклами: 2 -> 3 даёт (40 + 52 + 52) / 3.
+    _feed(feed, ['1,2,32', '2,3,52', '4,5,60'])
+    assert pipeline.run_once(now=NOW + 2)['published']
+    assert open(pipeline.speed_file).read().split() == ['1,2,31', '2,3,48', '4,5,60']
+    assert router.rebuild.call_count == 2
+
+
+def test_pipeline_retries_changes_when_rebuild_is_busy(tmp_path):
+    feed = _feed(tmp_path / 'feed.csv', ['1,2,30', '2,3,40'])
+    router = MagicMock()
+    router.rebuild.return_value = {'state': 'running', 'accepted': False}
+    pipeline = TrafficPipeline(feed, router=router, output_dir=str(tmp_path), min_changed=2)
+    result = pipeline.run_once(now=NOW)
+    assert result['rebuild'] == 'busy' and not result['published']
+    assert pipeline.published == {}
+    # Перестройка освободилась: те же изменения отправляются снова.
+    router.rebuild.return_value = {'state': 'running', 'accepted': True}
+    result = pipeline.run_once(now=NOW + 1)
+    assert result['changed'] == 2 and result['published'] and result['rebuild'] == 'running'
+    assert router.rebuild.call_count == 2
+
+
+def test_pipeline_applies_changes_to_local_graph(tmp_path):
+    graph = Graph.from_edges(
+        np.array([10, 20, 30]), np.array([30.0, 30.001, 30.002]), np.array([46.0, 46.0, 46.0]),
+        np.array([0, 1, 1]), np.array([1, 2, 0]), np.array([50, 50, 50]), np.array([1, 2, 3])
+    )
+    free = graph.weights.copy()
+    feed = _feed(tmp_path / 'feed.csv', ['10,20,25', '20,30,25', '30,10,5'])
+    pipeline = TrafficPipeline(feed, graph=graph, output_dir=str(tmp_path), min_changed=1)
+    result = pipeline.run_once(now=NOW)
+    forward, onward = graph.find_edges([10, 20], [20, 30])
+    # Ребра 30 -> 10 в графе нет, оно пропускается.
+    assert result['graph_edges'] == 2
+    np.testing.assert_allclose(graph.weights[[forward, onward]], free[[forward, onward]] * 2, rtol=1e-5)
+
+    # Сегмент, пропавший из ленты после окна, возвращается к свободному потоку.
+    _feed(tmp_path / 'feed.csv', ['10,20,25,{}'.format(NOW + 900)])
+    assert pipeline.run_once(now=NOW + 900)['graph_edges'] == 1
+    np.testing.assert_allclose(graph.weights[onward], free[onward], rtol=1e-5)
+    np.testing.assert_allclose(graph.weights[forward], free[forward] * 2, rtol=1e-5)
+
+
+def test_background_worker_runs_on_schedule(tmp_path):
+    feed = _feed(tmp_path / 'feed.csv', ['1,2,30'])
+    pipeline = TrafficPipeline(feed, output_dir=str(tmp_path), interval=0.01, min_changed=1)
+    done = threading.Event()
+    cycles = []
+
+    def cycle():
+        cycles.append(1)
+        if len(cycles) == 3:
+            done.set()
+        return {}
+
+    with patch.object(TrafficPipeline, 'run_once', side_effect=cycle):
+        assert pipeline.start()
+        assert not pipeline.start()
+        assert done.wait(5)
+        pipeline.stop(5)
+    assert not pipeline._thread.is_alive()
+
+
+def test_main_requires_source(capsys):
+    with patch.object(traffic, 'TRAFFIC_SOURCE', ''):
+        assert traffic.main([]) == 2
+    assert 'usage' in capsys.readouterr().out
+
+
+def test_write_speed_file_clamps_to_positive_integers(tmp_path):
+    path = traffic.write_speed_file({(2, 3): 0.3, (1, 2): 44.6}, str(tmp_path / 'x' / 'speeds.csv'))
+    assert open(path).read() == '1,2,45\n2,3,1\n'
+
+
+def test_pipeline_hands_changes_to_scheduler(tmp_path):
+    feed = tmp_path / 'feed.csv'
+    scheduler = MagicMock()
+    router = MagicMock()
+    pipeline = TrafficPipeline(str(feed), router=router, scheduler=scheduler, output_dir=str(tmp_path),
+                               min_changed=50, speed_delta=5)
+    _feed(feed, ['1,2,40', '2,3,40'])
+    assert pipeline.run_once(now=NOW)['rebuild'] == 'scheduled'
+    # Сдвиг 40 -> 60 км/ч за окно: среднее 50, относительный сдвиг 0.25; новый сегмент считается за один.
+    _feed(feed, ['1,2,60', '3,4,30'])
+    pipeline.run_once(now=NOW + 1)
+    magnitudes = [call.args[0] for call in scheduler.record.call_args_list]
+    assert magnitudes == [2.0, 1.25]
+    assert scheduler.record.call_args.kwargs['speed_file'] == pipeline.speed_file
+    router.rebuild.assert_not_called()
+
+
+def test_serve_metrics_exposes_registry():
+    registry = Registry()
+    registry.gauge('osrm_rebuild_pending_updates', 'Очередь').set(3)
+    server = traffic.serve_metrics(registry, 0, '127.0.0.1')
+    try:
+        base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        assert 'osrm_rebuild_pending_updates 3' in requests.get(base + '/metrics', timeout=5).text
+        assert requests.get(base + '/other', timeout=5).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()